@@ -1,2 +1,2 @@
-from . import ndlib
+# ndlib loads the shared C library and declares its function signatures, so it is only imported where it is used
 from . import ndtype
@@ -42,6 +42,10 @@ uint64_t XYZMorton ( uint64_t * );
 // Declaring MortonXYZ zindex function
 void MortonXYZ ( uint64_t , uint64_t [3] );
 
+// Declaring the vectorized XYZMorton and MortonXYZ zindex functions
+void XYZMortonArray ( uint64_t [][3] , uint64_t * , int );
+void MortonXYZArray ( uint64_t * , uint64_t [][3] , int );
+
 // Declaring recolorCube function
 void recolorCubeOMP32 ( uint32_t * , int , int , uint32_t * , uint32_t * );
 void recolorCubeOMP64 ( uint64_t * , int , int , uint64_t * , uint64_t * );
@@ -66,3 +66,59 @@ void MortonXYZ ( uint64_t morton, uint64_t xyz[3] )
     morton >>= 3;
   }
 }
+
+// Spread the low 21 bits of a value so there are two zero bits between each bit
+
+static inline uint64_t splitBy3 ( uint64_t a )
+{
+  uint64_t x = a & 0x1fffff;
+
+  x = ( x | x << 32 ) & 0x1f00000000ffff;
+  x = ( x | x << 16 ) & 0x1f0000ff0000ff;
+  x = ( x | x << 8 ) & 0x100f00f00f00f00f;
+  x = ( x | x << 4 ) & 0x10c30c30c30c30c3;
+  x = ( x | x << 2 ) & 0x1249249249249249;
+
+  return x;
+}
+
+// Gather every third bit of a value back into the low 21 bits
+
+static inline uint64_t compactBy3 ( uint64_t a )
+{
+  uint64_t x = a & 0x1249249249249249;
+
+  x = ( x ^ ( x >> 2 ) ) & 0x10c30c30c30c30c3;
+  x = ( x ^ ( x >> 4 ) ) & 0x100f00f00f00f00f;
+  x = ( x ^ ( x >> 8 ) ) & 0x1f0000ff0000ff;
+  x = ( x ^ ( x >> 16 ) ) & 0x1f00000000ffff;
+  x = ( x ^ ( x >> 32 ) ) & 0x1fffff;
+
+  return x;
+}
+
+// Generate morton order for an array of XYZ coordinates
+
+void XYZMortonArray ( uint64_t xyz[][3], uint64_t * morton, int size )
+{
+  int i;
+
+  for ( i=0; i<size; i++ )
+  {
+    morton[i] = splitBy3 ( xyz[i][0] ) | ( splitBy3 ( xyz[i][1] ) << 1 ) | ( splitBy3 ( xyz[i][2] ) << 2 );
+  }
+}
+
+// Generate XYZ coordinates for an array of Morton indices
+
+void MortonXYZArray ( uint64_t * morton, uint64_t xyz[][3], int size )
+{
+  int i;
+
+  for ( i=0; i<size; i++ )
+  {
+    xyz[i][0] = compactBy3 ( morton[i] );
+    xyz[i][1] = compactBy3 ( morton[i] >> 1 );
+    xyz[i][2] = compactBy3 ( morton[i] >> 2 );
+  }
+}
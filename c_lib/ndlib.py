@@ -53,6 +53,8 @@ ndlib_ctypes.annotateCube.argtypes = [array_1d_uint32, cp.c_int, cp.POINTER(cp.c
                                       array_2d_uint32, cp.c_int, cp.c_char, array_2d_uint32]
 ndlib_ctypes.XYZMorton.argtypes = [array_1d_uint64]
 ndlib_ctypes.MortonXYZ.argtypes = [npct.ctypes.c_int64, array_1d_uint64]
+ndlib_ctypes.XYZMortonArray.argtypes = [array_2d_uint64, array_1d_uint64, cp.c_int]
+ndlib_ctypes.MortonXYZArray.argtypes = [array_1d_uint64, array_2d_uint64, cp.c_int]
 ndlib_ctypes.recolorCubeOMP32.argtypes = [ array_2d_uint32, cp.c_int, cp.c_int, array_2d_uint32, array_1d_uint32 ]
 ndlib_ctypes.recolorCubeOMP64.argtypes = [ array_2d_uint64, cp.c_int, cp.c_int, array_2d_uint64, array_1d_uint64 ]
 ndlib_ctypes.quicksort.argtypes = [array_2d_uint64, cp.c_int]
@@ -90,6 +92,8 @@ ndlib_ctypes.locateCube.restype = None
 ndlib_ctypes.annotateCube.restype = cp.c_int
 ndlib_ctypes.XYZMorton.restype = npct.ctypes.c_uint64
 ndlib_ctypes.MortonXYZ.restype = None
+ndlib_ctypes.XYZMortonArray.restype = None
+ndlib_ctypes.MortonXYZArray.restype = None
 ndlib_ctypes.recolorCubeOMP32.restype = None
 ndlib_ctypes.recolorCubeOMP64.restype = None
 ndlib_ctypes.quicksort.restype = None
@@ -236,6 +240,42 @@ def MortonXYZ(morton):
     return [i for i in cubeoff]
 
 
+def XYZMorton_array(xyz):
+    """ Get morton order for many XYZ coordinates in a single call
+
+    Args:
+        xyz (numpy.Array): Array of cuboid indices, uint64[N][3], in the x, y, z dimensions.
+
+    Returns:
+        (numpy.Array): uint64[N] array of morton ids, in the same order as the input.
+    """
+    xyz = np.ascontiguousarray(xyz, dtype=np.uint64).reshape(-1, 3)
+    morton = np.zeros(len(xyz), dtype=np.uint64)
+
+    # Calling the C native function
+    ndlib_ctypes.XYZMortonArray(xyz, morton, cp.c_int(len(xyz)))
+
+    return morton
+
+
+def MortonXYZ_array(morton):
+    """ Get XYZ indices for many Morton ids in a single call
+
+    Args:
+        morton (numpy.Array): Array of morton ids, uint64[N].
+
+    Returns:
+        (numpy.Array): uint64[N][3] array of cuboid indices in the x, y, z dimensions.
+    """
+    morton = np.ascontiguousarray(morton, dtype=np.uint64).ravel()
+    xyz = np.zeros((len(morton), 3), dtype=np.uint64)
+
+    # Calling the C native function
+    ndlib_ctypes.MortonXYZArray(morton, xyz, cp.c_int(len(morton)))
+
+    return xyz
+
+
 def recolor_ctype(cutout, imagemap):
     """ Annotation recoloring function """
 
@@ -0,0 +1,74 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import numpy as np
+
+from spdb.c_lib.ndlib import XYZMorton, MortonXYZ, XYZMorton_array, MortonXYZ_array
+
+# Morton ids interleave 21 bits from each of x, y and z
+MAX_COORD = 2 ** 21 - 1
+
+
+class TestMorton(unittest.TestCase):
+
+    def setUp(self):
+        self.xyz = np.array([[0, 0, 0],
+                             [1, 0, 0],
+                             [0, 1, 0],
+                             [0, 0, 1],
+                             [2, 1, 3],
+                             [6, 7, 5],
+                             [1000, 20, 3456],
+                             [MAX_COORD, 0, 0],
+                             [0, MAX_COORD, 0],
+                             [0, 0, MAX_COORD],
+                             [MAX_COORD, MAX_COORD, MAX_COORD]], dtype=np.uint64)
+
+    def test_xyz_morton_array(self):
+        """Test the array version matches the scalar version"""
+        expected = [XYZMorton(xyz.tolist()) for xyz in self.xyz]
+
+        actual = XYZMorton_array(self.xyz)
+
+        self.assertEqual(actual.dtype, np.uint64)
+        self.assertEqual(actual.tolist(), expected)
+        self.assertEqual(actual[-1], 2 ** 63 - 1)
+
+    def test_morton_xyz_array(self):
+        """Test the array version matches the scalar version"""
+        mortons = np.array([XYZMorton(xyz.tolist()) for xyz in self.xyz], dtype=np.uint64)
+        expected = [[int(i) for i in MortonXYZ(morton)] for morton in mortons]
+
+        actual = MortonXYZ_array(mortons)
+
+        self.assertEqual(actual.dtype, np.uint64)
+        self.assertEqual(actual.tolist(), expected)
+        self.assertEqual(actual.tolist(), self.xyz.tolist())
+
+    def test_morton_array_empty(self):
+        """Test empty input gives empty output"""
+        mortons = XYZMorton_array(np.zeros((0, 3), dtype=np.uint64))
+        self.assertEqual(mortons.shape, (0,))
+        self.assertEqual(mortons.dtype, np.uint64)
+
+        xyz = MortonXYZ_array(np.zeros(0, dtype=np.uint64))
+        self.assertEqual(xyz.shape, (0, 3))
+        self.assertEqual(xyz.dtype, np.uint64)
+
+    def test_morton_array_list_input(self):
+        """Test python lists are accepted"""
+        self.assertEqual(XYZMorton_array([[2, 1, 3]]).tolist(), [XYZMorton([2, 1, 3])])
+        self.assertEqual(MortonXYZ_array([XYZMorton([2, 1, 3])]).tolist(), [[2, 1, 3]])
@@ -47,6 +47,7 @@ class BossResourceBasic(BossResource):
         self.data = json.loads(json_str)
         self._boss_key = self.data['boss_key']
         self._lookup_key = self.data['lookup_key']
+        self._reset_memoized()
 
     def from_dict(self, dict_data):
         """
@@ -61,6 +62,7 @@ class BossResourceBasic(BossResource):
         self.data = dict_data
         self._boss_key = self.data['boss_key']
         self._lookup_key = self.data['lookup_key']
+        self._reset_memoized()
 
     # Methods to populate class properties
     def populate_collection(self):
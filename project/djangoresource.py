@@ -31,32 +31,6 @@ class BossResourceDjango(BossResource):
 
         self.boss_request = boss_request
 
-    def to_dict(self):
-        """
-        Method to convert a resource to a dictionary
-        Returns:
-            (dict): a dict of all the parameters
-        """
-        # Populate everything
-        self.populate_collection()
-        self.populate_coord_frame()
-        self.populate_experiment()
-        self.populate_channel()
-        self.populate_boss_key()
-        self.populate_lookup_key()
-
-        # Collect Data
-        data = {"collection": self._collection.__dict__,
-                "coord_frame": self._coord_frame.__dict__,
-                "experiment": self._experiment.__dict__,
-                "channel": self._channel.__dict__,
-                "boss_key": self._boss_key,
-                "lookup_key": self._lookup_key,
-                }
-
-        # Serialize and return
-        return data
-
     # Methods to populate class properties
     def populate_collection(self):
         """
@@ -280,6 +280,11 @@ class BossResource(metaclass=ABCMeta):
       _boss_key (str): The unique, plain text key identifying the resource - used to query for the lookup key
       _lookup_key (str): The unique key identifying the resource that enables renaming resources and physically used to
       ID data in databases
+      _dict (dict): Memoized result of to_dict()
+      _json (str): Memoized result of to_json()
+      _isotropic_level (int): Memoized result of get_isotropic_level()
+      _downsampled_voxel_dims (dict): Memoized results of get_downsampled_voxel_dims(), keyed by iso
+      _downsampled_extent_dims (dict): Memoized results of get_downsampled_extent_dims(), keyed by iso
     """
     def __init__(self):
         self._collection = None
@@ -289,6 +294,19 @@ class BossResource(metaclass=ABCMeta):
         self._boss_key = None
         self._lookup_key = None
 
+        # A resource doesn't change once populated, so serialized forms and derived values are only computed once
+        self._reset_memoized()
+
+    def _reset_memoized(self):
+        """
+        Method to clear memoized serialized forms and derived values. Must be called if the resource is re-populated
+        """
+        self._dict = None
+        self._json = None
+        self._isotropic_level = None
+        self._downsampled_voxel_dims = {}
+        self._downsampled_extent_dims = {}
+
     def to_json(self):
         """
         Method to serialize a resource to a JSON object
@@ -296,33 +314,35 @@ class BossResource(metaclass=ABCMeta):
             (str): a JSON encoded string
         """
         # Serialize and return
-        return json.dumps(self.to_dict())
+        if self._json is None:
+            self._json = json.dumps(self.to_dict())
+        return self._json
 
     def to_dict(self):
         """
         Method to convert a resource to a dictionary
         Returns:
-            (dict): a dict of all the parameters
-        """
-        # Populate everything
-        self.populate_collection()
-        self.populate_coord_frame()
-        self.populate_experiment()
-        self.populate_channel()
-        self.populate_boss_key()
-        self.populate_lookup_key()
-
-        # Collect Data
-        data = {"collection": self._collection.__dict__,
-                "coord_frame": self._coord_frame.__dict__,
-                "experiment": self._experiment.__dict__,
-                "channel": self._channel.__dict__,
-                "boss_key": self._boss_key,
-                "lookup_key": self._lookup_key,
-                }
+            (dict): a dict of all the parameters. Shared between calls, so must not be modified
+        """
+        if self._dict is None:
+            # Populate everything
+            self.populate_collection()
+            self.populate_coord_frame()
+            self.populate_experiment()
+            self.populate_channel()
+            self.populate_boss_key()
+            self.populate_lookup_key()
 
-        # Serialize and return
-        return data
+            # Collect Data
+            self._dict = {"collection": self._collection.__dict__,
+                          "coord_frame": self._coord_frame.__dict__,
+                          "experiment": self._experiment.__dict__,
+                          "channel": self._channel.__dict__,
+                          "boss_key": self._boss_key,
+                          "lookup_key": self._lookup_key,
+                          }
+
+        return self._dict
 
     # Methods to populate class properties
     @abstractmethod
@@ -505,16 +525,18 @@ class BossResource(metaclass=ABCMeta):
         Returns:
             int
         """
-        if not self._coord_frame:
-            self.populate_coord_frame()
+        if self._isotropic_level is None:
+            if not self._coord_frame:
+                self.populate_coord_frame()
 
-        if not self._experiment:
-            self.populate_experiment()
+            if not self._experiment:
+                self.populate_experiment()
 
-        return get_isotropic_level(self._experiment.hierarchy_method,
-                                   self._coord_frame.x_voxel_size,
-                                   self._coord_frame.y_voxel_size,
-                                   self._coord_frame.z_voxel_size)
+            self._isotropic_level = get_isotropic_level(self._experiment.hierarchy_method,
+                                                        self._coord_frame.x_voxel_size,
+                                                        self._coord_frame.y_voxel_size,
+                                                        self._coord_frame.z_voxel_size)
+        return self._isotropic_level
 
     def get_downsampled_voxel_dims(self, iso=False):
         """Method to return a list, mapping resolution levels to voxel dimensions
@@ -523,21 +545,23 @@ class BossResource(metaclass=ABCMeta):
             iso(bool): If requesting isotropic dimensions (for anisotropic channels)
 
         Returns:
-            (dict)
+            (dict): Shared between calls, so must not be modified
         """
-        if not self._coord_frame:
-            self.populate_coord_frame()
+        if iso not in self._downsampled_voxel_dims:
+            if not self._coord_frame:
+                self.populate_coord_frame()
 
-        if not self._experiment:
-            self.populate_experiment()
+            if not self._experiment:
+                self.populate_experiment()
 
-        return get_downsampled_voxel_dims(self._experiment.num_hierarchy_levels,
-                                          self.get_isotropic_level(),
-                                          self._experiment.hierarchy_method,
-                                          self._coord_frame.x_voxel_size,
-                                          self._coord_frame.y_voxel_size,
-                                          self._coord_frame.z_voxel_size,
-                                          iso)
+            self._downsampled_voxel_dims[iso] = get_downsampled_voxel_dims(self._experiment.num_hierarchy_levels,
+                                                                           self.get_isotropic_level(),
+                                                                           self._experiment.hierarchy_method,
+                                                                           self._coord_frame.x_voxel_size,
+                                                                           self._coord_frame.y_voxel_size,
+                                                                           self._coord_frame.z_voxel_size,
+                                                                           iso)
+        return self._downsampled_voxel_dims[iso]
 
     def get_downsampled_extent_dims(self, iso=False):
         """Method to return a list, mapping resolution levels to extent dimensions
@@ -546,18 +570,20 @@ class BossResource(metaclass=ABCMeta):
             iso(bool): If requesting isotropic dimensions (for anisotropic channels)
 
         Returns:
-            (dict)
-        """
-        if not self._coord_frame:
-            self.populate_coord_frame()
-
-        if not self._experiment:
-            self.populate_experiment()
-
-        return get_downsampled_extent_dims(self._experiment.num_hierarchy_levels,
-                                           self.get_isotropic_level(),
-                                           self._experiment.hierarchy_method,
-                                           self._coord_frame.x_stop,
-                                           self._coord_frame.y_stop,
-                                           self._coord_frame.z_stop,
-                                           iso)
+            (dict): Shared between calls, so must not be modified
+        """
+        if iso not in self._downsampled_extent_dims:
+            if not self._coord_frame:
+                self.populate_coord_frame()
+
+            if not self._experiment:
+                self.populate_experiment()
+
+            self._downsampled_extent_dims[iso] = get_downsampled_extent_dims(self._experiment.num_hierarchy_levels,
+                                                                             self.get_isotropic_level(),
+                                                                             self._experiment.hierarchy_method,
+                                                                             self._coord_frame.x_stop,
+                                                                             self._coord_frame.y_stop,
+                                                                             self._coord_frame.z_stop,
+                                                                             iso)
+        return self._downsampled_extent_dims[iso]
@@ -481,6 +481,26 @@ class TestBasicResource(unittest.TestCase):
         assert resource2.get_lookup_key() == setup_data['lookup_key']
         assert resource2.get_boss_key() == setup_data['boss_key']
 
+    def test_basic_resource_memoized(self):
+        """Test serialized forms and derived values are computed once, and reset when re-populated
+
+        Returns:
+            None
+
+        """
+        resource = BossResourceBasic(get_image_dict())
+
+        assert resource.to_dict() is resource.to_dict()
+        assert resource.to_json() is resource.to_json()
+        assert resource.get_downsampled_voxel_dims() is resource.get_downsampled_voxel_dims()
+        assert resource.get_downsampled_extent_dims(iso=True) is resource.get_downsampled_extent_dims(iso=True)
+        self.assertEqual(resource.get_isotropic_level(), resource.get_isotropic_level())
+
+        data = get_image_dict()
+        data['lookup_key'] = '5&6&7'
+        resource.from_dict(data)
+        assert json.loads(resource.to_json())['lookup_key'] == '5&6&7'
+
     def test_basic_resource_get_iso_level_anisotropic(self):
         """Test get iso level anisotropic
 
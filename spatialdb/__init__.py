@@ -1,10 +1,36 @@
-from .error import SpdbError, ErrorCodes
-from .kvio import KVIO
-from .cube import Cube
-from .imagecube import ImageCube8, ImageCube16
-from .annocube import AnnotateCube64
-from .rediskvio import RedisKVIO
-from .spatialdb import SpatialDB
-from .state import CacheStateDB
-from .object import AWSObjectStore
-from .region import Region
+import importlib
+
+# Names exported by the package and the submodule each is defined in. Submodules are only imported when a name is
+# first accessed, so a client that only needs part of the package (e.g. key conversion in spdb.spatialdb.object)
+# doesn't pay to import boto3, redis, blosc, PIL and ndlib
+_EXPORTS = {
+    "SpdbError": ".error",
+    "ErrorCodes": ".error",
+    "KVIO": ".kvio",
+    "Cube": ".cube",
+    "ImageCube8": ".imagecube",
+    "ImageCube16": ".imagecube",
+    "AnnotateCube64": ".annocube",
+    "RedisKVIO": ".rediskvio",
+    "SpatialDB": ".spatialdb",
+    "CacheStateDB": ".state",
+    "AWSObjectStore": ".object",
+    "Region": ".region",
+    "CuboidCache": ".cuboidcache",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    """Import an exported name's submodule on first access"""
+    if name not in _EXPORTS:
+        raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
+
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
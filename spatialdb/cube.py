@@ -14,6 +14,7 @@
 # limitations under the License.
 import numpy as np
 import blosc
+import struct
 from PIL import Image
 
 from abc import ABCMeta, abstractmethod
@@ -201,6 +202,54 @@ class Cube(metaclass=ABCMeta):
 
         return data_mat
 
+    @staticmethod
+    def unpack_array_into(data, out, staging=None, shape=None, sub_box=None):
+        """Method to uncompress blosc compressed data directly into an existing array
+
+        out is typically a view into a larger array (e.g. a cuboid's slice of a cutout). If it is C contiguous the data
+        is decompressed in place, otherwise it is decompressed into a contiguous staging buffer and copied in with a
+        single strided copy.
+
+        If only part of the compressed array is needed, provide its full shape and the sub_box to copy into out.
+
+        Args:
+            data (bytes): The blosc compressed data
+            out (np.ndarray): The array to populate. Must match the size of the uncompressed data (or the sub_box)
+            staging (np.ndarray): Optional uint8 staging buffer to reuse across calls
+            shape (tuple(int)): Optional shape of the compressed array, required if sub_box is provided
+            sub_box (tuple(slice)): Optional region of the compressed array to copy into out
+
+        Returns:
+            (np.ndarray): The staging buffer, which can be passed into the next call
+        """
+        if sub_box is None:
+            shape = out.shape
+        expected_nbytes = int(np.prod(shape)) * out.dtype.itemsize
+
+        # Size of the uncompressed data is stored in the blosc header, little endian uint32 at offset 4
+        if len(data) < 16:
+            raise SpdbError("Failed to decompress cube. Data is not a blosc buffer.",
+                            ErrorCodes.SERIALIZATION_ERROR)
+        nbytes = struct.unpack_from('<I', data, 4)[0]
+        if nbytes != expected_nbytes:
+            raise SpdbError("Failed to decompress cube. Expected {} bytes but data contains {} bytes.".format(
+                expected_nbytes, nbytes), ErrorCodes.SERIALIZATION_ERROR)
+
+        try:
+            if sub_box is None and out.flags['C_CONTIGUOUS'] and out.flags['WRITEABLE']:
+                blosc.decompress_ptr(data, out.ctypes.data)
+            else:
+                if staging is None or staging.size < nbytes:
+                    staging = np.empty(nbytes, dtype=np.uint8)
+                staged = staging[:nbytes].view(out.dtype).reshape(shape)
+                blosc.decompress_ptr(data, staged.ctypes.data)
+                np.copyto(out, staged if sub_box is None else staged[sub_box])
+        except Exception as e:
+            raise SpdbError("Failed to decompress cube. {}".format(e),
+                            ErrorCodes.SERIALIZATION_ERROR)
+
+        return staging
+
     def from_blosc(self, byte_arrays, time_sample_range=None):
         # TODO: Conditional properties of this method are challenging for the developer. break into multiple methods
         """Uncompress and populate Cube data from a Blosc serialized and compressed byte array using the numpy interface
@@ -0,0 +1,143 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+import threading
+
+
+class CuboidCache(object):
+    """
+    An in-process LRU cache of decompressed cuboids, bounded by the total number of bytes held
+
+    Entries are keyed by cached-cuboid key and tagged with the cuboid's version stamp from the cache database. A
+    lookup only hits if the stamp matches, so any change to the cuboid in the cache database invalidates the entry.
+
+    Cached arrays are marked read-only since they are shared between requests.
+
+    Args:
+        max_bytes (int): Max number of bytes of cuboid data to hold
+
+    Attributes:
+        max_bytes (int): Max number of bytes of cuboid data to hold
+        size_bytes (int): Number of bytes of cuboid data currently held
+        hits (int): Number of lookups that returned a cuboid
+        misses (int): Number of lookups that did not return a cuboid
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls, max_bytes):
+        """Get the process wide cache, creating it on first use
+
+        Args:
+            max_bytes (int): Max number of bytes of cuboid data to hold. Resizes the cache if it already exists
+
+        Returns:
+            (CuboidCache)
+        """
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls(max_bytes)
+            elif cls._instance.max_bytes != max_bytes:
+                cls._instance.resize(max_bytes)
+
+        return cls._instance
+
+    def get(self, key, version):
+        """Get a cuboid if it is cached at the given version
+
+        Args:
+            key (str): cached-cuboid key
+            version (str): The cuboid's current version stamp. None never hits
+
+        Returns:
+            (np.ndarray): The read-only cuboid data or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if version is None or entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, data):
+        """Add a cuboid to the cache, evicting the least recently used cuboids as needed
+
+        Args:
+            key (str): cached-cuboid key
+            version (str): The cuboid's version stamp the data corresponds to. None is not cached
+            data (np.ndarray): The cuboid data. Marked read-only and must not be modified afterwards
+
+        Returns:
+            None
+        """
+        if version is None or data.nbytes > self.max_bytes:
+            return
+
+        data.flags.writeable = False
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size_bytes -= old[1].nbytes
+
+            self._entries[key] = (version, data)
+            self.size_bytes += data.nbytes
+            self._evict()
+
+    def resize(self, max_bytes):
+        """Change the max number of bytes held, evicting cuboids as needed
+
+        Args:
+            max_bytes (int): Max number of bytes of cuboid data to hold
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        """Remove all cuboids and reset the counters
+
+        Returns:
+            None
+        """
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def _evict(self):
+        """Remove least recently used cuboids until within budget. Must hold the lock"""
+        while self.size_bytes > self.max_bytes and self._entries:
+            _, (_, data) = self._entries.popitem(last=False)
+            self.size_bytes -= data.nbytes
+
+    def __len__(self):
+        return len(self._entries)
@@ -12,7 +12,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from bossutils.logger import BossLogger
 from enum import IntEnum
 
 
@@ -58,6 +57,7 @@ class SpdbError(Exception):
         # Log
         # TODO: Look into removing boss logger dependency
         if len(args) > 1:
+            from bossutils.logger import BossLogger
             blog = BossLogger().logger
             blog.error("SpdbError - Message: {0} - Code: {1}".format(args[0], args[1]))
             self.message = args[0]
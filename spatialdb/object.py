@@ -13,19 +13,28 @@
 # limitations under the License.
 
 from abc import ABCMeta, abstractmethod
-import boto3
 import collections
+from concurrent.futures import ThreadPoolExecutor
 import json
 import hashlib
 import numpy as np
+import random
+import threading
+import time
 from .error import SpdbError, ErrorCodes
-from .object_indices import ObjectIndices
-from .region import Region
-from spdb.c_lib.ndlib import XYZMorton
 
-from bossutils.aws import get_region
+# boto3, bossutils, ndlib and the object indices are imported on first use, so clients only converting keys (e.g. the
+# page in and page out lambdas) don't pay to import them
 
-import boto3
+
+def get_region():
+    """Get the AWS region this is running in
+
+    Returns:
+        (str)
+    """
+    from bossutils.aws import get_region as get_aws_region
+    return get_aws_region()
 
 
 class ObjectStore(metaclass=ABCMeta):
@@ -136,6 +145,20 @@ class ObjectStore(metaclass=ABCMeta):
             None
         """
 
+    @abstractmethod
+    def trigger_page_out_batch(self, config_data, write_cuboid_keys, resource):
+        """
+        Method to trigger page outs of multiple write-cuboids to the object storage system
+
+        Args:
+            config_data (dict): Dictionary of configuration information
+            write_cuboid_keys (list(str)): Unique write-cuboids to be flushed to S3
+            resource (spdb.project.resource.BossResource): resource for the given write cuboid keys
+
+        Returns:
+            None
+        """
+
     @abstractmethod
     def get_loose_bounding_box(self, resource, resolution, id):
         """
@@ -204,6 +227,24 @@ class ObjectStore(metaclass=ABCMeta):
 
 
 class AWSObjectStore(ObjectStore):
+    # Max number of keys in a single DynamoDB BatchGetItem request
+    DYNAMODB_BATCH_GET_SIZE = 100
+
+    # Number of attempts to read keys DynamoDB left unprocessed before giving up
+    DYNAMODB_MAX_RETRIES = 7
+
+    # Max number of messages and total payload bytes in a single SQS SendMessageBatch request
+    SQS_BATCH_SIZE = 10
+    SQS_BATCH_BYTES = 256 * 1024
+
+    # Default number of write-cuboid keys in a single page out message and lambda invocation. Single key messages use
+    # the original "write_cuboid_key" format, so batching stays off until the s3_flush lambda reads "write_cuboid_keys"
+    PAGE_OUT_KEYS_PER_INVOKE = 1
+
+    # Default number of object keys paged in by a single page in lambda invocation. Single key invocations use the
+    # original "object_key" payload, so batching stays off until the page in lambda reads "object_keys"
+    PAGE_IN_KEYS_PER_INVOKE = 1
+
     def __init__(self, conf):
         """
         A class to implement the object store for cuboid storage using AWS (using S3 and DynamoDB)
@@ -220,11 +261,141 @@ class AWSObjectStore(ObjectStore):
             s3_index_table: name of the dynamoDB table for storing the s3 cuboid index
             id_index_table: name of DynamoDB table that maps object ids to cuboid object keys
             id_count_table: name of DynamoDB table that reserves objects ids for channels
+            s3_max_concurrency: Optional max number of concurrent S3 requests made when getting or putting multiple
+                                objects (defaults to 16)
+            page_out_keys_per_invoke: Optional max number of write-cuboid keys flushed by a single page out lambda
+                                      invocation (defaults to 1). Only set above 1 if the s3_flush lambda supports
+                                      "write_cuboid_keys" messages
+            page_out_executor: Optional callable that is given each page out message instead of sending it to SQS
+                               and lambda, e.g. spdb.spatialdb.test.pageout.LocalPageOutExecutor for testing
+            page_in_keys_per_invoke: Optional max number of object keys paged in by a single page in lambda
+                                     invocation (defaults to 1). Only set above 1 if the page in lambda supports
+                                     "object_keys" payloads
         """
         # call the base class constructor
         ObjectStore.__init__(self, conf)
-        self.obj_ind = ObjectIndices(
-            conf['s3_index_table'], conf['id_index_table'], conf['id_count_table'], get_region())
+
+        # Object indices (and their DynamoDB client) are created on first use
+        self._obj_ind = None
+
+        self.s3_max_concurrency = conf.get('s3_max_concurrency', 16)
+        self.page_out_keys_per_invoke = conf.get('page_out_keys_per_invoke', self.PAGE_OUT_KEYS_PER_INVOKE)
+        self.page_out_executor = conf.get('page_out_executor')
+        self.page_in_keys_per_invoke = conf.get('page_in_keys_per_invoke', self.PAGE_IN_KEYS_PER_INVOKE)
+
+        # S3 client is created on first use and shared (boto3 clients are thread safe)
+        self._s3_client = None
+        self._s3_client_lock = threading.Lock()
+
+    @property
+    def obj_ind(self):
+        """The object indices, created on first use
+
+        Returns:
+            (spdb.spatialdb.object_indices.ObjectIndices)
+        """
+        if self._obj_ind is None:
+            from .object_indices import ObjectIndices
+            self._obj_ind = ObjectIndices(self.config['s3_index_table'], self.config['id_index_table'],
+                                          self.config['id_count_table'], get_region())
+
+        return self._obj_ind
+
+    def _get_s3_client(self):
+        """Method to get the S3 client, sized so every concurrent request gets a pooled connection
+
+        Returns:
+            (botocore.client.S3)
+        """
+        if self._s3_client is None:
+            with self._s3_client_lock:
+                if self._s3_client is None:
+                    import boto3
+                    from botocore.config import Config
+                    config = Config(max_pool_connections=max(10, self.s3_max_concurrency))
+                    self._s3_client = boto3.session.Session().client('s3', region_name=get_region(), config=config)
+
+        return self._s3_client
+
+    def _run_requests(self, fcn, key_list, args_list, error_msg):
+        """Method to run an AWS request for each key (or batch of keys) with bounded concurrency
+
+        Args:
+            fcn (function): function to call for each key, called as fcn(*args)
+            key_list (list): A list of object keys (or batches of keys), used for error reporting
+            args_list (list(tuple)): Arguments to call fcn with for each key
+            error_msg (str): Message used if any of the requests fail
+
+        Returns:
+            (list): The result for each key, in the same order as key_list
+
+        Raises:
+            (SpdbError): Listing every key that failed, after all requests have completed
+        """
+        if len(args_list) <= 1 or self.s3_max_concurrency <= 1:
+            outcomes = []
+            for args in args_list:
+                try:
+                    outcomes.append((fcn(*args), None))
+                except Exception as e:
+                    outcomes.append((None, e))
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.s3_max_concurrency, len(args_list))) as executor:
+                futures = [executor.submit(fcn, *args) for args in args_list]
+            outcomes = [(f.result(), None) if not f.exception() else (None, f.exception()) for f in futures]
+
+        failed = ["{} ({})".format(key, e) for key, (_, e) in zip(key_list, outcomes) if e is not None]
+        if failed:
+            raise SpdbError("{} {} of {} failed: {}".format(error_msg, len(failed), len(key_list), ", ".join(failed)),
+                            ErrorCodes.OBJECT_STORE_ERROR)
+
+        return [result for result, _ in outcomes]
+
+    def _get_object(self, key, version):
+        """Method to read a single object from S3
+
+        Args:
+            key (str): An object key to retrieve from the object store
+            version (int): The ID of the version node
+
+        Returns:
+            (bytes): blosc compressed cuboid data
+        """
+        # Append version to key
+        key = "{}&{}".format(key, version)
+
+        response = self._get_s3_client().get_object(
+            Key=key,
+            Bucket=self.config["cuboid_bucket"],
+        )
+        if response['ResponseMetadata']['HTTPStatusCode'] != 200:
+            raise SpdbError("Error reading cuboid from S3.",
+                            ErrorCodes.OBJECT_STORE_ERROR)
+
+        return response['Body'].read()
+
+    def _put_object(self, key, cube, version):
+        """Method to write a single object to S3
+
+        Args:
+            key (str): An object key to put into the object store
+            cube (bytes): blosc compressed cuboid data
+            version (int): The ID of the version node
+
+        Returns:
+            None
+        """
+        # Append version to key
+        key = "{}&{}".format(key, version)
+
+        response = self._get_s3_client().put_object(
+            Body=cube,
+            Key=key,
+            Bucket=self.config["cuboid_bucket"],
+        )
+        if response['ResponseMetadata']['HTTPStatusCode'] != 200:
+            raise SpdbError("Error writing cuboid to S3.",
+                            ErrorCodes.OBJECT_STORE_ERROR)
 
     @staticmethod
     def object_key_chunks(object_keys, chunk_size):
@@ -232,6 +403,32 @@ class AWSObjectStore(ObjectStore):
         for ii in range(0, len(object_keys), chunk_size):
             yield object_keys[ii:ii + chunk_size]
 
+    @classmethod
+    def sqs_batches(cls, payloads):
+        """Yield successive batches of payloads that fit in a single SQS SendMessageBatch request
+
+        A batch holds at most SQS_BATCH_SIZE messages totalling at most SQS_BATCH_BYTES bytes
+
+        Args:
+            payloads (list(str)): The message bodies
+
+        Returns:
+            (generator): Lists of message bodies
+        """
+        batch = []
+        batch_bytes = 0
+        for payload in payloads:
+            payload_bytes = len(payload.encode())
+            if batch and (len(batch) == cls.SQS_BATCH_SIZE or batch_bytes + payload_bytes > cls.SQS_BATCH_BYTES):
+                yield batch
+                batch = []
+                batch_bytes = 0
+            batch.append(payload)
+            batch_bytes += payload_bytes
+
+        if batch:
+            yield batch
+
     @staticmethod
     def get_object_key_parts(object_key):
         """
@@ -297,6 +494,8 @@ class AWSObjectStore(ObjectStore):
         """
         Method to check if cuboids exist in S3 by checking the S3 Index table.
 
+        Keys are checked with BatchGetItem, 100 keys per request, with requests issued concurrently.
+
         Currently versioning is not implemented, so a version of "a" is simply used
 
         Args:
@@ -312,31 +511,69 @@ class AWSObjectStore(ObjectStore):
         """
         if not cache_miss_key_idx:
             cache_miss_key_idx = range(0, len(key_list))
+        cache_miss_key_idx = sorted(set(cache_miss_key_idx))
 
-        object_keys = self.cached_cuboid_to_object_keys(key_list)
+        object_keys = self.cached_cuboid_to_object_keys([key_list[idx] for idx in cache_miss_key_idx])
+
+        # Only need to look up each unique key once
+        unique_keys = list(collections.OrderedDict.fromkeys(object_keys))
+        batches = list(self.object_key_chunks(unique_keys, self.DYNAMODB_BATCH_GET_SIZE))
 
-        # TODO: Should use batch read to speed up
+        import boto3
         dynamodb = boto3.client('dynamodb', region_name=get_region())
+        results = self._run_requests(self._batch_get_index_keys, batches,
+                                     [(dynamodb, batch, version) for batch in batches],
+                                     "Error checking cuboids in S3 index.")
+        found_keys = set().union(*results)
 
         s3_key_index = []
         zero_key_index = []
-        for idx, key in enumerate(object_keys):
-            if idx not in cache_miss_key_idx:
-                continue
-            response = dynamodb.get_item(
-                TableName=self.config['s3_index_table'],
-                Key={'object-key': {'S': key}, 'version-node': {'N': "{}".format(version)}},
-                ConsistentRead=True,
-                ReturnConsumedCapacity='NONE')
-
-            if "Item" not in response:
+        for idx, key in zip(cache_miss_key_idx, object_keys):
+            if key in found_keys:
+                s3_key_index.append(idx)
+            else:
                 # Item not in S3
                 zero_key_index.append(idx)
-            else:
-                s3_key_index.append(idx)
 
         return s3_key_index, zero_key_index
 
+    def _batch_get_index_keys(self, dynamodb, object_keys, version):
+        """Method to look up a batch of up to 100 object keys in the S3 index table
+
+        Unprocessed keys are retried with exponential backoff.
+
+        Args:
+            dynamodb (botocore.client.DynamoDB): DynamoDB client to use
+            object_keys (list(str)): A list of object keys
+            version (int): The ID of the version node
+
+        Returns:
+            (set(str)): The object keys that exist in the S3 index table
+        """
+        table = self.config['s3_index_table']
+        request = {table: {'Keys': [{'object-key': {'S': key}, 'version-node': {'N': "{}".format(version)}}
+                                    for key in object_keys],
+                           'ConsistentRead': True,
+                           'ProjectionExpression': '#objkey',
+                           'ExpressionAttributeNames': {'#objkey': 'object-key'}}}
+
+        found_keys = set()
+        for backoff in range(0, self.DYNAMODB_MAX_RETRIES):
+            response = dynamodb.batch_get_item(RequestItems=request, ReturnConsumedCapacity='NONE')
+
+            for item in response['Responses'].get(table, []):
+                found_keys.add(item['object-key']['S'])
+
+            request = response.get('UnprocessedKeys')
+            if not request:
+                return found_keys
+
+            # Need to back off!
+            time.sleep(((2 ** backoff) + (random.randint(0, 1000) / 1000.0))/10.0)
+
+        raise SpdbError("Unprocessed keys remain after {} attempts to read the S3 index table.".format(
+            self.DYNAMODB_MAX_RETRIES), ErrorCodes.OBJECT_STORE_ERROR)
+
     def add_cuboid_to_index(self, object_key, version=0, ingest_job=0):
         """
         Method to add a cuboid's object_key to the S3 index table
@@ -352,6 +589,7 @@ class AWSObjectStore(ObjectStore):
         Returns:
             None
         """
+        import boto3
         dynamodb = boto3.client('dynamodb', region_name=get_region())
 
         # Get lookup key and resolution from object key
@@ -452,6 +690,11 @@ class AWSObjectStore(ObjectStore):
         """
         Method to page in objects from S3 to the Cache Database via Lambda invocation directly
 
+        Object keys are sent in batches of up to page_in_keys_per_invoke keys, listed in the payload's "object_keys".
+        The page in lambda is invoked once per batch and should call SpatialDB.page_objects_into_cache(), which sends
+        one completion message per batch. A batch with a single key uses the original payload instead, with the key in
+        "object_key", so it is understood by page in lambdas that don't support batches.
+
         Args:
             key_list (list(str)): A list of cached-cuboid keys to retrieve from the object store
             page_in_chan (str): Redis channel used for sending status of page in operations
@@ -466,6 +709,7 @@ class AWSObjectStore(ObjectStore):
         object_keys = self.cached_cuboid_to_object_keys(key_list)
 
         # Trigger lambda for all keys
+        import boto3
         client = boto3.client('lambda', region_name=get_region())
 
         params = {"page_in_channel": page_in_chan,
@@ -474,14 +718,16 @@ class AWSObjectStore(ObjectStore):
                   "lambda-name": "page_in_lambda_function",
                   "object_store_config": self.config}
 
-        # TODO: Make concurrent
-        for key in object_keys:
-            params["object_key"] = key
+        for batch in self.object_key_chunks(object_keys, self.page_in_keys_per_invoke):
+            payload = dict(params)
+            if len(batch) == 1:
+                payload["object_key"] = batch[0]
+            else:
+                payload["object_keys"] = batch
 
-            response = client.invoke(
-                FunctionName=self.config["page_in_lambda_function"],
-                InvocationType='Event',
-                Payload=json.dumps(params).encode())
+            client.invoke(FunctionName=self.config["page_in_lambda_function"],
+                          InvocationType='Event',
+                          Payload=json.dumps(payload).encode())
 
         return object_keys
 
@@ -497,23 +743,12 @@ class AWSObjectStore(ObjectStore):
             (bytes): A list of blosc compressed cuboid data
 
         """
-        s3 = boto3.client('s3', region_name=get_region())
-
-        # Append version to key
-        key = "{}&{}".format(key, version)
-
-        response = s3.get_object(
-            Key=key,
-            Bucket=self.config["cuboid_bucket"],
-        )
-        if response['ResponseMetadata']['HTTPStatusCode'] != 200:
-            raise SpdbError("Error reading cuboid from S3.",
-                            ErrorCodes.OBJECT_STORE_ERROR)
-
-        return response['Body'].read()
+        return self._get_object(key, version)
 
     def get_objects(self, key_list, version=0):
-        """ Method to get multiple objects serially in a loop
+        """ Method to get multiple objects concurrently
+
+        Up to s3_max_concurrency requests are in flight at once, sharing a single pooled S3 client.
 
         Args:
             key_list (list(str)): A list of object keys to retrieve from the object store
@@ -521,31 +756,16 @@ class AWSObjectStore(ObjectStore):
                            need to do a migration
 
         Returns:
-            (list(bytes)): A list of blosc compressed cuboid data
+            (list(bytes)): A list of blosc compressed cuboid data, in the same order as key_list
 
+        Raises:
+            (SpdbError): Listing every key that could not be read
         """
-        s3 = boto3.client('s3', region_name=get_region())
-
-        results = []
-
-        for key in key_list:
-            # Append version to key
-            key = "{}&{}".format(key, version)
-
-            response = s3.get_object(
-                Key=key,
-                Bucket=self.config["cuboid_bucket"],
-            )
-            if response['ResponseMetadata']['HTTPStatusCode'] != 200:
-                raise SpdbError("Error reading cuboid from S3.",
-                                ErrorCodes.OBJECT_STORE_ERROR)
-
-            results.append(response['Body'].read())
-
-        return results
+        return self._run_requests(self._get_object, key_list, [(key, version) for key in key_list],
+                                  "Error reading cuboids from S3.")
 
     def put_objects(self, key_list, cube_list, version=0):
-        """
+        """ Method to put multiple objects concurrently
 
         Args:
             key_list (list(str)): A list of object keys to put into the object store
@@ -555,21 +775,13 @@ class AWSObjectStore(ObjectStore):
 
         Returns:
 
+        Raises:
+            (SpdbError): Listing every key that could not be written
         """
-        s3 = boto3.client('s3', region_name=get_region())
-
-        for key, cube in zip(key_list, cube_list):
-            # Append version to key
-            key = "{}&{}".format(key, version)
-
-            response = s3.put_object(
-                Body=cube,
-                Key=key,
-                Bucket=self.config["cuboid_bucket"],
-            )
-            if response['ResponseMetadata']['HTTPStatusCode'] != 200:
-                raise SpdbError("Error writing cuboid to S3.",
-                                ErrorCodes.OBJECT_STORE_ERROR)
+        key_list = list(key_list)
+        self._run_requests(self._put_object, key_list,
+                           [(key, cube, version) for key, cube in zip(key_list, cube_list)],
+                           "Error writing cuboids to S3.")
 
     def update_id_indices(self, resource, resolution, key_list, cube_list, version=0):
         """
@@ -643,6 +855,7 @@ class AWSObjectStore(ObjectStore):
             None
         """
         # Put page out job on the queue
+        import boto3
         sqs = boto3.client('sqs', region_name=get_region())
 
         msg_data = {"config": config_data,
@@ -665,6 +878,66 @@ class AWSObjectStore(ObjectStore):
             InvocationType='Event',
             Payload=json.dumps(msg_data).encode())
 
+    def trigger_page_out_batch(self, config_data, write_cuboid_keys, resource):
+        """
+        Method to invoke lambda functions to page out multiple write-cuboids via data in SQS messages
+
+        Keys are grouped into messages of up to page_out_keys_per_invoke keys, listed in the message's
+        "write_cuboid_keys". A message with a single key uses the original format instead, with the key in
+        "write_cuboid_key", so it is understood by page out lambdas that don't support batches. Messages are sent
+        with SQS batch sends, and the page out lambda is invoked once per message. If a page_out_executor is
+        configured, it is called with each message instead.
+
+        Args:
+            config_data (dict): Dictionary of configuration dictionaries
+            write_cuboid_keys (list(str)): Unique write-cuboids to be flushed to S3
+            resource (spdb.project.resource.BossResource): resource for the given write cuboid keys
+
+        Returns:
+            None
+        """
+        if not write_cuboid_keys:
+            return
+
+        resource_dict = resource.to_dict()
+        messages = []
+        for keys in self.object_key_chunks(list(write_cuboid_keys), self.page_out_keys_per_invoke):
+            msg_data = {"config": config_data,
+                        "lambda-name": "s3_flush",
+                        "resource": resource_dict}
+            if len(keys) == 1:
+                msg_data["write_cuboid_key"] = keys[0]
+            else:
+                msg_data["write_cuboid_keys"] = keys
+            messages.append(msg_data)
+
+        if self.page_out_executor:
+            for msg_data in messages:
+                self.page_out_executor(msg_data)
+            return
+
+        payloads = [json.dumps(msg_data) for msg_data in messages]
+
+        # Put page out jobs on the queue
+        import boto3
+        sqs = boto3.client('sqs', region_name=get_region())
+        for batch in self.sqs_batches(payloads):
+            response = sqs.send_message_batch(QueueUrl=self.config["s3_flush_queue"],
+                                              Entries=[{"Id": str(idx), "MessageBody": payload}
+                                                       for idx, payload in enumerate(batch)])
+
+            if response['ResponseMetadata']['HTTPStatusCode'] != 200 or response.get('Failed'):
+                raise SpdbError("Error sending SQS messages to trigger page out operations. {}".format(
+                                response.get('Failed')),
+                                ErrorCodes.SPDB_ERROR)
+
+        # Trigger lambda to handle them
+        client = boto3.client('lambda', region_name=get_region())
+        for payload in payloads:
+            client.invoke(FunctionName=self.config["page_out_lambda_function"],
+                          InvocationType='Event',
+                          Payload=payload.encode())
+
     def reserve_ids(self, resource, num_ids, version=0):
         """Method to reserve a block of ids for a given channel at a version.
 
@@ -697,6 +970,7 @@ class AWSObjectStore(ObjectStore):
             (dict): { 'ids': ['1', '4', '8'] }
 
         """
+        from .region import Region
 
         # Identify sub-region entirely contained by cuboids.
         cuboids = Region.get_cuboid_aligned_sub_region(
@@ -772,13 +1046,19 @@ class AWSObjectStore(ObjectStore):
         Returns:
 
         """
+        cuboid_xyz = [[x, y, z]
+                      for x in cuboid_bounds.x_cuboids
+                      for y in cuboid_bounds.y_cuboids
+                      for z in cuboid_bounds.z_cuboids]
+        if not cuboid_xyz:
+            return []
+
+        from spdb.c_lib.ndlib import XYZMorton_array
+
         key_list = []
-        for x in cuboid_bounds.x_cuboids:
-            for y in cuboid_bounds.y_cuboids:
-                for z in cuboid_bounds.z_cuboids:
-                    morton = XYZMorton([x, y, z])
-                    for t in range(t_range[0], t_range[1]):
-                        key_list.append(self.generate_object_key(
-                            resource, resolution, t, morton))
+        for morton in XYZMorton_array(cuboid_xyz).tolist():
+            for t in range(t_range[0], t_range[1]):
+                key_list.append(self.generate_object_key(
+                    resource, resolution, t, morton))
 
         return key_list
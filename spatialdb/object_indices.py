@@ -13,7 +13,7 @@
 # limitations under the License.
 
 from spdb.c_lib.ndlib import unique
-from spdb.c_lib.ndlib import MortonXYZ, XYZMorton
+from spdb.c_lib.ndlib import MortonXYZ_array
 from spdb.c_lib.ndtype import CUBOIDSIZE
 from .error import SpdbError, ErrorCodes
 import boto3
@@ -321,12 +321,6 @@ class ObjectIndices:
             (SpdbError): Can't talk to id index database or database corrupt.
         """
         cf = resource.get_coord_frame()
-        x_min = cf.x_stop
-        x_max = cf.x_start
-        y_min = cf.y_stop
-        y_max = cf.y_start
-        z_min = cf.z_stop
-        z_max = cf.z_start
 
         [x_cube_dim, y_cube_dim, z_cube_dim] = CUBOIDSIZE[resolution]
         obj_keys = self.get_cuboids(resource, resolution, id)
@@ -334,25 +328,13 @@ class ObjectIndices:
         if len(obj_keys) == 0:
             return None
 
-        for key in obj_keys:
-            morton = int(key.split('&')[6])
-            xyz = MortonXYZ(morton)
-            x = xyz[0] * x_cube_dim
-            y = xyz[1] * y_cube_dim
-            z = xyz[2] * z_cube_dim
-
-            if x < x_min:
-                x_min = x
-            if x > x_max:
-                x_max = x
-            if y < y_min:
-                y_min = y
-            if y > y_max:
-                y_max = y
-            if z < z_min:
-                z_min = z
-            if z > z_max:
-                z_max = z
+        mortons = np.array([int(key.split('&')[6]) for key in obj_keys], dtype=np.uint64)
+        xyz = MortonXYZ_array(mortons) * np.array([x_cube_dim, y_cube_dim, z_cube_dim], dtype=np.uint64)
+        # Keep the bounds uint64 so they aren't promoted to float
+        [x_min, y_min, z_min] = np.minimum(xyz.min(axis=0),
+                                           np.array([cf.x_stop, cf.y_stop, cf.z_stop], dtype=np.uint64)).tolist()
+        [x_max, y_max, z_max] = np.maximum(xyz.max(axis=0),
+                                           np.array([cf.x_start, cf.y_start, cf.z_start], dtype=np.uint64)).tolist()
 
         return {
             'x_range': [x_min, x_max+x_cube_dim],
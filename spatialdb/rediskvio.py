@@ -21,6 +21,19 @@ from .kvio import KVIO
 
 
 class RedisKVIO(KVIO):
+    # Default number of seconds a cuboid is remembered as not existing in the object store. 0 disables the markers,
+    # since writers that add cuboids to the object store index directly (e.g. ingest) don't clear them
+    EMPTY_CUBOID_TIMEOUT = 0
+
+    # Counter that orders writes in the dirty indices. Incremented on the Redis server so the order doesn't depend on
+    # the clocks of the clients writing
+    WRITE_SEQUENCE_KEY = "WRITE-SEQUENCE"
+
+    # Status of each cuboid returned by get_clean_cubes()
+    CUBE_MISSING = 0
+    CUBE_CLEAN = 1
+    CUBE_DIRTY = 2
+
     def __init__(self, kv_conf):
         """Connect to the Redis backend
 
@@ -29,6 +42,12 @@ class RedisKVIO(KVIO):
             cache_host: If cache_client not provided, a string indicating the database host
             cache_db: If cache_client not provided, an integer indicating the database to use
             read_timeout: Integer indicating number of seconds a read cache key expires
+            empty_timeout: Optional integer indicating number of seconds a cuboid is remembered as not existing in
+                           the object store. Disabled if not provided or 0. Only enable if all writers to the object
+                           store go through the cache, since markers aren't cleared when cuboids are added to the
+                           object store index directly
+            cuboid_cache_bytes: Optional size in bytes of the in-process cache of decompressed cuboids used by
+                                SpatialDB. Disabled if not provided or 0
         """
         # call the base class constructor
         KVIO.__init__(self, kv_conf)
@@ -70,7 +89,8 @@ class RedisKVIO(KVIO):
         No rollback with redis"""
         pass
 
-    def get_missing_read_cache_keys(self, resource, resolution, time_sample_range, morton_idx_list, iso=False):
+    def get_missing_read_cache_keys(self, resource, resolution, time_sample_range, morton_idx_list, iso=False,
+                                    versions=False):
         """Retrieve the indexes of missing cubes in the cache db based on a morton ID list and time samples
 
         When using redis as the cache backend, you don't need to keep a secondary index and can get this info
@@ -82,16 +102,19 @@ class RedisKVIO(KVIO):
             time_sample_range (list[int]): the start and stop index of the time samples
             morton_idx_list (list[int]): a list of Morton ID of the cuboids to get
             iso (bool): flag indicating if you want to try to get the isotropic version of a channel
+            versions (bool): flag indicating if the version stamp of each cube should also be returned
 
         Returns:
             (list(int), list(int), list(str)): A tuple of lists with the first being an index of missing keys
-            the second a list of keys in the cache, and the third being the cached-cuboid keys for the query
+            the second a list of keys in the cache, and the third being the cached-cuboid keys for the query. If
+            versions is True, a fourth list contains the version stamp (or None) of each cached-cuboid key
         """
         # Get the cached-cuboid keys
         all_cuboid_keys = self.generate_cached_cuboid_keys(resource, resolution,
                                                            list(range(*time_sample_range)), morton_idx_list, iso=iso)
 
         # Query Redis for key existence, refreshing the cache timeout if exists
+        num_cmds = 4 if versions else 2
         try:
             pipe = self.cache_client.pipeline()
             pipe.multi()
@@ -100,6 +123,10 @@ class RedisKVIO(KVIO):
             for key in all_cuboid_keys:
                 pipe.expire(key, self.kv_conf["read_timeout"])
                 pipe.exists(key)
+                if versions:
+                    version_key = self.generate_cuboid_version_key(key)
+                    pipe.expire(version_key, self.kv_conf["read_timeout"])
+                    pipe.get(version_key)
 
             # Run Pipelined commands
             result = pipe.execute()
@@ -112,13 +139,220 @@ class RedisKVIO(KVIO):
         missing_key_idx = []
         cached_key_idx = []
         for idx, key in enumerate(all_cuboid_keys):
-            if not result[idx*2]:
+            if not result[idx*num_cmds]:
                 missing_key_idx.append(idx)
             else:
                 cached_key_idx.append(idx)
 
+        if versions:
+            version_list = [self._decode_version(result[idx*num_cmds + 3]) for idx in range(len(all_cuboid_keys))]
+            return missing_key_idx, cached_key_idx, all_cuboid_keys, version_list
+
         return missing_key_idx, cached_key_idx, all_cuboid_keys
 
+    def get_clean_cubes(self, key_list, data=True, versions=False):
+        """Check if cubes are cached and dirty, returning the data of the clean ones
+
+        The timeout of each cached cube is refreshed. This is a single pipelined round trip, plus one more to verify
+        the dirty index of cubes that have one.
+
+        Args:
+            key_list (list(str)): the list of cached-cuboid keys
+            data (bool): flag indicating if the data of clean cubes should be returned
+            versions (bool): flag indicating if the version stamp of each cube should be returned
+
+        Returns:
+            (list(int), list(bytes), list(str)): A tuple of lists with the first being the status of each cube
+            (CUBE_MISSING, CUBE_CLEAN or CUBE_DIRTY), the second the blosc compressed byte array of each clean cube
+            (or None) and the third the version stamp of each cube (or None)
+        """
+        if not key_list:
+            return [], [], []
+
+        num_cmds = 2 + (1 if data else 0) + (2 if versions else 0)
+        try:
+            pipe = self.cache_client.pipeline()
+            for key in key_list:
+                pipe.expire(key, self.kv_conf["read_timeout"])
+                pipe.exists(self.generate_dirty_cuboid_key(key))
+                if data:
+                    pipe.get(key)
+                if versions:
+                    version_key = self.generate_cuboid_version_key(key)
+                    pipe.expire(version_key, self.kv_conf["read_timeout"])
+                    pipe.get(version_key)
+            result = pipe.execute()
+
+            dirty_idx = [idx for idx in range(len(key_list)) if result[idx * num_cmds + 1]]
+            dirty = set()
+            if dirty_idx:
+                flags = self._verify_dirty_index([self.generate_dirty_cuboid_key(key_list[idx]) for idx in dirty_idx])
+                dirty = set([idx for idx, flag in zip(dirty_idx, flags) if flag])
+        except Exception as e:
+            raise SpdbError("Error reading cuboids from the cache database. {}".format(e),
+                            ErrorCodes.REDIS_ERROR)
+
+        status = []
+        rows = []
+        version_list = []
+        for idx in range(len(key_list)):
+            if idx in dirty:
+                status.append(self.CUBE_DIRTY)
+            elif result[idx * num_cmds]:
+                status.append(self.CUBE_CLEAN)
+            else:
+                status.append(self.CUBE_MISSING)
+
+            if data and status[-1] == self.CUBE_CLEAN:
+                rows.append(result[idx * num_cmds + 2])
+            else:
+                rows.append(None)
+
+            version_list.append(self._decode_version(result[(idx + 1) * num_cmds - 1]) if versions else None)
+
+        return status, rows, version_list
+
+    @staticmethod
+    def generate_cuboid_version_key(key):
+        """Converts a cached-cuboid or write-cuboid key to the key of the cuboid's version stamp
+
+        The version stamp is a random value replaced every time the cuboid is modified in the cache or write buffer,
+        so decompressed copies of a cuboid can be validated against it:
+
+            CACHED-CUBOID&{lookup_key}&res&time_sample&morton_id
+            WRITE-CUBOID&{lookup_key}&res&time_sample&morton_id&UUID
+                                    to
+            CUBOID-VERSION&{lookup_key}&res&time_sample&morton_id
+
+        Args:
+            key (str): the cached-cuboid or write-cuboid key to convert
+
+        Returns:
+            str: the associated cuboid-version key
+        """
+        key_type, base = key.split("&", 1)
+        if key_type == "WRITE-CUBOID":
+            base = base.rsplit("&", 1)[0]
+        return 'CUBOID-VERSION&{}'.format(base)
+
+    @staticmethod
+    def _decode_version(version):
+        return version.decode() if version else None
+
+    def get_cube_versions(self, key_list):
+        """Retrieve the version stamps of multiple cubes from the cache database
+
+        Args:
+            key_list (list(str)): the list of cuboid keys
+
+        Returns:
+            (list(str)): The version stamp of each cube, or None if the cube has no version stamp
+        """
+        if not key_list:
+            return []
+
+        try:
+            versions = self.cache_client.mget([self.generate_cuboid_version_key(key) for key in key_list])
+        except Exception as e:
+            raise SpdbError("Error retrieving cuboid versions from the cache database. {}".format(e),
+                            ErrorCodes.REDIS_ERROR)
+
+        return [self._decode_version(version) for version in versions]
+
+    @staticmethod
+    def generate_empty_cuboid_key(key):
+        """Converts a cached-cuboid or write-cuboid key to the key marking the cuboid as not in the object store
+
+            CACHED-CUBOID&{lookup_key}&res&time_sample&morton_id
+            WRITE-CUBOID&{lookup_key}&res&time_sample&morton_id&UUID
+                                    to
+            EMPTY-CUBOID&{lookup_key}&res&time_sample&morton_id
+
+        Args:
+            key (str): the cached-cuboid or write-cuboid key to convert
+
+        Returns:
+            str: the associated empty-cuboid key
+        """
+        key_type, base = key.split("&", 1)
+        if key_type == "WRITE-CUBOID":
+            base = base.rsplit("&", 1)[0]
+        return 'EMPTY-CUBOID&{}'.format(base)
+
+    def empty_cubes_enabled(self):
+        """Check if cuboids missing from the object store are remembered with empty cuboid markers
+
+        Returns:
+            (bool): True if empty_timeout is configured
+        """
+        return bool(self.kv_conf.get("empty_timeout", self.EMPTY_CUBOID_TIMEOUT))
+
+    def get_empty_cubes(self, key_list):
+        """Check if cubes were recently found to not exist in the object store
+
+        Args:
+            key_list (list(str)): the list of cached-cuboid keys
+
+        Returns:
+            (list(bool)): True for each cube known to be empty
+        """
+        if not key_list:
+            return []
+
+        if not self.empty_cubes_enabled():
+            return [False] * len(key_list)
+
+        try:
+            rows = self.cache_client.mget([self.generate_empty_cuboid_key(key) for key in key_list])
+        except Exception as e:
+            raise SpdbError("Error checking for empty cuboids in the cache database. {}".format(e),
+                            ErrorCodes.REDIS_ERROR)
+
+        return [row is not None for row in rows]
+
+    def set_empty_cubes(self, key_list, versions=None):
+        """Remember that cubes don't exist in the object store, so they aren't checked again until the marker expires
+
+        Does nothing unless empty_timeout is configured. The marker is removed whenever the cuboid is written to the
+        cache or write buffer, or flushed from the write buffer. A flush that finishes after the object store was checked but before the marker is set would leave a
+        stale marker, so pass the version stamps read before checking the object store. Markers are then only set if
+        no cube's version has changed since.
+
+        Args:
+            key_list (list(str)): the list of cached-cuboid keys
+            versions (list(str)): Optional version stamp of each cube, read before checking the object store
+
+        Returns:
+            None
+        """
+        if not key_list:
+            return
+
+        timeout = self.kv_conf.get("empty_timeout", self.EMPTY_CUBOID_TIMEOUT)
+        if not timeout:
+            return
+
+        with self.cache_client.pipeline() as pipe:
+            try:
+                if versions is not None:
+                    version_keys = [self.generate_cuboid_version_key(key) for key in key_list]
+                    pipe.watch(*version_keys)
+                    current = [self._decode_version(version) for version in pipe.mget(version_keys)]
+                    if current != list(versions):
+                        # Written since the object store was checked
+                        return
+                    pipe.multi()
+
+                for key in key_list:
+                    pipe.set(self.generate_empty_cuboid_key(key), 1, ex=timeout)
+                pipe.execute()
+            except redis.WatchError:
+                # Written while setting the markers. They are only an optimization, so skip them
+                return
+            except Exception as e:
+                raise SpdbError("Error marking empty cuboids in the cache database. {}".format(e),
+                                ErrorCodes.REDIS_ERROR)
+
     def get_cubes(self, key_list):
         """Retrieve multiple cubes from the cache database
 
@@ -182,8 +416,18 @@ class RedisKVIO(KVIO):
             None
         """
         try:
-            # Get the data from the DB
-            result = self.cache_client.delete(key)
+            pipe = self.cache_client.pipeline()
+            pipe.delete(key)
+            if key.startswith("WRITE-CUBOID&"):
+                # Remove from the dirty index at the same time so the cuboid becomes clean once all writes are gone
+                pipe.zrem(self.generate_dirty_cuboid_key(key), key)
+                pipe.set(self.generate_cuboid_version_key(key), uuid.uuid4().hex, ex=self.kv_conf["read_timeout"])
+
+                # The flushed cuboid is now in the object store
+                pipe.delete(self.generate_empty_cuboid_key(key))
+            else:
+                pipe.delete(self.generate_cuboid_version_key(key))
+            result = pipe.execute()[0]
         except Exception as e:
             raise SpdbError("Error deleting cuboids from the cache database. {}".format(e),
                             ErrorCodes.REDIS_ERROR)
@@ -206,12 +450,18 @@ class RedisKVIO(KVIO):
             key_list = [key_list]
 
         try:
-            # Write data to redis
-            self.cache_client.mset(dict(list(zip(key_list, cube_list))))
+            # Write data and new version stamps to redis
+            version_keys = [self.generate_cuboid_version_key(key) for key in key_list]
+            pipe = self.cache_client.pipeline()
+            pipe.mset(dict(list(zip(key_list, cube_list))))
+            pipe.mset(dict([(key, uuid.uuid4().hex) for key in version_keys]))
+            pipe.delete(*[self.generate_empty_cuboid_key(key) for key in key_list])
 
             # Set expire times
-            for key in key_list:
-                self.cache_client.expire(key, self.kv_conf["read_timeout"])
+            for key in list(key_list) + version_keys:
+                pipe.expire(key, self.kv_conf["read_timeout"])
+
+            pipe.execute()
 
         except Exception as e:
             raise SpdbError("Error inserting cubes into the cache database. {}".format(e),
@@ -227,20 +477,49 @@ class RedisKVIO(KVIO):
         Returns:
             (str): The complete write-buffer key
         """
+        return self.insert_cubes_in_write_buffer(base_key, [(time_sample, morton_id, data)])[0]
+
+    def insert_cubes_in_write_buffer(self, base_key, cube_list):
+        """Store multiple cubes (single time point each) in the write buffer in one round trip
+
+        Args:
+            base_key (str): the base write-buffer key (does not include uuid)
+            cube_list (list((int, int, bytes))): Tuples of the time sample, morton id and cube in a blosc compressed
+                                                 byte arrays using the numpy interface
+
+        Returns:
+            (list(str)): The complete write-buffer key of each cube
+        """
         # TODO: Move to parent class if this method sticks after optimization of write_cuboid method
-        # Create write buffer key
-        key = "{}&{}&{}&{}".format(base_key, time_sample, morton_id, uuid.uuid4().hex)
+        keys = []
+        if not cube_list:
+            return keys
 
         try:
-            # Write data to redis
-            self.cache_client.set(key, data)
+            # Reserve a write sequence number for each cube, so pending writes can be retrieved in order
+            last_sequence = self.cache_client.incrby(self.WRITE_SEQUENCE_KEY, len(cube_list))
+            first_sequence = last_sequence - len(cube_list) + 1
 
-            return key
+            # Write data to redis and add the key to the cuboid's dirty index, scored by sequence number. The cuboid's
+            # version stamp changes since it is now dirty
+            pipe = self.cache_client.pipeline()
+            for sequence, (time_sample, morton_id, data) in enumerate(cube_list, first_sequence):
+                # Create write buffer key
+                key = "{}&{}&{}&{}".format(base_key, time_sample, morton_id, uuid.uuid4().hex)
+                keys.append(key)
+
+                pipe.set(key, data)
+                pipe.zadd(self.generate_dirty_cuboid_key(key), sequence, key)
+                pipe.set(self.generate_cuboid_version_key(key), uuid.uuid4().hex, ex=self.kv_conf["read_timeout"])
+                pipe.delete(self.generate_empty_cuboid_key(key))
+            pipe.execute()
 
         except Exception as e:
             raise SpdbError("Error inserting cube into the write buffer. {}".format(e),
                             ErrorCodes.REDIS_ERROR)
 
+        return keys
+
     def get_cube_from_write_buffer(self, write_cuboid_key):
         """Retrieve a single cube from the write buffer
 
@@ -257,9 +536,77 @@ class RedisKVIO(KVIO):
             raise SpdbError("Error retrieving cuboid from the write buffer. {}".format(e),
                             ErrorCodes.REDIS_ERROR)
 
+    def get_pending_writes(self, cache_key_list):
+        """Get the writes pending in the write buffer for multiple cuboids, along with their cached data
+
+        The write-cuboid keys are read from each cuboid's dirty index first, then the writes and the cached cuboids are
+        read together in a single transaction. A write flushed in between is then either still returned or already
+        included in the cached data, so applying the writes in order over the cached data is always up to date.
+
+        Args:
+            cache_key_list (list(str)): A list of cached-cuboid keys
+
+        Returns:
+            (list(bytes), list(list(bytes))): For each key, the blosc compressed cached cuboid (None if not in the
+            cache) and the blosc compressed writes pending for it, oldest first
+        """
+        try:
+            pipe = self.cache_client.pipeline()
+            for key in cache_key_list:
+                pipe.zrange(self.generate_dirty_cuboid_key(key), 0, -1)
+            write_key_lists = pipe.execute()
+
+            pipe = self.cache_client.pipeline()
+            for key, write_keys in zip(cache_key_list, write_key_lists):
+                for write_key in write_keys:
+                    pipe.get(write_key)
+                pipe.get(key)
+            result = pipe.execute()
+        except Exception as e:
+            raise SpdbError("Error retrieving pending writes from the write buffer. {}".format(e),
+                            ErrorCodes.REDIS_ERROR)
+
+        rows = []
+        writes = []
+        result = iter(result)
+        for write_keys in write_key_lists:
+            # Writes removed since the dirty index was read have been flushed into the cached data
+            writes.append([data for data in [next(result) for _ in write_keys] if data is not None])
+            rows.append(next(result))
+
+        return rows, writes
+
+    @staticmethod
+    def generate_dirty_cuboid_key(key):
+        """Converts a cached-cuboid or write-cuboid key to the key of the cuboid's dirty index
+
+        The dirty index is a sorted set of the write-cuboid keys pending for a single cuboid, so a cuboid is dirty
+        if its dirty index exists:
+
+            CACHED-CUBOID&{lookup_key}&res&time_sample&morton_id
+            WRITE-CUBOID&{lookup_key}&res&time_sample&morton_id&UUID
+                                    to
+            DIRTY-CUBOID&{lookup_key}&res&time_sample&morton_id
+
+        Args:
+            key (str): the cached-cuboid or write-cuboid key to convert
+
+        Returns:
+            str: the associated dirty-cuboid key
+        """
+        key_type, base = key.split("&", 1)
+        if key_type == "WRITE-CUBOID":
+            base = base.rsplit("&", 1)[0]
+        return 'DIRTY-CUBOID&{}'.format(base)
+
     def is_dirty(self, cache_key_list):
         """
         Check if a cuboid is dirty based on its cache key
+
+        Each check is a single EXISTS on the cuboid's dirty index. Cuboids that look dirty have their index
+        verified against the write buffer so a write-cuboid key removed without going through delete_cube() can't
+        leave a cuboid dirty forever.
+
         Args:
             cache_key_list (list(str)): A list of cached-cuboid keys
 
@@ -269,16 +616,58 @@ class RedisKVIO(KVIO):
         if isinstance(cache_key_list, str):
             cache_key_list = [cache_key_list]
 
-        # Convert cached-keys to write-cuboid keys without UUID
-        # (we can't recreate UUIDs and want to check for ALL write-cuboid keys for a given cuboid anyway)
-        result = None
+        dirty_key_list = [self.generate_dirty_cuboid_key(key) for key in cache_key_list]
+
+        try:
+            with self.cache_client.pipeline() as pipe:
+                for key in dirty_key_list:
+                    pipe.exists(key)
+                result = [bool(x) for x in pipe.execute()]
+
+            dirty_idx = [idx for idx, flag in enumerate(result) if flag]
+            if dirty_idx:
+                for idx, flag in zip(dirty_idx, self._verify_dirty_index([dirty_key_list[i] for i in dirty_idx])):
+                    result[idx] = flag
+
+        except Exception as e:
+            raise SpdbError("Error checking dirty cuboids in the cache database. {}".format(e),
+                            ErrorCodes.REDIS_ERROR)
+
+        return result
+
+    def _verify_dirty_index(self, dirty_key_list):
+        """Prune write-cuboid keys that no longer exist from dirty indices
+
+        Args:
+            dirty_key_list (list(str)): A list of dirty-cuboid keys
+
+        Returns:
+            (list(bool)): A list of booleans, indicating if each cuboid is still dirty
+        """
         with self.cache_client.pipeline() as pipe:
-            for key in cache_key_list:
-                parts = key.split("&", 1)
-                pipe.keys('WRITE-CUBOID&{}*'.format(parts[1]))
+            for key in dirty_key_list:
+                pipe.zrange(key, 0, -1)
+            members = pipe.execute()
 
-            result = pipe.execute()
+        write_keys = [w for m in members for w in m]
+        with self.cache_client.pipeline() as pipe:
+            for key in write_keys:
+                pipe.exists(key)
+            exists = dict(zip(write_keys, pipe.execute()))
+
+        result = []
+        stale = []
+        for key, m in zip(dirty_key_list, members):
+            missing = [w for w in m if not exists[w]]
+            if missing:
+                stale.append((key, missing))
+            result.append(len(missing) < len(m))
+
+        if stale:
+            with self.cache_client.pipeline() as pipe:
+                for key, missing in stale:
+                    pipe.zrem(key, *missing)
+                pipe.execute()
 
-        # Check all keys in a pipelined command
-        return [len(x) > 0 for x in result]
+        return result
 
@@ -14,14 +14,17 @@
 # limitations under the License.
 
 import numpy as np
+import blosc
 from collections import namedtuple
 import collections
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import os
+import threading
 import time
 
 from operator import mod, floordiv
 from operator import itemgetter
-import uuid
 
 from spdb.c_lib import ndlib
 from spdb.c_lib.ndtype import CUBOIDSIZE
@@ -31,6 +34,7 @@ from bossutils.logger import BossLogger
 from .error import SpdbError, ErrorCodes
 from .rediskvio import RedisKVIO
 from .cube import Cube
+from .cuboidcache import CuboidCache
 from .object import AWSObjectStore
 from .state import CacheStateDB
 from .region import Region
@@ -47,6 +51,7 @@ class SpatialDB:
                     "cache_host": If cache_client not provided, a string indicating the database host
                     "cache_db": If cache_client not provided, an integer indicating the database to use
                     "read_timeout": Integer indicating number of seconds a read cache key expires
+                    "cuboid_cache_bytes": Optional size in bytes of the in-process cache of decompressed cuboids
                   }
 
 
@@ -80,7 +85,11 @@ class SpatialDB:
       kvio (KVIO): A key-value store engine instance
       objectio (spdb.rediskvio.RedisKVIO): An object storage engine instance
       cache_state (spdb.state.CacheStateDB): A cache state interface
+      cuboid_cache (spdb.cuboidcache.CuboidCache): In-process cache of decompressed cuboids or None if disabled
     """
+    # Seconds from triggering a lambda page in to each completion message, shared by all instances in the process
+    _page_in_latencies = collections.deque(maxlen=1000)
+
     def __init__(self, kv_conf, state_conf, object_store_conf):
         self.kv_config = kv_conf
         self.state_conf = state_conf
@@ -90,6 +99,26 @@ class SpatialDB:
         self.read_lambda_threshold = 600  # Currently high since read lambda not implemented
         # Number of seconds to wait for dirty cubes to get clean
         self.dirty_read_timeout = 60
+        # Max number of seconds to block on cuboid clean events before re-checking dirty cubes (guards against a
+        # missed event). If events are not available, dirty cubes are polled every dirty_poll_interval seconds
+        self.dirty_event_interval = 1.0
+        self.dirty_poll_interval = 0.05
+        # Number of threads used to compress and decompress cuboids. 1 (the default) disables the codec thread pool.
+        # The pool is only used if python-blosc can release the GIL and c-blosc's global lock is bypassed by setting
+        # BLOSC_NOLOCK, otherwise codec calls run one at a time anyway
+        self.codec_threads = 1
+        # Hedge lambda page in. Keys still missing after the page_in_hedge_percentile of recent page in latencies (or
+        # page_in_hedge_delay seconds until page_in_hedge_min_samples have been seen) are read directly from the
+        # object store. Off (None) by default since hedging adds object store load when page in is already slow.
+        # Set to e.g. 95 to enable
+        self.page_in_hedge_percentile = None
+        self.page_in_hedge_delay = 2.0
+        self.page_in_hedge_min_samples = 20
+
+        # Codec thread pool is created on first use. Each thread keeps its own staging buffer for decompression
+        self._codec_executor = None
+        self._codec_lock = threading.Lock()
+        self._codec_local = threading.local()
 
         # Currently only a AWS object store is supported, so create interface instance
         self.objectio = AWSObjectStore(object_store_conf)
@@ -100,6 +129,12 @@ class SpatialDB:
         # Create interface instance for the cache state db (redis backed)
         self.cache_state = CacheStateDB(state_conf)
 
+        # Optional in-process cache of decompressed cuboids, shared by all instances in the process
+        if kv_conf.get("cuboid_cache_bytes"):
+            self.cuboid_cache = CuboidCache.get_instance(kv_conf["cuboid_cache_bytes"])
+        else:
+            self.cuboid_cache = None
+
         # TODO: Add annotation support
         # self.annoIdx = annindex.AnnotateIndex(self.kvio, self.proj)
 
@@ -113,6 +148,43 @@ class SpatialDB:
         """
         self.kvio.close()
 
+        if self._codec_executor:
+            self._codec_executor.shutdown()
+            self._codec_executor = None
+
+    @staticmethod
+    def codec_parallel():
+        """Check if blosc calls made from different threads can run concurrently
+
+        Returns:
+            (bool): True if python-blosc can release the GIL and c-blosc's global lock is bypassed
+        """
+        return hasattr(blosc, "set_releasegil") and bool(os.environ.get("BLOSC_NOLOCK"))
+
+    def _codec_map(self, fcn, items):
+        """Apply fcn to each item, using the codec thread pool if enabled
+
+        blosc is told to release the GIL so compression and decompression of different cuboids run in parallel. If
+        the installed python-blosc can't release the GIL, or c-blosc's global lock isn't bypassed with the BLOSC_NOLOCK
+        environment variable, the items are processed serially.
+
+        Args:
+            fcn (function): The function to apply
+            items (list): The items to apply the function to
+
+        Returns:
+            (list): The results, in the same order as items
+        """
+        if self.codec_threads <= 1 or len(items) <= 1 or not self.codec_parallel():
+            return [fcn(item) for item in items]
+
+        with self._codec_lock:
+            if not self._codec_executor:
+                blosc.set_releasegil(True)
+                self._codec_executor = ThreadPoolExecutor(max_workers=self.codec_threads)
+
+        return list(self._codec_executor.map(fcn, items))
+
     # Cube Processing Methods
     def get_cubes(self, resource, key_list):
         """Load an array of cuboids from the cache key-value store as raw compressed byte arrays
@@ -128,17 +200,71 @@ class SpatialDB:
         if isinstance(key_list, str):
             key_list = [key_list]
 
-        # Get all cuboid byte arrays from db
-        cuboids = self.kvio.get_cubes(key_list)
+        if self.cuboid_cache is not None:
+            # Get decompressed cuboids from the cuboid cache if they haven't changed
+            cuboids = self._get_cache_cuboids(resource, key_list, self.kvio.get_cube_versions(key_list))
+        else:
+            # Get all cuboid byte arrays from db
+            cuboids = self.kvio.get_cubes(key_list)
 
         return self.sort_cubes(resource, cuboids)
 
+    def _get_cache_cuboids(self, resource, key_list, versions=None):
+        """Load cuboids from the cache key-value store, using the in-process cuboid cache if enabled
+
+        Cuboids with a version stamp that are not in the cuboid cache are decompressed and added to it.
+
+        Args:
+            resource (spdb.project.BossResource): Data model info based on the request or target resource
+            key_list (list(str)): List of cached-cuboid keys to read from the database
+            versions (list(str)): The version stamp of each key, read no later than the cuboids are read. If None,
+                                  the cuboid cache is bypassed
+
+        Returns:
+            (list((int, int, bytes|np.ndarray))): Tuples of the morton id, time sample and either the blosc
+            compressed byte array or the decompressed, read-only array
+        """
+        if self.cuboid_cache is None or versions is None:
+            return self.kvio.get_cubes(key_list)
+
+        entries = [None] * len(key_list)
+        fetch_idx = []
+        for idx, (key, version) in enumerate(zip(key_list, versions)):
+            data = self.cuboid_cache.get(key, version)
+            if data is None:
+                fetch_idx.append(idx)
+            else:
+                vals = key.rsplit("&", 2)
+                entries[idx] = (int(vals[2]), int(vals[1]), data)
+
+        if fetch_idx:
+            fetched = self.kvio.get_cubes([key_list[idx] for idx in fetch_idx])
+            dtype = resource.get_numpy_data_type()
+
+            def decode_cuboid(item):
+                idx, (morton, time_sample, cube_bytes) = item
+                if versions[idx] is None:
+                    # Can't be cached so leave compressed
+                    return morton, time_sample, cube_bytes
+
+                [x_cube_dim, y_cube_dim, z_cube_dim] = CUBOIDSIZE[int(key_list[idx].rsplit("&", 3)[1])]
+                data = np.empty((1, z_cube_dim, y_cube_dim, x_cube_dim), dtype=dtype)
+                Cube.unpack_array_into(cube_bytes, data)
+                self.cuboid_cache.put(key_list[idx], versions[idx], data)
+                return morton, time_sample, data
+
+            for idx, entry in zip(fetch_idx, self._codec_map(decode_cuboid, list(zip(fetch_idx, fetched)))):
+                entries[idx] = entry
+
+        return entries
+
     def sort_cubes(self, resource, cuboids):
         """Sort cubes by time sample and then by morton id
         
         Args:
             resource (spdb.project.BossResource): Data model info based on the request or target resource
             cuboids (int, int, bytes): A tuple of the morton id, time sample and the blosc compressed byte array using the numpy interface
+                                       (or a decompressed array)
 
         Returns:
             list(cube.Cube): The cuboid data with time-series support, packed into Cube instances, sorted by morton id
@@ -161,25 +287,103 @@ class SpatialDB:
         else:
             not_time_series = False
 
-        start = 0
-        output_cubes = []
-        for end in morton_boundaries:
+        def unpack_cube(bounds):
+            start, end = bounds
+
             # Create a temporary cube instance
             temp_cube = Cube.create_cube(resource)
             temp_cube.morton_id = morton[start]
 
             # populate with all the time samples
             if not_time_series:
-                temp_cube.from_blosc(cube_bytes[start:end], [time_sample[start], time_sample[start] + 1])
+                time_range = [time_sample[start], time_sample[start] + 1]
             else:
-                temp_cube.from_blosc(cube_bytes[start:end], [time_sample[start], time_sample[end - 1] + 1])
+                time_range = [time_sample[start], time_sample[end - 1] + 1]
 
-            # Save for output
-            output_cubes.append(temp_cube)
+            if not any(isinstance(x, np.ndarray) for x in cube_bytes[start:end]):
+                temp_cube.from_blosc(cube_bytes[start:end], time_range)
+            else:
+                # Some time samples are already decompressed. Always copy since those arrays are shared
+                temp_cube.is_time_series = True
+                temp_cube.time_range = time_range
+                temp_cube.data = np.empty([end - start] + temp_cube.cube_size, dtype=temp_cube.datatype)
+                for idx, source in enumerate(cube_bytes[start:end]):
+                    if isinstance(source, np.ndarray):
+                        np.copyto(temp_cube.data[idx:idx + 1], source)
+                    else:
+                        Cube.unpack_array_into(source, temp_cube.data[idx:idx + 1])
+
+            return temp_cube
 
-            start = end
+        # Decompress each cube (all of its time samples) in parallel
+        starts = np.insert(morton_boundaries[:-1], 0, 0)
+        return self._codec_map(unpack_cube, list(zip(starts.tolist(), morton_boundaries.tolist())))
 
-        return output_cubes
+    def _add_cuboids_to_cube(self, out_cube, cuboids, corner, cube_dim):
+        """Decompress cuboids directly into their location in a preallocated cube
+
+        Only the part of each cuboid that overlaps out_cube is copied. Cuboids fully inside out_cube are decompressed
+        straight into their slice of out_cube.data, the rest go through a reused per-thread staging buffer. Cuboids
+        are decompressed on the codec thread pool.
+
+        Args:
+            out_cube (cube.Cube): The cube to populate, which starts at voxel corner and time sample
+                                  out_cube.time_range[0]
+            cuboids (list((int, int, bytes))): Tuples of the morton id, time sample and the blosc compressed byte array
+                                               (or decompressed array) for a single time sample
+            corner (list(int)): The x, y, z voxel coordinates of out_cube's origin
+            cube_dim (list(int)): The x, y, z dimensions of a cuboid
+
+        Returns:
+            None
+        """
+        if not cuboids:
+            return
+
+        cube_dim = np.array(cube_dim, dtype=np.int64)
+        corner = np.array(corner, dtype=np.int64)
+        extent = np.array([out_cube.x_dim, out_cube.y_dim, out_cube.z_dim], dtype=np.int64)
+
+        # Voxel bounds of each cuboid, clipped to out_cube and made relative to the cuboid and to out_cube
+        cuboid_start = ndlib.MortonXYZ_array([cuboid[0] for cuboid in cuboids]).astype(np.int64) * cube_dim
+        lo = np.maximum(cuboid_start, corner)
+        hi = np.minimum(cuboid_start + cube_dim, corner + extent)
+        src_lo = (lo - cuboid_start).tolist()
+        src_hi = (hi - cuboid_start).tolist()
+        dst_lo = (lo - corner).tolist()
+        dst_hi = (hi - corner).tolist()
+
+        full_shape = (1, int(cube_dim[2]), int(cube_dim[1]), int(cube_dim[0]))
+
+        def unpack_cuboid(idx):
+            _, time_sample, cube_bytes = cuboids[idx]
+            t = time_sample - out_cube.time_range[0]
+            out = out_cube.data[t:t + 1,
+                                dst_lo[idx][2]:dst_hi[idx][2],
+                                dst_lo[idx][1]:dst_hi[idx][1],
+                                dst_lo[idx][0]:dst_hi[idx][0]]
+
+            if isinstance(cube_bytes, np.ndarray):
+                # Already decompressed
+                np.copyto(out, cube_bytes[:,
+                                          src_lo[idx][2]:src_hi[idx][2],
+                                          src_lo[idx][1]:src_hi[idx][1],
+                                          src_lo[idx][0]:src_hi[idx][0]])
+                return
+
+            staging = getattr(self._codec_local, "staging", None)
+            if out.shape == full_shape:
+                staging = Cube.unpack_array_into(cube_bytes, out, staging)
+            else:
+                sub_box = (slice(None),
+                           slice(src_lo[idx][2], src_hi[idx][2]),
+                           slice(src_lo[idx][1], src_hi[idx][1]),
+                           slice(src_lo[idx][0], src_hi[idx][0]))
+                staging = Cube.unpack_array_into(cube_bytes, out, staging, full_shape, sub_box)
+            self._codec_local.staging = staging
+
+        # Cuboids never overlap in out_cube so they can be decompressed in parallel
+        self._codec_map(unpack_cuboid, list(range(len(cuboids))))
 
     # Lambda Page In Methods
     def page_in_cubes(self, key_list, timeout=60):
@@ -193,17 +397,86 @@ class SpatialDB:
         Returns:
             None
         """
+        for _ in self.page_in_cubes_iter(key_list, timeout):
+            pass
+
+    def page_in_cubes_iter(self, key_list, timeout=60):
+        """
+        Generator that triggers the page-in of cubes from the object store, yielding keys as they become available
+
+        Keys still missing after get_page_in_hedge_delay() seconds are read directly from the object store instead of
+        waiting on the rest of the page in.
+
+        Args:
+            key_list (list(str)): List of cached-cuboid keys to page in from the object store
+            timeout (int): Number of seconds page in which the operation should complete before an error is raised
+
+        Returns:
+            (list(str)): Yields lists of cached-cuboid keys that are now in the cache
+        """
         # Setup status channel
-        page_in_chan = self.cache_state.create_page_in_channel()
+        page_in_chan, listener = self.cache_state.create_page_in_channel()
+        try:
+            # Trigger page in operations
+            start_time = time.time()
+            self.objectio.page_in_objects(key_list, page_in_chan, self.kv_config, self.state_conf)
+
+            hedge_delay = self.get_page_in_hedge_delay()
+            deadline = None if hedge_delay is None else start_time + hedge_delay
+
+            # Wait for page in operations to complete. Completion messages carry cached-cuboid keys
+            missing_keys = set(key_list)
+            for paged_in_keys in self.cache_state.iter_page_in(key_list, page_in_chan, listener, timeout,
+                                                                  deadline):
+                if paged_in_keys:
+                    self._page_in_latencies.append(time.time() - start_time)
+                    missing_keys.difference_update(paged_in_keys)
+                    yield paged_in_keys
+                else:
+                    # Page in is slower than usual, so read the rest directly. If a page in finishes first it
+                    # writes the same data to the cache
+                    hedge_keys = [key for key in key_list if key in missing_keys]
+                    self.page_in_cubes_direct(hedge_keys)
+                    yield hedge_keys
+                    break
+        finally:
+            self.cache_state.delete_page_in_channel(page_in_chan, listener)
+
+    def page_in_cubes_direct(self, key_list):
+        """
+        Method to read cubes from the object store and write them to the cache database
+
+        Args:
+            key_list (list(str)): List of cached-cuboid keys to page in from the object store
+
+        Returns:
+            None
+        """
+        # Convert cuboid-cache keys to object keys
+        temp_keys = self.objectio.cached_cuboid_to_object_keys(key_list)
 
-        # Trigger page in operations
-        object_keys = self.objectio.page_in_objects(key_list, page_in_chan, self.kv_config, self.state_conf)
+        # Get objects
+        temp_cubes = self.objectio.get_objects(temp_keys)
 
-        # Wait for page in operation to complete
-        self.cache_state.wait_for_page_in(object_keys, page_in_chan, timeout)
+        # write to cache
+        self.kvio.put_cubes(key_list, temp_cubes)
 
-        # If you got here everything successfully paged in!
-        self.cache_state.delete_page_in_channel(page_in_chan)
+    def get_page_in_hedge_delay(self):
+        """
+        Method to get the number of seconds after triggering a lambda page in that missing keys are read directly
+
+        Returns:
+            (float): The page_in_hedge_percentile of recent page in latencies, page_in_hedge_delay if there are not
+                     enough samples yet, or None if hedging is disabled
+        """
+        if self.page_in_hedge_percentile is None:
+            return None
+
+        latencies = list(self._page_in_latencies)
+        if len(latencies) < self.page_in_hedge_min_samples:
+            return self.page_in_hedge_delay
+
+        return float(np.percentile(latencies, self.page_in_hedge_percentile))
 
     def page_object_into_cache(self, object_key, page_in_channel):
         """Move compressed byte array from the object store to the cache database
@@ -220,12 +493,91 @@ class SpatialDB:
 
         # Write data to read-cache
         key_list = self.objectio.object_to_cached_cuboid_keys([object_key])
-        self.kvio.put_cubes(key_list, [data])
+        self.kvio.put_cubes(key_list, data)
 
         # Notify complete
         self.cache_state.notify_page_in_complete(page_in_channel, key_list[0])
 
+    def page_objects_into_cache(self, object_keys, page_in_channel):
+        """Move a batch of compressed byte arrays from the object store to the cache database
+
+        Objects are fetched concurrently and written to the cache in one round trip, then a single completion message
+        is sent for the whole batch.
+
+        Args:
+            object_keys (list(str)): Object keys for the cuboids that are being moved to the cache
+            page_in_channel (str): Page in channel for the current operation
+
+        Returns:
+            None
+        """
+        # Get Cube data from object store
+        data = self.objectio.get_objects(object_keys)
+
+        # Write data to read-cache
+        key_list = self.objectio.object_to_cached_cuboid_keys(object_keys)
+        self.kvio.put_cubes(key_list, data)
+
+        # Notify complete
+        self.cache_state.notify_page_in_batch_complete(page_in_channel, key_list)
+
     # Status Methods
+    def wait_for_clean_cubes(self, cache_keys):
+        """Generator that yields cached-cuboid keys as the cuboids they represent are flushed from the write buffer
+
+        Keys that are already clean are yielded immediately. While cuboids remain dirty this blocks on cuboid clean
+        events from the cache state db, falling back to polling if events are not available.
+
+        Args:
+            cache_keys (list(str)): A list of cached-cuboid keys
+
+        Returns:
+            (list(str)): Yields lists of cached-cuboid keys that are now clean
+
+        Raises:
+            (SpdbError): If all cuboids are not clean before the dirty_read_timeout elapses
+        """
+        dirty_keys = list(cache_keys)
+        listener = None
+        subscribed = False
+        start_time = datetime.now()
+        try:
+            while dirty_keys:
+                dirty_flags = self.kvio.is_dirty(dirty_keys)
+                dirty_keys_temp, clean_keys = [], []
+                for key, flag in zip(dirty_keys, dirty_flags):
+                    (dirty_keys_temp if flag else clean_keys).append(key)
+                dirty_keys = dirty_keys_temp
+
+                if clean_keys:
+                    yield clean_keys
+
+                if not dirty_keys:
+                    break
+
+                if not subscribed:
+                    # Subscribe and then re-check immediately so a flush that happened in between is not missed
+                    subscribed = True
+                    listener = self.cache_state.subscribe_cuboid_clean(dirty_keys)
+                    if listener:
+                        continue
+
+                remaining = self.dirty_read_timeout - (datetime.now() - start_time).total_seconds()
+                if remaining <= 0:
+                    # Took too long! Something must have crashed
+                    raise SpdbError('{} second timeout reached while waiting for dirty cubes to be flushed.'.format(
+                        self.dirty_read_timeout),
+                        ErrorCodes.ASYNC_ERROR)
+
+                if listener:
+                    self.cache_state.wait_for_cuboid_clean(listener, min(remaining, self.dirty_event_interval))
+                else:
+                    # Sleep a bit so you don't kill the DB
+                    time.sleep(self.dirty_poll_interval)
+        finally:
+            if listener:
+                self.cache_state.unsubscribe_cuboid_clean(listener)
+
     def resource_locked(self, lookup_key):
         """
         Method to check if a given channel is locked for writing due to an error
@@ -340,7 +692,8 @@ class SpatialDB:
         return result_tuple(effcorner, effdim, None, None)
 
     # Main Interface Methods
-    def cutout(self, resource, corner, extent, resolution, time_sample_range=None, filter_ids=None, iso=False, no_cache=False):
+    def cutout(self, resource, corner, extent, resolution, time_sample_range=None, filter_ids=None, iso=False, no_cache=False,
+               out=None, read_your_writes=False):
         """Extract a cube of arbitrary size. Need not be aligned to cuboid boundaries.
 
         corner represents the location of the cutout and extent the size.  As an example in 1D, if asking for
@@ -358,17 +711,19 @@ class SpatialDB:
             filter_ids (optional[list]): Defaults to None. Otherwise, is a list of uint64 ids to filter cutout by.
             iso (bool): Flag indicating if you want to get to the "isotropic" version of a cuboid, if available
             no_cache (bool): True to read directly from S3 and bypass the cache.
+            out (optional[np.ndarray]): Defaults to None. Otherwise, the buffer to assemble the cutout in, shaped
+                                        [time, z, y, x] with the resource's data type. May be an ndarray, an
+                                        np.memmap or an object exposing a buffer via a "buf" attribute, like a
+                                        multiprocessing.shared_memory.SharedMemory instance.
+            read_your_writes (bool): True to merge in writes still pending in the write buffer instead of waiting for
+                                     them to be flushed
 
         Returns:
-            cube.Cube: The cutout data stored in a Cube instance
+            cube.Cube: The cutout data stored in a Cube instance. If out is provided, the Cube's data is a view of it
 
         Raises:
             (SPDBError):
         """
-        boss_logger = BossLogger()
-        boss_logger.setLevel("info")
-        blog = boss_logger.logger
-
         if not time_sample_range:
             # If not time sample list defined, used default of 0
             time_sample_range = [0, 1]
@@ -430,261 +785,572 @@ class SpatialDB:
             # Create namedtuple for consistency with re-sampling paths through the code
             cutout_coords = result_tuple(corner, extent, None, None)
 
+        # Initialize the final output cube at exactly the requested extent
+        if out is None:
+            out_cube = Cube.create_cube(resource, list(cutout_coords.extent), time_sample_range)
+        else:
+            out_data = self._get_output_buffer(out,
+                                               [time_sample_range[1] - time_sample_range[0]] +
+                                               list(cutout_coords.extent[::-1]),
+                                               resource.get_numpy_data_type())
+            out_data.fill(0)
+
+            out_cube = Cube.create_cube(resource, [1, 1, 1], time_sample_range)
+            out_cube.set_data(out_data)
+            out_cube.z_dim, out_cube.y_dim, out_cube.x_dim = out_cube.cube_size = list(out_data.shape[1:])
+
+        # Build a list of indexes to access, sorted in Morton order
+        list_of_idxs = self._get_cutout_morton_ids(cutout_coords.corner, cutout_coords.extent, cube_dim)
+
+        # Get all cuboids, whether or not the cache was used
+        cuboids = self._get_cutout_cuboids(resource, cutout_resolution, time_sample_range, list_of_idxs, iso=iso,
+                                           no_cache=no_cache, read_your_writes=read_your_writes)
+
+        # Decompress all cuboids directly into the final cube of data
+        self._add_cuboids_to_cube(out_cube, cuboids, cutout_coords.corner, cube_dim)
+
+        # A smaller cube was cutout due to off-base resolution query: up-sample and trim
+        base_res = channel.base_resolution
+        if not channel.is_image() and base_res > resolution and not resource.is_downsampled():
+            raise SpdbError('Not Implemented',
+                            'Dynamic resolution up-sampling not yet implemented.',
+                            ErrorCodes.FUTURE)
+            # TODO: implement dynamic re-sampling
+            # out_cube.zoomData(base_res - resolution)
+
+            # need to trim based on the cube cutout at new resolution
+            # out_cube.trim(corner[0] % (x_cube_dim * (2 ** (base_res - resolution))) + cutout_coords.x_pixel_offset,
+            #               extent[0],
+            #               corner[1] % (y_cube_dim * (2 ** (base_res - resolution))) + cutout_coords.y_pixel_offset,
+            #               extent[1],
+            #               corner[2] % z_cube_dim,
+            #               extent[2])
+
+        # A larger cube was cutout due to off-base resolution query: down-sample and trim
+        elif not channel.is_image() and base_res < resolution and not resource.is_downsampled():
+            raise SpdbError('Not Implemented',
+                            'Dynamic resolution down-sampling not yet implemented.',
+                            ErrorCodes.FUTURE)
+            # out_cube.downScale(resolution - base_res)
+            # # need to trim based on the cube cutout at new resolution
+            # out_cube.trim(corner[0] % (x_cube_dim * (2 ** (base_res - resolution))),
+            #               extent[0],
+            #               corner[1] % (y_cube_dim * (2 ** (base_res - resolution))),
+            #               extent[1],
+            #               corner[2] % z_cube_dim,
+            #               extent[2])
+
+        # Filter out ids not in list.
+        if filter_ids is not None:
+            self._filter_cube(out_cube, filter_ids)
+
+        return out_cube
+
+    @staticmethod
+    def _get_cutout_morton_ids(corner, extent, cube_dim):
+        """Get the morton ids of the cuboids overlapping a region
+
+        Args:
+            corner ((int, int, int)): the xyz location of the corner of the region
+            extent ((int, int, int)): the xyz extents
+            cube_dim (list(int)): The x, y, z dimensions of a cuboid
+
+        Returns:
+            (list(int)): The morton ids, sorted
+        """
+        [x_cube_dim, y_cube_dim, z_cube_dim] = cube_dim
+
         # Round to the nearest larger cube in all dimensions
-        z_start = cutout_coords.corner[2] // z_cube_dim
-        y_start = cutout_coords.corner[1] // y_cube_dim
-        x_start = cutout_coords.corner[0] // x_cube_dim
-
-        z_num_cubes = (cutout_coords.corner[2] + cutout_coords.extent[2] + z_cube_dim - 1) // z_cube_dim - z_start
-        y_num_cubes = (cutout_coords.corner[1] + cutout_coords.extent[1] + y_cube_dim - 1) // y_cube_dim - y_start
-        x_num_cubes = (cutout_coords.corner[0] + cutout_coords.extent[0] + x_cube_dim - 1) // x_cube_dim - x_start
-
-        # Initialize the final output cube (before trim operation since adding full cuboids)
-        out_cube = Cube.create_cube(resource,
-                                    [x_num_cubes * x_cube_dim, y_num_cubes * y_cube_dim, z_num_cubes * z_cube_dim],
-                                    time_sample_range)
-
-        # Build a list of indexes to access
-        # TODO: Move this for loop directly into c-lib
-        list_of_idxs = []
-        for z in range(z_num_cubes):
-            for y in range(y_num_cubes):
-                for x in range(x_num_cubes):
-                    morton_idx = ndlib.XYZMorton([x + x_start, y + y_start, z + z_start])
-                    list_of_idxs.append(morton_idx)
-
-        # Sort the indexes in Morton order
-        list_of_idxs.sort()
-
-        # xyz offset stored for later use
-        lowxyz = ndlib.MortonXYZ(list_of_idxs[0])
-
-        # Get index of missing keys for cuboids to read
-        missing_key_idx, cached_key_idx, all_keys = self.kvio.get_missing_read_cache_keys(resource,
-                                                                                          cutout_resolution,
-                                                                                          time_sample_range,
-                                                                                          list_of_idxs,
-                                                                                          iso=iso)
-        # Wait for cuboids that are currently being written to finish
-        start_time = datetime.now()
-        dirty_keys = all_keys
-        blog.debug("Waiting for {} writes to finish before read can complete".format(len(dirty_keys)))
-        while dirty_keys:
-            dirty_flags = self.kvio.is_dirty(dirty_keys)
-            dirty_keys_temp, clean_keys = [], []
-            for key, flag in zip(dirty_keys, dirty_flags):
-                (dirty_keys_temp if flag else clean_keys).append(key)
-            dirty_keys = dirty_keys_temp
-
-            if (datetime.now() - start_time).seconds > self.dirty_read_timeout:
-                # Took too long! Something must have crashed
-                raise SpdbError('{} second timeout reached while waiting for dirty cubes to be flushed.'.format(
-                    self.dirty_read_timeout),
-                                ErrorCodes.ASYNC_ERROR)
-            # Sleep a bit so you don't kill the DB
-            time.sleep(0.05)
-
-        #
-        # All dirty cubes flushed, can begin reading.
-        #
+        z_start = corner[2] // z_cube_dim
+        y_start = corner[1] // y_cube_dim
+        x_start = corner[0] // x_cube_dim
+
+        z_num_cubes = (corner[2] + extent[2] + z_cube_dim - 1) // z_cube_dim - z_start
+        y_num_cubes = (corner[1] + extent[1] + y_cube_dim - 1) // y_cube_dim - y_start
+        x_num_cubes = (corner[0] + extent[0] + x_cube_dim - 1) // x_cube_dim - x_start
 
+        cuboid_xyz = np.indices((x_num_cubes, y_num_cubes, z_num_cubes)).reshape(3, -1).T
+        cuboid_xyz += [x_start, y_start, z_start]
+        return np.sort(ndlib.XYZMorton_array(cuboid_xyz)).tolist()
+
+    def _get_cutout_cuboids(self, resource, resolution, time_sample_range, list_of_idxs, iso=False, no_cache=False,
+                            read_your_writes=False):
+        """Get the data of the cuboids needed for a cutout from the cache or object store
+
+        Cuboids that are missing from the cache are paged in, and dirty cuboids are waited on. Cuboids that don't
+        exist are not returned.
+
+        If read_your_writes is set, dirty cuboids are not waited on. Their pending writes are read from the write
+        buffer instead and merged over the cuboid's current data, the same way the page out flush does. Dirty cuboids
+        missing from the cache are read directly from the object store, since paging them in could race the flush.
+
+        Args:
+            resource (spdb.project.BossResource): Data model info based on the request or target resource
+            resolution (int): the resolution level
+            time_sample_range (list((int)):  a range of time samples to get [start, stop)
+            list_of_idxs (list(int)): The morton ids of the cuboids
+            iso (bool): Flag indicating if you want to get to the "isotropic" version of a cuboid, if available
+            no_cache (bool): True to read directly from S3 and bypass the cache.
+            read_your_writes (bool): True to merge in writes pending in the write buffer instead of waiting on them
+
+        Returns:
+            (list((int, int, bytes|np.ndarray))): Tuples of the morton id, time sample and either the blosc
+            compressed byte array or the decompressed array of each cuboid
+        """
+        boss_logger = BossLogger()
+        boss_logger.setLevel("info")
+        blog = boss_logger.logger
+
+        # (morton, time sample, blosc compressed bytes) for each cuboid with data. Cuboids that don't exist are left
+        # as zeros in out_cube
         s3_key_idx = []
         cache_cuboids = []
         s3_cuboids = []
-        zero_cuboids = []
+        # True if s3_cuboids were read as their page in completed
+        paged_in = False
+        # Index of dirty keys read with their pending writes, if read_your_writes
+        write_key_idx = []
 
+        all_keys = self.kvio.generate_cached_cuboid_keys(resource, resolution, list(range(*time_sample_range)),
+                                                         list_of_idxs, iso=iso)
         if no_cache:
+            if read_your_writes:
+                write_key_idx = [idx for idx, dirty in enumerate(self.kvio.is_dirty(all_keys)) if dirty]
+            else:
+                # Wait for cuboids that are currently being written to finish
+                blog.debug("Waiting for writes to finish on {} cuboids before read can complete".format(
+                    len(all_keys)))
+                for _ in self.wait_for_clean_cubes(all_keys):
+                    pass
+
             # If not using the cache, then consider all keys are missing.
             blog.debug("Bypassing cache; loading all cuboids directly from S3")
             missing_key_idx = [i for i in range(len(all_keys))]
+        else:
+            # Check and read all cuboids in one round trip. Dirty cuboids are checked again once their writes finish.
+            # If using the cuboid cache, only version stamps are read and data is read for cuboid cache misses
+            missing_key_idx = []
+            pending_key_idx = list(range(len(all_keys)))
+            while pending_key_idx:
+                pending_keys = [all_keys[idx] for idx in pending_key_idx]
+                status, rows, versions = self.kvio.get_clean_cubes(pending_keys, data=self.cuboid_cache is None,
+                                                                   versions=self.cuboid_cache is not None)
+
+                clean_keys = []
+                clean_versions = []
+                dirty_key_idx = []
+                for idx, key, cube_status, cube_bytes, version in zip(pending_key_idx, pending_keys, status, rows,
+                                                                      versions):
+                    if cube_status == RedisKVIO.CUBE_MISSING:
+                        missing_key_idx.append(idx)
+                    elif cube_status == RedisKVIO.CUBE_DIRTY and read_your_writes:
+                        write_key_idx.append(idx)
+                    elif cube_status == RedisKVIO.CUBE_DIRTY:
+                        dirty_key_idx.append(idx)
+                    elif self.cuboid_cache is not None:
+                        clean_keys.append(key)
+                        clean_versions.append(version)
+                    else:
+                        vals = key.rsplit("&", 2)
+                        cache_cuboids.append((int(vals[2]), int(vals[1]), cube_bytes))
+
+                if clean_keys:
+                    cache_cuboids.extend(self._get_cache_cuboids(resource, clean_keys, clean_versions))
+
+                # Wait for cuboids that are currently being written to finish
+                if dirty_key_idx:
+                    blog.debug("Waiting for writes to finish on {} cuboids before read can complete".format(
+                        len(dirty_key_idx)))
+                    for _ in self.wait_for_clean_cubes([all_keys[idx] for idx in dirty_key_idx]):
+                        pass
+                pending_key_idx = dirty_key_idx
+
+        # Pending writes must be read before the data they are merged over, so a flush in between isn't missed
+        pending_writes = {}
+        direct_key_idx = []
+        if write_key_idx:
+            blog.debug("Reading pending writes on {} cuboids".format(len(write_key_idx)))
+            rows, writes = self.kvio.get_pending_writes([all_keys[idx] for idx in write_key_idx])
+            for idx, cube_bytes, write_list in zip(write_key_idx, rows, writes):
+                vals = all_keys[idx].rsplit("&", 2)
+                cuboid = (int(vals[2]), int(vals[1]))
+                if write_list:
+                    pending_writes[cuboid] = write_list
+
+                if no_cache:
+                    continue
+                elif cube_bytes:
+                    cache_cuboids.append(cuboid + (cube_bytes,))
+                else:
+                    direct_key_idx.append(idx)
+
+        # Dirty cuboids missing from the cache
+        if len(direct_key_idx) > 0:
+            direct_s3_key_idx, _ = self.objectio.cuboids_exist(all_keys, direct_key_idx)
+            if len(direct_s3_key_idx) > 0:
+                s3_cuboids.extend(self._get_object_cuboids([all_keys[idx] for idx in direct_s3_key_idx]))
 
         if len(missing_key_idx) > 0:
             # There are keys that are missing in the cache
+            # Skip the S3 index for keys recently found to be empty
+            empty_markers = not no_cache and self.kvio.empty_cubes_enabled()
+            if empty_markers:
+                empty_cubes = self.kvio.get_empty_cubes([all_keys[idx] for idx in missing_key_idx])
+                check_key_idx = [idx for idx, empty in zip(missing_key_idx, empty_cubes) if not empty]
+            else:
+                check_key_idx = missing_key_idx
+
+            # Read versions before the S3 index so a page out finishing during the lookup isn't marked empty
+            check_versions = {}
+            if empty_markers and len(check_key_idx) > 0:
+                versions = self.kvio.get_cube_versions([all_keys[idx] for idx in check_key_idx])
+                check_versions = dict(zip(check_key_idx, versions))
+
             # Get index of missing keys that are in S3
-            s3_key_idx, zero_key_idx = self.objectio.cuboids_exist(all_keys, missing_key_idx)
+            if len(check_key_idx) > 0:
+                s3_key_idx, zero_key_idx = self.objectio.cuboids_exist(all_keys, check_key_idx)
+            else:
+                s3_key_idx, zero_key_idx = [], []
+
+            if empty_markers:
+                self.kvio.set_empty_cubes([all_keys[idx] for idx in zero_key_idx],
+                                          [check_versions[idx] for idx in zero_key_idx])
 
             if len(s3_key_idx) > 0:
                 if no_cache:
-                    temp_keys = self.objectio.cached_cuboid_to_object_keys(itemgetter(*s3_key_idx)(all_keys))
-
-                    # Get objects
-                    temp_cubes = self.objectio.get_objects(temp_keys)
-                    # keys will be just the morton id and time sample.
-                    keys_and_cubes = []
-                    for key, cube in zip(temp_keys, temp_cubes):
-                        vals = key.split("&")
-                        keys_and_cubes.append((int(vals[-1]), int(vals[-2]), cube))
-                    s3_cuboids = self.sort_cubes(resource, keys_and_cubes)
+                    s3_cuboids.extend(self._get_object_cuboids([all_keys[idx] for idx in s3_key_idx]))
                 else:
                     # Load data into cache.
                     blog.debug("Data missing from cache, but present in S3")
 
                     if len(s3_key_idx) > self.read_lambda_threshold:
-                        # Trigger page-in of available blocks from object store and wait for completion
+                        # Trigger page-in of available blocks from object store. Cuboids are read and decompressed
+                        # as each page in completes, while the rest are still being paged in
                         blog.debug("Triggering Lambda Page-in")
-                        self.page_in_cubes(itemgetter(*s3_key_idx)(all_keys))
+                        for paged_in_keys in self.page_in_cubes_iter([all_keys[idx] for idx in s3_key_idx]):
+                            s3_cuboids.extend(self._get_decoded_cache_cuboids(resource, paged_in_keys))
+                        paged_in = True
                     else:
                         # Read cuboids from S3 into cache directly
-                        # Convert cuboid-cache keys to object keys
                         blog.debug("Paging-in Keys Directly")
-                        temp_keys = self.objectio.cached_cuboid_to_object_keys(itemgetter(*s3_key_idx)(all_keys))
-
-                        # Get objects
-                        temp_cubes = self.objectio.get_objects(temp_keys)
-
-                        # write to cache
                         blog.debug("put keys on direct page in: {}".format(itemgetter(*s3_key_idx)(all_keys)))
-                        self.kvio.put_cubes(itemgetter(*s3_key_idx)(all_keys), temp_cubes)
+                        self.page_in_cubes_direct([all_keys[idx] for idx in s3_key_idx])
 
             if len(zero_key_idx) > 0:
+                # Keys that don't exist in object store render as zeros, which out_cube is already initialized to
                 if not no_cache:
                     blog.debug("Data missing in cache, but not in S3")
                 else:
-                    blog.debug("No data for some keys, making cuboids with zeros")
-
-                # Keys that don't exist in object store render as zeros
-                [x_cube_dim, y_cube_dim, z_cube_dim] = CUBOIDSIZE[resolution]
-                for idx in zero_key_idx:
-                    parts, m_id = all_keys[idx].rsplit("&", 1)
-                    _, t_start = parts.rsplit("&", 1)
-                    temp_cube = Cube.create_cube(resource, [x_cube_dim, y_cube_dim, z_cube_dim], [int(t_start), int(t_start) + 1])
-                    temp_cube.morton_id = int(m_id)
-                    temp_cube.zeros()
-                    zero_cuboids.append(temp_cube)
-
-        # Get cubes from the cache database (either already there or freshly paged in)
+                    blog.debug("No data for some keys, leaving cuboids as zeros")
+
+        # Get cubes from the cache database that were freshly paged in
         if not no_cache:
-            # TODO: Optimize access to cache data and checking for dirty cubes
             if len(s3_key_idx) > 0:
-                blog.debug("Get cubes from cache that were paged in from S3")
-                blog.debug(itemgetter(*s3_key_idx)(all_keys))
+                if not paged_in:
+                    blog.debug("Get cubes from cache that were paged in from S3")
+                    blog.debug(itemgetter(*s3_key_idx)(all_keys))
 
-                s3_cuboids = self.get_cubes(resource, itemgetter(*s3_key_idx)(all_keys))
+                    s3_keys_list = itemgetter(*s3_key_idx)(all_keys)
+                    if isinstance(s3_keys_list, str):
+                        s3_keys_list = [s3_keys_list]
+                    s3_cuboids.extend(self.kvio.get_cubes(s3_keys_list))
 
                 # Record misses that were found in S3 for possible pre-fetching
                 self.cache_state.add_cache_misses(itemgetter(*s3_key_idx)(all_keys))
 
-            # Get previously cached cubes, waiting for dirty cubes to be updated if needed
-            if len(cached_key_idx) > 0:
-                blog.debug("Get cubes that were already present in the cache")
-
-                # Get the cached keys once in list form
-                cached_keys_list = itemgetter(*cached_key_idx)(all_keys)
-                if isinstance(cached_keys_list, str):
-                    cached_keys_list = [cached_keys_list]
-                if isinstance(cached_keys_list, tuple):
-                    cached_keys_list = list(cached_keys_list)
-
-                # Split clean and dirty keys
-                dirty_flags = self.kvio.is_dirty(cached_keys_list)
-                dirty_keys, clean_keys = [], []
-                for key, flag in zip(cached_keys_list, dirty_flags):
-                    (dirty_keys if flag else clean_keys).append(key)
-
-                # Get all the clean cubes immediately, removing them from the list of cached keys to get
-                for k in clean_keys:
-                    cached_keys_list.remove(k)
-                cache_cuboids.extend(self.get_cubes(resource, clean_keys))
-
-                # Get the dirty ones when you can with a timeout
-                start_time = datetime.now()
-                while dirty_keys:
-                    dirty_flags = self.kvio.is_dirty(cached_keys_list)
-                    dirty_keys, clean_keys = [], []
-                    for key, flag in zip(cached_keys_list, dirty_flags):
-                        (dirty_keys if flag else clean_keys).append(key)
-
-                    if clean_keys:
-                        # Some keys are ready now. Remove from list and get them
-                        for k in clean_keys:
-                            cached_keys_list.remove(k)
-                        cache_cuboids.extend(self.get_cubes(resource, clean_keys))
-
-                    if (datetime.now() - start_time).seconds > self.dirty_read_timeout:
-                        # Took too long! Something must have crashed
-                        raise SpdbError('{} second timeout reached while waiting for dirty cubes to be flushed.'.format(self.dirty_read_timeout),
-                                        ErrorCodes.ASYNC_ERROR)
+        cuboids = cache_cuboids + s3_cuboids
+        if pending_writes:
+            cuboids = self._apply_pending_writes(resource, resolution, cuboids, pending_writes)
 
-                    # Sleep a bit so you don't kill the DB
-                    time.sleep(0.05)
+        return cuboids
 
-        #
-        # At this point, have all cuboids whether or not the cache was used.
-        #
+    def _get_decoded_cache_cuboids(self, resource, key_list):
+        """Load cuboids from the cache key-value store and decompress them
 
-        # Add all cuboids (which have all time samples packed in already) to final cube of data
-        for cube in cache_cuboids + s3_cuboids + zero_cuboids:
-            # Compute offset so data inserted properly
-            curxyz = ndlib.MortonXYZ(cube.morton_id)
-            offset = [curxyz[0] - lowxyz[0], curxyz[1] - lowxyz[1], curxyz[2] - lowxyz[2]]
+        Args:
+            resource (spdb.project.BossResource): Data model info based on the request or target resource
+            key_list (list(str)): List of cached-cuboid keys to read from the database
 
-            # add it to the output cube
-            out_cube.add_data(cube, offset)
+        Returns:
+            (list((int, int, np.ndarray))): Tuples of the morton id, time sample and decompressed array of each cuboid
+        """
+        dtype = resource.get_numpy_data_type()
 
-        # A smaller cube was cutout due to off-base resolution query: up-sample and trim
-        base_res = channel.base_resolution
-        if not channel.is_image() and base_res > resolution and not resource.is_downsampled():
-            raise SpdbError('Not Implemented',
-                            'Dynamic resolution up-sampling not yet implemented.',
-                            ErrorCodes.FUTURE)
-            # TODO: implement dynamic re-sampling
-            # out_cube.zoomData(base_res - resolution)
+        def decode_cuboid(item):
+            key, (morton, time_sample, cube_bytes) = item
+            [x_cube_dim, y_cube_dim, z_cube_dim] = CUBOIDSIZE[int(key.rsplit("&", 3)[1])]
+            data = np.empty((1, z_cube_dim, y_cube_dim, x_cube_dim), dtype=dtype)
+            Cube.unpack_array_into(cube_bytes, data)
+            return morton, time_sample, data
 
-            # need to trim based on the cube cutout at new resolution
-            # out_cube.trim(corner[0] % (x_cube_dim * (2 ** (base_res - resolution))) + cutout_coords.x_pixel_offset,
-            #               extent[0],
-            #               corner[1] % (y_cube_dim * (2 ** (base_res - resolution))) + cutout_coords.y_pixel_offset,
-            #               extent[1],
-            #               corner[2] % z_cube_dim,
-            #               extent[2])
+        return self._codec_map(decode_cuboid, list(zip(key_list, self.kvio.get_cubes(key_list))))
 
-        # A larger cube was cutout due to off-base resolution query: down-sample and trim
-        elif not channel.is_image() and base_res < resolution and not resource.is_downsampled():
+    def _get_object_cuboids(self, key_list):
+        """Read cuboids directly from the object store
+
+        Args:
+            key_list (list(str)): cached-cuboid keys of cuboids that exist in the object store
+
+        Returns:
+            (list((int, int, bytes))): Tuples of the morton id, time sample and blosc compressed byte array of each
+            cuboid
+        """
+        temp_keys = self.objectio.cached_cuboid_to_object_keys(key_list)
+
+        # Get objects
+        temp_cubes = self.objectio.get_objects(temp_keys)
+
+        # keys will be just the morton id and time sample.
+        cuboids = []
+        for key, cube in zip(temp_keys, temp_cubes):
+            vals = key.split("&")
+            cuboids.append((int(vals[-1]), int(vals[-2]), cube))
+        return cuboids
+
+    def _apply_pending_writes(self, resource, resolution, cuboids, pending_writes):
+        """Merge pending writes over cuboids, with the same overwrite semantics as the page out flush
+
+        Args:
+            resource (spdb.project.BossResource): Data model info based on the request or target resource
+            resolution (int): the resolution level
+            cuboids (list((int, int, bytes|np.ndarray))): Tuples of the morton id, time sample and data of each cuboid
+            pending_writes (dict): The blosc compressed writes pending for each (morton id, time sample), oldest first
+
+        Returns:
+            (list((int, int, bytes|np.ndarray))): The cuboids, with the decompressed merged data of cuboids that had
+            pending writes. Cuboids that only exist in the write buffer are added
+        """
+        cube_dim = CUBOIDSIZE[resolution]
+        existing = set((morton, time_sample) for morton, time_sample, _ in cuboids)
+        cuboids = cuboids + [cuboid + (None,) for cuboid in pending_writes if cuboid not in existing]
+
+        def merge_cuboid(cuboid):
+            morton, time_sample, cube_data = cuboid
+            write_list = pending_writes.get((morton, time_sample))
+            if not write_list:
+                return cuboid
+
+            cube = Cube.create_cube(resource, cube_dim)
+            if isinstance(cube_data, np.ndarray):
+                cube.data = cube_data.copy()
+            elif cube_data is not None:
+                cube.from_blosc([cube_data])
+
+            write_cube = Cube.create_cube(resource, cube_dim)
+            for write_bytes in write_list:
+                write_cube.from_blosc([write_bytes])
+                cube.overwrite(write_cube.data)
+            return morton, time_sample, cube.data
+
+        return self._codec_map(merge_cuboid, cuboids)
+
+    @staticmethod
+    def _filter_cube(cube, filter_ids):
+        """Remove all ids not in filter_ids from a cube's data, in place if possible
+
+        Args:
+            cube (cube.Cube): The cube to filter
+            filter_ids (list): A list of uint64 ids to keep
+
+        Returns:
+            None
+        """
+        try:
+            filtered_data = ndlib.filter_ctype_OMP(cube.data, filter_ids)
+            if np.may_share_memory(filtered_data, cube.data):
+                cube.data = filtered_data
+            else:
+                # Filtered a copy, so keep the data in the original buffer
+                np.copyto(cube.data, filtered_data)
+        except ValueError as ve:
+            raise SpdbError(
+                'filter_ids probably not convertible to numpy uint64 array: {}'.format(ve),
+                ErrorCodes.DATATYPE_MISMATCH) from ve
+        except:
+            raise SpdbError('unknown error filtering cutout', ErrorCodes.SPDB_ERROR)
+
+    @staticmethod
+    def _get_output_buffer(out, shape, dtype):
+        """Get a writeable array over a caller provided cutout output buffer, verifying its shape and data type
+
+        Args:
+            out (np.ndarray): An ndarray (or np.memmap), or an object exposing a buffer via a "buf" attribute
+            shape (list(int)): The required [time, z, y, x] shape
+            dtype (np.dtype): The required data type
+
+        Returns:
+            (np.ndarray): The output array
+
+        Raises:
+            (SpdbError): If the buffer doesn't match the cutout
+        """
+        if not isinstance(out, np.ndarray):
+            try:
+                out = np.ndarray(shape, dtype=dtype, buffer=getattr(out, "buf", out))
+            except (TypeError, ValueError) as e:
+                raise SpdbError("Cutout output buffer can't hold a {} array of {}. {}".format(shape, np.dtype(dtype), e),
+                                ErrorCodes.DATATYPE_MISMATCH)
+
+        if out.dtype != dtype:
+            raise SpdbError("Cutout output buffer is {}, but the cutout is {}".format(out.dtype, np.dtype(dtype)),
+                            ErrorCodes.DATATYPE_MISMATCH)
+        if list(out.shape) != list(shape):
+            raise SpdbError("Cutout output buffer shape {} does not match the cutout shape {}".format(list(out.shape),
+                                                                                                   list(shape)),
+                            ErrorCodes.SPDB_ERROR)
+        if not out.flags.writeable:
+            raise SpdbError("Cutout output buffer is read-only", ErrorCodes.SPDB_ERROR)
+
+        return out
+
+    def cutout_many(self, resource, regions, resolution, time_sample_range=None, filter_ids=None, iso=False,
+                    no_cache=False, read_your_writes=False):
+        """Extract multiple cubes of arbitrary size, reading each cuboid only once
+
+        The union of cuboids overlapping the regions is fetched in a single pass (key generation, dirty check, page-in
+        and cache reads), and cuboids shared by multiple regions are decompressed once and copied into each output.
+
+        Args:
+            resource (spdb.project.BossResource): Data model info based on the request or target resource
+            regions (list(((int, int, int), (int, int, int)))): The xyz corner and xyz extent of each cutout
+            resolution (int): the resolution level
+            time_sample_range (list((int)):  a range of time samples to get [start, stop). Default is [0,1) if omitted
+            filter_ids (optional[list]): Defaults to None. Otherwise, is a list of uint64 ids to filter cutouts by.
+            iso (bool): Flag indicating if you want to get to the "isotropic" version of a cuboid, if available
+            no_cache (bool): True to read directly from S3 and bypass the cache.
+            read_your_writes (bool): True to merge in writes still pending in the write buffer instead of waiting for
+                                     them to be flushed
+
+        Returns:
+            (list(cube.Cube)): The cutout data of each region, in the same order as regions
+
+        Raises:
+            (SPDBError):
+        """
+        if not time_sample_range:
+            # If not time sample list defined, used default of 0
+            time_sample_range = [0, 1]
+
+        channel = resource.get_channel()
+        if not channel.is_image() and channel.base_resolution != resolution and not resource.is_downsampled():
             raise SpdbError('Not Implemented',
-                            'Dynamic resolution down-sampling not yet implemented.',
+                            'Dynamic resolution re-sampling not yet implemented.',
                             ErrorCodes.FUTURE)
-            # out_cube.downScale(resolution - base_res)
-            # # need to trim based on the cube cutout at new resolution
-            # out_cube.trim(corner[0] % (x_cube_dim * (2 ** (base_res - resolution))),
-            #               extent[0],
-            #               corner[1] % (y_cube_dim * (2 ** (base_res - resolution))),
-            #               extent[1],
-            #               corner[2] % z_cube_dim,
-            #               extent[2])
 
-        # Trim cube since cutout was not cuboid aligned
-        elif extent[0] % x_cube_dim == 0 and \
-             extent[1] % y_cube_dim == 0 and \
-             extent[2] % z_cube_dim == 0 and \
-             corner[0] % x_cube_dim == 0 and \
-             corner[1] % y_cube_dim == 0 and \
-             corner[2] % z_cube_dim == 0:
-            # Cube is already the correct dimensions
-            pass
-        else:
-            out_cube.trim(corner[0] % x_cube_dim,
-                          extent[0],
-                          corner[1] % y_cube_dim,
-                          extent[1],
-                          corner[2] % z_cube_dim,
-                          extent[2])
+        cube_dim = CUBOIDSIZE[resolution]
+        [x_cube_dim, y_cube_dim, z_cube_dim] = cube_dim
 
-        # Filter out ids not in list.
-        if filter_ids is not None:
-            try:
-                out_cube.data = ndlib.filter_ctype_OMP(out_cube.data, filter_ids)
-            except ValueError as ve:
-                raise SpdbError(
-                    'filter_ids probably not convertible to numpy uint64 array: {}'.format(ve),
-                    ErrorCodes.DATATYPE_MISMATCH) from ve
-            except:
-                raise SpdbError('unknown error filtering cutout', ErrorCodes.SPDB_ERROR)
+        # Get the union of cuboids needed
+        region_idxs = [self._get_cutout_morton_ids(corner, extent, cube_dim) for corner, extent in regions]
+        region_counts = collections.Counter(idx for idxs in region_idxs for idx in idxs)
+        cuboids = self._get_cutout_cuboids(resource, resolution, time_sample_range, sorted(region_counts), iso=iso,
+                                           no_cache=no_cache, read_your_writes=read_your_writes)
 
-        return out_cube
+        # Decompress cuboids shared by multiple regions once
+        dtype = resource.get_numpy_data_type()
+
+        def decode_cuboid(cuboid):
+            morton, time_sample, cube_bytes = cuboid
+            if isinstance(cube_bytes, np.ndarray) or region_counts[morton] < 2:
+                return cuboid
+
+            data = np.empty((1, z_cube_dim, y_cube_dim, x_cube_dim), dtype=dtype)
+            Cube.unpack_array_into(cube_bytes, data)
+            return morton, time_sample, data
+
+        cuboids_by_idx = collections.defaultdict(list)
+        for cuboid in self._codec_map(decode_cuboid, cuboids):
+            cuboids_by_idx[cuboid[0]].append(cuboid)
+
+        # Assemble each output from its cuboids
+        out_cubes = []
+        for (corner, extent), idxs in zip(regions, region_idxs):
+            out_cube = Cube.create_cube(resource, list(extent), time_sample_range)
+            self._add_cuboids_to_cube(out_cube, [cuboid for idx in idxs for cuboid in cuboids_by_idx[idx]], corner,
+                                      cube_dim)
+            if filter_ids is not None:
+                self._filter_cube(out_cube, filter_ids)
+            out_cubes.append(out_cube)
+
+        return out_cubes
+
+    def cutout_stream(self, resource, corner, extent, resolution, time_sample_range=None, filter_ids=None, iso=False,
+                      no_cache=False, slab_depth=None, prefetch=1, read_your_writes=False):
+        """Extract a cube of arbitrary size as a sequence of z-slabs, so the whole cutout is never held in memory
+
+        Each slab is a separate cutout covering the full x-y extent. Slab boundaries are aligned to multiples of
+        slab_depth, so slabs only share cuboids if slab_depth is not a multiple of the cuboid z dimension. Up to
+        prefetch slabs are cut out in the background while the caller consumes the current one, so peak memory is
+        proportional to (prefetch + 1) slabs.
+
+        Args:
+            resource (spdb.project.BossResource): Data model info based on the request or target resource
+            corner ((int, int, int)): the xyz location of the corner of the cutout
+            extent ((int, int, int)): the xyz extents
+            resolution (int): the resolution level
+            time_sample_range (list((int)):  a range of time samples to get [start, stop). Default is [0,1) if omitted
+            filter_ids (optional[list]): Defaults to None. Otherwise, is a list of uint64 ids to filter cutout by.
+            iso (bool): Flag indicating if you want to get to the "isotropic" version of a cuboid, if available
+            no_cache (bool): True to read directly from S3 and bypass the cache.
+            slab_depth (int): Max number of z slices in each slab. Defaults to the cuboid z dimension
+            prefetch (int): Number of slabs to cut out ahead of the caller. 0 disables prefetching
+            read_your_writes (bool): True to merge in writes still pending in the write buffer instead of waiting for
+                                     them to be flushed
+
+        Returns:
+            (generator): Yields a tuple of the xyz corner of the slab and a cube.Cube containing its data, in
+            increasing z order
+
+        Raises:
+            (SPDBError):
+        """
+        if slab_depth is None:
+            slab_depth = CUBOIDSIZE[resolution][2]
+        if slab_depth < 1 or prefetch < 0:
+            raise SpdbError("Invalid streaming cutout parameters. slab_depth: {}, prefetch: {}".format(slab_depth,
+                                                                                                     prefetch),
+                            ErrorCodes.SPDB_ERROR)
+
+        slabs = []
+        z_stop = corner[2] + extent[2]
+        z = corner[2]
+        while z < z_stop:
+            z_next = min((z // slab_depth + 1) * slab_depth, z_stop)
+            slabs.append(((corner[0], corner[1], z), (extent[0], extent[1], z_next - z)))
+            z = z_next
+
+        def cutout_slab(slab):
+            return self.cutout(resource, slab[0], slab[1], resolution, time_sample_range, filter_ids=filter_ids,
+                               iso=iso, no_cache=no_cache, read_your_writes=read_your_writes)
+
+        if prefetch == 0:
+            for slab in slabs:
+                yield slab[0], cutout_slab(slab)
+            return
+
+        pending = collections.deque()
+        executor = ThreadPoolExecutor(max_workers=prefetch)
+        try:
+            for slab in slabs:
+                pending.append((slab[0], executor.submit(cutout_slab, slab)))
+                if len(pending) > prefetch:
+                    slab_corner, future = pending.popleft()
+                    yield slab_corner, future.result()
+
+            while pending:
+                slab_corner, future = pending.popleft()
+                yield slab_corner, future.result()
+        finally:
+            # Stop reading ahead if the caller stops early
+            for _, future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
 
     def write_cuboid(self, resource, corner, resolution, cuboid_data, time_sample_start=0, iso=False):
         """ Write a 3D/4D volume to the key-value store. Used by API/cache in consistent mode as it reconciles writes
 
+        Only non-zero values are written, so cuboids where the data is all zeros are skipped entirely.
+
         If cuboid_data.ndim == 4, data in time-series format - assume t,z,y,x
         If cuboid_data.ndim == 3, data not in time-series format - assume z,y,x
 
@@ -698,7 +1364,7 @@ class SpatialDB:
             iso (bool): Flag indicating if you want to write to the "isotropic" version of a channel, if available
 
         Returns:
-            None
+            (int): Number of cuboids (per time sample) skipped because the data written to them was all zeros
         """
         boss_logger = BossLogger()
         boss_logger.setLevel("info")
@@ -744,15 +1410,6 @@ class SpatialDB:
 
         [x_offset, y_offset, z_offset] = list(map(mod, corner, cube_dim))
 
-        # Populate the data buffer
-        data_buffer = np.zeros([time_sample_stop - time_sample_start] +
-                               [z_num_cubes * z_cube_dim, y_num_cubes * y_cube_dim, x_num_cubes * x_cube_dim],
-                               dtype=cuboid_data.dtype, order="C")
-
-        data_buffer[:, z_offset:z_offset + dim[2],
-                       y_offset:y_offset + dim[1],
-                       x_offset:x_offset + dim[0]] = cuboid_data
-
         # Get keys ready
         experiment = resource.get_experiment()
         if iso is True and resolution > resource.get_isotropic_level() and experiment.hierarchy_method.lower() == "anisotropic":
@@ -764,67 +1421,99 @@ class SpatialDB:
 
         # Get current cube from db, merge with new cube, write back to the to db
         # TODO: Move splitting up data and computing morton into c-lib as single method
-        page_out_cnt = 0
-        for z in range(z_num_cubes):
-            for y in range(y_num_cubes):
-                for x in range(x_num_cubes):
-                    # Get the morton ID for the cube
-                    morton_idx = ndlib.XYZMorton([x + x_start, y + y_start, z + z_start])
-
-                    # Get sub-cube
-                    temp_cube = Cube.create_cube(resource, [x_cube_dim, y_cube_dim, z_cube_dim],
-                                                 [time_sample_start, time_sample_stop])
-                    temp_cube.data = np.ascontiguousarray(data_buffer[:,
-                                                          z * z_cube_dim:(z + 1) * z_cube_dim,
-                                                          y * y_cube_dim:(y + 1) * y_cube_dim,
-                                                          x * x_cube_dim:(x + 1) * x_cube_dim], dtype=data_buffer.dtype)
-
-                    # For each time sample put cube into write-buffer and add to temp page out key
-                    for t in range(time_sample_start, time_sample_stop):
-                        # Add cuboid to write buffer
-                        write_cuboid_key = self.kvio.insert_cube_in_write_buffer(base_write_cuboid_key, t, morton_idx,
-                                                                                 temp_cube.to_blosc_by_time_index(t))
-
-                        # Page Out Attempt Loop
-                        temp_page_out_key = "TEMP&{}".format(uuid.uuid4().hex)
-                        # Check for page out
-                        if self.cache_state.in_page_out(temp_page_out_key, resource.get_lookup_key(),
-                                                        resolution, morton_idx, t):
-                            blog.info("Writing Cuboid - Delayed Write: {}".format(write_cuboid_key))
-                            # Delay Write!
-                            self.cache_state.add_to_delayed_write(write_cuboid_key,
-                                                                  resource.get_lookup_key(),
-                                                                  resolution,
-                                                                  morton_idx,
-                                                                  t,
-                                                                  resource.to_json())
-                            # You are done. continue
-                        else:
-                            # Attempt to get write slot by checking page out
-                            in_page_out = self.cache_state.add_to_page_out(temp_page_out_key,
-                                                                           resource.get_lookup_key(),
-                                                                           resolution,
-                                                                           morton_idx,
-                                                                           t)
-
-                            if not in_page_out:
-                                # Good to trigger lambda!
-                                self.objectio.trigger_page_out({"kv_config": self.kv_config,
-                                                                "state_config": self.state_conf,
-                                                                "object_store_config": self.object_store_config},
-                                                               write_cuboid_key,
-                                                               resource)
-                                page_out_cnt += 1
-                                # All done. continue.
-                            else:
-                                # Ended up in page out during transaction. Make delayed write.
-                                blog.info("Writing Cuboid - Delayed Write: {}".format(write_cuboid_key))
-                                self.cache_state.add_to_delayed_write(write_cuboid_key,
-                                                                      resource.get_lookup_key(),
-                                                                      resolution,
-                                                                      morton_idx,
-                                                                      t, resource.to_json())
+        # Compute the morton IDs for every cube up front, indexed [z][y][x] to match the loop below
+        cuboid_zyx = np.indices((z_num_cubes, y_num_cubes, x_num_cubes)).reshape(3, -1).T
+        morton_ids = ndlib.XYZMorton_array(cuboid_zyx[:, ::-1] + [x_start, y_start, z_start])
+        morton_ids = morton_ids.reshape(z_num_cubes, y_num_cubes, x_num_cubes).tolist()
+
+        # Sub-cubes are compressed straight from views into cuboid_data when contiguous. Otherwise they are copied
+        # into a single cuboid sized staging buffer per codec thread, which is only zero padded for edge cuboids
+        packer = Cube.create_cube(resource, [1, 1, 1])
+        staging = threading.local()
+
+        def compress_cuboid(zyx):
+            # Get the sub-cube's bounds in cuboid_data, clipped to the data, and its placement in the cuboid
+            src = [slice(None)]
+            dst = [slice(0, 1)]
+            for idx, cube_len, offset, data_len in ((zyx[0], z_cube_dim, z_offset, dim[2]),
+                                                    (zyx[1], y_cube_dim, y_offset, dim[1]),
+                                                    (zyx[2], x_cube_dim, x_offset, dim[0])):
+                start = idx * cube_len - offset
+                src_start = max(start, 0)
+                src_stop = min(start + cube_len, data_len)
+                src.append(slice(src_start, src_stop))
+                dst.append(slice(src_start - start, src_stop - start))
+            sub_cube = cuboid_data[tuple(src)]
+            edge = sub_cube.shape[1:] != (z_cube_dim, y_cube_dim, x_cube_dim)
+
+            cuboid_bytes = []
+            for t_idx in range(time_sample_stop - time_sample_start):
+                sub_cube_t = sub_cube[t_idx:t_idx + 1]
+                if not sub_cube_t.any():
+                    # Only non-zero values overwrite, so an all-zero sub-cube would not change anything
+                    cuboid_bytes.append(None)
+                    continue
+
+                if edge or not sub_cube_t.flags.c_contiguous:
+                    buffer = getattr(staging, "buffer", None)
+                    if buffer is None:
+                        buffer = staging.buffer = np.empty([1, z_cube_dim, y_cube_dim, x_cube_dim],
+                                                           dtype=cuboid_data.dtype)
+                    if edge:
+                        buffer.fill(0)
+                    buffer[tuple(dst)] = sub_cube_t
+                    sub_cube_t = buffer
+                cuboid_bytes.append(packer.pack_array(sub_cube_t))
+
+            return cuboid_bytes
+
+        # Compress all the cuboids up front on the codec thread pool
+        cuboid_zyx = [(z, y, x) for z in range(z_num_cubes) for y in range(y_num_cubes) for x in range(x_num_cubes)]
+        cuboid_bytes = self._codec_map(compress_cuboid, cuboid_zyx)
+
+        # Put all cuboids into the write buffer
+        cuboid_list = []
+        cube_list = []
+        skipped_cnt = 0
+        for (z, y, x), time_sample_bytes in zip(cuboid_zyx, cuboid_bytes):
+            # Get the morton ID for the cube
+            morton_idx = morton_ids[z][y][x]
+            for t, cube_bytes in zip(range(time_sample_start, time_sample_stop), time_sample_bytes):
+                if cube_bytes is None:
+                    skipped_cnt += 1
+                    continue
+                cuboid_list.append((t, morton_idx))
+                cube_list.append((t, morton_idx, cube_bytes))
+        write_cuboid_keys = self.kvio.insert_cubes_in_write_buffer(base_write_cuboid_key, cube_list)
+
+        # Attempt to get write slots by adding all cuboids to page out. Cuboids already in page out are delayed
+        in_page_out = self.cache_state.add_to_page_out_batch(resource.get_lookup_key(), resolution, cuboid_list)
+
+        page_out_keys = []
+        delayed_keys = []
+        delayed_cuboids = []
+        for write_cuboid_key, cuboid, delayed in zip(write_cuboid_keys, cuboid_list, in_page_out):
+            if delayed:
+                blog.info("Writing Cuboid - Delayed Write: {}".format(write_cuboid_key))
+                delayed_keys.append(write_cuboid_key)
+                delayed_cuboids.append(cuboid)
+            else:
+                page_out_keys.append(write_cuboid_key)
+
+        self.cache_state.add_to_delayed_write_batch(delayed_keys, resource.get_lookup_key(), resolution,
+                                                    delayed_cuboids, resource.to_json())
+
+        # Good to trigger lambda!
+        self.objectio.trigger_page_out_batch({"kv_config": self.kv_config,
+                                              "state_config": self.state_conf,
+                                              "object_store_config": self.object_store_config},
+                                             page_out_keys,
+                                             resource)
+        page_out_cnt = len(page_out_keys)
         blog.info("Triggered {} Page Out Operations".format(page_out_cnt))
+        blog.info("Skipped {} All-Zero Cuboids".format(skipped_cnt))
+
+        return skipped_cnt
 
     def get_bounding_box(self, resource, resolution, id, bb_type='loose'):
         """
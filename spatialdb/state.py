@@ -12,14 +12,25 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import redis
 import uuid
+import threading
 import time
-from datetime import datetime
 from .error import SpdbError, ErrorCodes
 
 
 class CacheStateDB(object):
+    # Default number of seconds a channel's lock state is cached in process
+    LOCK_CACHE_TIMEOUT = 1.0
+
+    # Lock state of each channel checked recently, as a tuple of the expire time and lock state. Shared by all
+    # instances in the process, since an instance is created per request
+    _lock_cache = {}
+    _lock_cache_lock = threading.Lock()
+    # Incremented whenever a lock is changed, so a lock state read before the change isn't cached after it
+    _lock_cache_generation = 0
+
     def __init__(self, config):
         """
         A class to implement the Boss cache state database and associated functionality
@@ -34,6 +45,7 @@ class CacheStateDB(object):
             state_client: Optional instance of a redis client that will be used directly
             cache_state_host: If state_client not provided, a string indicating the database host
             cache_state_db: If state_client not provided, an integer indicating the database to use
+            lock_cache_timeout: Optional number of seconds a channel's lock state is cached in process. 0 disables
 
         """
         self.config = config
@@ -45,58 +57,100 @@ class CacheStateDB(object):
             self.status_client = redis.StrictRedis(host=self.config["cache_state_host"], port=6379,
                                                    db=self.config["cache_state_db"])
 
-        self.status_client_listener = None
+        self.lock_cache_timeout = self.config.get("lock_cache_timeout", self.LOCK_CACHE_TIMEOUT)
 
     def create_page_in_channel(self):
         """
         Create a page in channel for monitoring a page-in operation
 
+        Each call gets its own listener, so concurrent page-ins using the same instance don't read each other's
+        messages.
+
         Returns:
-            (str): the page in channel name
+            ((str, redis.client.PubSub)): the page in channel name and the listener subscribed to it
         """
         channel_name = "PAGE-IN-CHANNEL&{}".format(uuid.uuid4().hex)
-        self.status_client_listener = self.status_client.pubsub()
-        self.status_client_listener.subscribe(channel_name)
-        return channel_name
+        listener = self.status_client.pubsub()
+        listener.subscribe(channel_name)
+        return channel_name, listener
 
-    def delete_page_in_channel(self, page_in_channel):
+    def delete_page_in_channel(self, page_in_channel, listener):
         """
         Method to remove a page in channel (after use) and close the pubsub connection
         Args:
             page_in_channel (str): Name of the subscription
+            listener (redis.client.PubSub): listener returned by create_page_in_channel()
 
         Returns:
             None
         """
-        self.status_client_listener.punsubscribe(page_in_channel)
-        self.status_client_listener.close()
+        listener.unsubscribe(page_in_channel)
+        listener.close()
 
-    def wait_for_page_in(self, keys, page_in_channel, timeout):
+    def wait_for_page_in(self, keys, page_in_channel, listener, timeout):
         """
         Method to monitor page in operation and wait for all operations to complete
 
         Args:
-            keys (list(str)): List of object keys to wait for
+            keys (list(str)): List of cached-cuboid keys to wait for
             page_in_channel (str): Name of the subscription
+            listener (redis.client.PubSub): listener returned by create_page_in_channel()
             timeout (int): Max # of seconds page in should take before an exception is raised.
 
         Returns:
             None
         """
-        start_time = datetime.now()
+        try:
+            for _ in self.iter_page_in(keys, page_in_channel, listener, timeout):
+                pass
+        finally:
+            self.delete_page_in_channel(page_in_channel, listener)
+
+    def iter_page_in(self, keys, page_in_channel, listener, timeout, deadline=None):
+        """
+        Generator that yields cached-cuboid keys as their page in completes
+
+        Blocks on the page in channel until a message arrives instead of polling. Both single key
+        (notify_page_in_complete) and batch (notify_page_in_batch_complete) messages are handled. The channel is not
+        deleted.
+
+        If a deadline is given and keys are still missing when it passes, an empty list is yielded once so the caller
+        can act on them (e.g. read them directly) before waiting continues.
+
+        Args:
+            keys (list(str)): List of cached-cuboid keys to wait for
+            page_in_channel (str): Name of the subscription
+            listener (redis.client.PubSub): listener returned by create_page_in_channel()
+            timeout (int): Max # of seconds page in should take before an exception is raised.
+            deadline (float): Optional time.time() at which to yield an empty list if keys are still missing
+
+        Returns:
+            (list(str)): Yields lists of the cached-cuboid keys that are now in the cache
+
+        Raises:
+            (SpdbError): If all keys are not paged in before the timeout elapses
+        """
+        start_time = time.time()
 
         keys_set = set(keys)
 
-        while True:
+        while keys_set:
             # Check if too much time has passed
-            if (datetime.now() - start_time).seconds > timeout:
+            remaining = timeout - (time.time() - start_time)
+            if remaining <= 0:
                 # Took too long! Something must have crashed
-                self.delete_page_in_channel(page_in_channel)
                 raise SpdbError('All data failed to page in before timeout elapsed.',
                                 ErrorCodes.ASYNC_ERROR)
 
-            # If not, get a message
-            msg = self.status_client_listener.get_message()
+            if deadline is not None:
+                if time.time() >= deadline:
+                    deadline = None
+                    yield []
+                    continue
+                remaining = min(remaining, deadline - time.time())
+
+            # If not, block until a message arrives
+            msg = listener.get_message(timeout=max(remaining, 0))
 
             # If message is not there, continue
             if not msg:
@@ -111,19 +165,14 @@ class CacheStateDB(object):
             if msg["type"] != 'message':
                 continue
 
-            # Remove the key from the set you are waiting for
-            keys_set.remove(msg["data"].decode())
-
-            # Check if you have completed
-            if len(keys_set) == 0:
-                # Done!
-                break
+            # Remove the key(s) from the set you are waiting for
+            data = msg["data"].decode()
+            paged_in_keys = json.loads(data) if data.startswith("[") else [data]
+            paged_in_keys = [key for key in paged_in_keys if key in keys_set]
+            keys_set.difference_update(paged_in_keys)
 
-            # Sleep a bit so you don't kill the DB
-            time.sleep(0.05)
-
-        # If you get here you got everything! Clean up
-        self.delete_page_in_channel(page_in_channel)
+            if paged_in_keys:
+                yield paged_in_keys
 
     def notify_page_in_complete(self, page_in_channel, key):
         """
@@ -138,6 +187,20 @@ class CacheStateDB(object):
         """
         self.status_client.publish(page_in_channel, key)
 
+    def notify_page_in_batch_complete(self, page_in_channel, keys):
+        """
+        Method to notify main API process that the async page-in operation for a batch of cuboids is complete, with a
+        single message
+        Args:
+            page_in_channel (str): Name of the subscription
+            keys (list(str)): cached-cuboid keys for the cuboids that have been successfully paged in
+
+        Returns:
+            None
+
+        """
+        self.status_client.publish(page_in_channel, json.dumps(list(keys)))
+
     def add_cache_misses(self, key_list):
         """
         Method to add cached-cuboid keys to the cache-miss list
@@ -158,14 +221,29 @@ class CacheStateDB(object):
         """
         Method to check if a given channel is locked for writing due to an error
 
+        The lock state is cached in process for lock_cache_timeout seconds, so a lock set by another process may take
+        that long to be seen. Locks set with set_project_lock() in this process are seen immediately.
+
         Args:
             lookup_key (str): Lookup key for a channel
 
         Returns:
             (bool): True if the channel is locked, false if not
         """
+        now = time.monotonic()
+        with self._lock_cache_lock:
+            cached = self._lock_cache.get(lookup_key)
+            generation = CacheStateDB._lock_cache_generation
+        if self.lock_cache_timeout > 0 and cached and cached[0] > now:
+            return cached[1]
+
         key = "WRITE-LOCK&{}".format(lookup_key)
-        return bool(self.status_client.exists(key))
+        locked = bool(self.status_client.exists(key))
+        if self.lock_cache_timeout > 0:
+            with self._lock_cache_lock:
+                if generation == CacheStateDB._lock_cache_generation:
+                    self._lock_cache[lookup_key] = (now + self.lock_cache_timeout, locked)
+        return locked
 
     def set_project_lock(self, lookup_key, locked):
         """
@@ -184,37 +262,21 @@ class CacheStateDB(object):
         else:
             self.status_client.delete(key)
 
-    def in_page_out(self, temp_page_out_key, lookup_key, resolution, morton, time_sample):
-        """
-        Method to check if a cuboid is currently being written to S3 via page out key
+        with self._lock_cache_lock:
+            CacheStateDB._lock_cache_generation += 1
+            self._lock_cache.pop(lookup_key, None)
 
-        Args:
-            temp_page_out_key (str): a temporary set used to check if cubes are in page out
-            lookup_key (str): Lookup key for a channel
-            resolution (int): level in the resolution heirarchy
-            morton (int): morton id for the cuboid
-            time_sample (int): time sample for cuboid
+    @classmethod
+    def clear_lock_cache(cls):
+        """
+        Method to remove all cached lock states
 
         Returns:
-            (bool): True if the key is in page out
+            None
         """
-        with self.status_client.pipeline() as pipe:
-            try:
-                # Create temp set
-                pipe.sadd(temp_page_out_key, "{}&{}".format(time_sample, morton))
-                pipe.expire(temp_page_out_key, 30)
-                pipe.execute()
-            except Exception as e:
-                raise SpdbError("Failed to check page-out set. {}".format(e),
-                                ErrorCodes.REDIS_ERROR)
-
-        # Use set diff to check for key
-        result = self.status_client.sdiff(temp_page_out_key, "PAGE-OUT&{}&{}".format(lookup_key, resolution))
-
-        if result:
-            return False
-        else:
-            return True
+        with cls._lock_cache_lock:
+            cls._lock_cache_generation += 1
+            cls._lock_cache.clear()
 
     def add_to_delayed_write(self, write_cuboid_key, lookup_key, resolution, morton, time_sample, resource_str):
         """
@@ -236,6 +298,35 @@ class CacheStateDB(object):
         self.status_client.set("RESOURCE-DELAYED-WRITE&{}&{}&{}&{}".format(lookup_key, resolution, time_sample, morton),
                                resource_str)
 
+    def add_to_delayed_write_batch(self, write_cuboid_key_list, lookup_key, resolution, cuboid_list, resource_str):
+        """
+        Method to add multiple write cuboid keys to their delayed write queues in one round trip
+
+        Args:
+            write_cuboid_key_list (list(str)): write-cuboid keys for the cuboids to delay write
+            lookup_key (str): Lookup key for a channel
+            resolution (int): level in the resolution heirarchy
+            cuboid_list (list((int, int))): the time sample and morton id of each write-cuboid key
+            resource_str (str): a JSON encoded resource for the write-cuboids to be written
+
+        Returns:
+            None
+        """
+        if not write_cuboid_key_list:
+            return
+
+        with self.status_client.pipeline() as pipe:
+            try:
+                for write_cuboid_key, (time_sample, morton) in zip(write_cuboid_key_list, cuboid_list):
+                    pipe.rpush("DELAYED-WRITE&{}&{}&{}&{}".format(lookup_key, resolution, time_sample, morton),
+                               write_cuboid_key)
+                    pipe.set("RESOURCE-DELAYED-WRITE&{}&{}&{}&{}".format(lookup_key, resolution, time_sample, morton),
+                             resource_str)
+                pipe.execute()
+            except Exception as e:
+                raise SpdbError("Failed to add delayed writes. {}".format(e),
+                                ErrorCodes.REDIS_ERROR)
+
     def get_all_delayed_write_keys(self):
         """
         Method to get all available delayed write key
@@ -329,55 +420,74 @@ class CacheStateDB(object):
         else:
             return None
 
+    def in_page_out(self, temp_page_out_key, lookup_key, resolution, morton, time_sample):
+        """
+        Method to check if a cuboid is currently being written to S3 via page out key
+
+        Args:
+            temp_page_out_key (str): Deprecated and ignored. Membership is checked directly on the page-out set
+            lookup_key (str): Lookup key for a channel
+            resolution (int): level in the resolution heirarchy
+            morton (int): morton id for the cuboid
+            time_sample (int): time sample for cuboid
+
+        Returns:
+            (bool): True if the key is in page out
+        """
+        try:
+            return bool(self.status_client.sismember("PAGE-OUT&{}&{}".format(lookup_key, resolution),
+                                                     "{}&{}".format(time_sample, morton)))
+        except Exception as e:
+            raise SpdbError("Failed to check page-out set. {}".format(e),
+                            ErrorCodes.REDIS_ERROR)
+
     def add_to_page_out(self, temp_page_out_key, lookup_key, resolution, morton, time_sample):
         """
         Method to add a key to the page-out tracking set
 
         Args:
+            temp_page_out_key (str): Deprecated and ignored. Kept so existing positional callers still bind correctly
             lookup_key (str): Lookup key for a channel
             resolution (int): level in the resolution heirarchy
             morton (int): morton id for the cuboid
             time_sample (int): time sample for cuboid
 
         Returns:
-            (bool, bool): Tuple where first value is if the transaction succeeded and the second is if the key is in
-            page out already
+            (bool): True if the key was in page out already
         """
+        return self.add_to_page_out_batch(lookup_key, resolution, [(time_sample, morton)])[0]
+
+    def add_to_page_out_batch(self, lookup_key, resolution, cuboid_list):
+        """
+        Method to add multiple cuboids to the page-out tracking set in one round trip
+
+        All cuboids are added in one atomic (MULTI/EXEC) pipeline. A cuboid is admitted to page out if this call added
+        it to the set, and is already in page out (and the write must be delayed) otherwise.
+
+        Args:
+            lookup_key (str): Lookup key for a channel
+            resolution (int): level in the resolution heirarchy
+            cuboid_list (list((int, int))): the time sample and morton id of each cuboid
+
+        Returns:
+            (list(bool)): A list of booleans, indicating if each cuboid was in page out already
+        """
+        if not cuboid_list:
+            return []
+
         page_out_key = "PAGE-OUT&{}&{}".format(lookup_key, resolution)
-        in_page_out = True
-        cnt = 0
-        with self.status_client.pipeline() as pipe:
-            while 1:
-                try:
-                    # Create temp set
-                    pipe.watch(page_out_key)
-                    pipe.multi()
-                    pipe.sadd(temp_page_out_key, "{}&{}".format(time_sample, morton))
-                    pipe.expire(temp_page_out_key, 15)
-                    pipe.sdiff(temp_page_out_key, page_out_key)
-                    pipe.sadd(page_out_key, "{}&{}".format(time_sample, morton))
-                    result = pipe.execute()
-
-                    if len(result[2]) > 0:
-                        in_page_out = False
-                    else:
-                        in_page_out = True
-
-                    break
-                except redis.WatchError as e:
-                    # Watch error occurred, try again!
-                    cnt += 1
-
-                    if cnt > 200:
-                        raise SpdbError("Failed to add to page out due to timeout. {}".format(e),
-                                        ErrorCodes.REDIS_ERROR)
-                    continue
+        members = ["{}&{}".format(time_sample, morton) for time_sample, morton in cuboid_list]
 
-                except Exception as e:
-                    raise SpdbError("Failed to check page-out set. {}".format(e),
-                                    ErrorCodes.REDIS_ERROR)
+        with self.status_client.pipeline() as pipe:
+            try:
+                for member in members:
+                    pipe.sadd(page_out_key, member)
+                result = pipe.execute()
+            except Exception as e:
+                raise SpdbError("Failed to check page-out set. {}".format(e),
+                                ErrorCodes.REDIS_ERROR)
 
-        return in_page_out
+        return [not added for added in result]
 
     def remove_from_page_out(self, write_cuboid_key):
         """
@@ -397,3 +507,114 @@ class CacheStateDB(object):
 
         page_out_key = "PAGE-OUT&{}&{}".format(lookup, res)
         self.status_client.srem(page_out_key, "{}&{}".format(time_sample, morton))
+
+        # The cuboid has been flushed, so wake up any reads waiting on it
+        self.notify_cuboid_clean(write_cuboid_key)
+
+    @staticmethod
+    def cuboid_clean_channel(key):
+        """
+        Method to get the name of the channel used to signal that cuboids have been flushed from the write buffer
+
+        There is a single channel per channel/resolution (and iso flag) so readers only subscribe to a handful of
+        channels no matter how many cuboids they are waiting on.
+
+        Args:
+            key (str): a cached-cuboid or write-cuboid key
+
+        Returns:
+            (str): the cuboid clean channel name
+        """
+        key_type, parts = key.split("&", 1)
+        if key_type == "WRITE-CUBOID":
+            # Drop the uuid
+            parts = parts.rsplit("&", 1)[0]
+
+        # Drop the time sample and morton id
+        parts = parts.rsplit("&", 2)[0]
+        return "CUBOID-CLEAN&{}".format(parts)
+
+    def notify_cuboid_clean(self, write_cuboid_key):
+        """
+        Method to notify readers that a write-cuboid has been flushed from the write buffer
+
+        Args:
+            write_cuboid_key (str): the write cuboid key that was flushed
+
+        Returns:
+            None
+        """
+        _, parts = write_cuboid_key.split("&", 1)
+        parts, _ = parts.rsplit("&", 1)
+        parts, morton = parts.rsplit("&", 1)
+        _, time_sample = parts.rsplit("&", 1)
+
+        self.status_client.publish(self.cuboid_clean_channel(write_cuboid_key), "{}&{}".format(time_sample, morton))
+
+    def subscribe_cuboid_clean(self, cache_key_list):
+        """
+        Method to subscribe to cuboid clean events for a list of cached-cuboid keys
+
+        Subscribe BEFORE re-checking if the cuboids are dirty, otherwise an event could be missed.
+
+        Args:
+            cache_key_list (list(str)): A list of cached-cuboid keys to wait on
+
+        Returns:
+            (redis.client.PubSub): the subscribed listener or None if pub/sub is not available on the client
+        """
+        channels = set([self.cuboid_clean_channel(key) for key in cache_key_list])
+        try:
+            listener = self.status_client.pubsub()
+            listener.subscribe(*channels)
+        except Exception:
+            # Pub/sub not supported by this client (e.g. a mock). Caller should fall back to polling.
+            return None
+
+        return listener
+
+    def unsubscribe_cuboid_clean(self, listener):
+        """
+        Method to unsubscribe from cuboid clean events and close the pubsub connection
+
+        Args:
+            listener (redis.client.PubSub): listener returned by subscribe_cuboid_clean()
+
+        Returns:
+            None
+        """
+        try:
+            listener.unsubscribe()
+            listener.close()
+        except Exception:
+            pass
+
+    def wait_for_cuboid_clean(self, listener, timeout):
+        """
+        Method to block until a cuboid clean event arrives or the timeout elapses
+
+        Any additional events already queued are consumed so a burst of flushes only wakes the caller once.
+
+        Args:
+            listener (redis.client.PubSub): listener returned by subscribe_cuboid_clean()
+            timeout (float): Max # of seconds to block
+
+        Returns:
+            (bool): True if a cuboid clean event was received
+        """
+        start_time = time.time()
+        received = False
+        remaining = timeout
+        while remaining > 0:
+            msg = listener.get_message(timeout=remaining)
+            if msg and msg["type"] == 'message':
+                received = True
+                break
+            remaining = timeout - (time.time() - start_time)
+
+        if received:
+            # Drain anything else that is already waiting
+            while listener.get_message():
+                pass
+
+        return received
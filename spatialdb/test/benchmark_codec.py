@@ -0,0 +1,90 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark cuboid compression and decompression throughput against SpatialDB.codec_threads
+
+Usage:
+    python -m spdb.spatialdb.test.benchmark_codec --cuboids 64 --threads 1 2 4 8
+"""
+import argparse
+import time
+
+import numpy as np
+from mockredis import mock_strict_redis_client
+
+from spdb.c_lib.ndlib import XYZMorton
+from spdb.c_lib.ndtype import CUBOIDSIZE
+from spdb.project import BossResourceBasic
+from spdb.spatialdb import Cube, SpatialDB
+from spdb.spatialdb.test.setup import SetupTests
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cuboid codec throughput against thread count")
+    parser.add_argument("--cuboids", type=int, default=64, help="Number of cuboids to encode/decode")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8], help="codec_threads values to test")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per thread count, best is reported")
+    args = parser.parse_args()
+
+    resource = BossResourceBasic(SetupTests().get_image8_dict())
+    object_store_config = {"s3_flush_queue": 'https://mytestqueue.com',
+                           "cuboid_bucket": "test_bucket",
+                           "page_in_lambda_function": "page_in.test.boss",
+                           "page_out_lambda_function": "page_out.test.boss",
+                           "s3_index_table": "test_table",
+                           "id_index_table": "test_id_table",
+                           "id_count_table": "test_count_table",
+                           }
+    db = SpatialDB({"cache_client": mock_strict_redis_client(), "read_timeout": 86400},
+                   {"state_client": mock_strict_redis_client()},
+                   object_store_config)
+
+    # Build a row of cuboids with compressible (but not trivial) data
+    x_cube_dim, y_cube_dim, z_cube_dim = cube_dim = CUBOIDSIZE[0]
+    cubes = []
+    for x in range(args.cuboids):
+        cube = Cube.create_cube(resource, cube_dim)
+        cube.data[:] = np.random.randint(0, 32, size=cube.data.shape, dtype=np.uint8)
+        cube.morton_id = XYZMorton([x, 0, 0])
+        cubes.append(cube)
+    cuboids = [(cube.morton_id, 0, cube.to_blosc_by_time_index(0)) for cube in cubes]
+    total_mb = sum(cube.data.nbytes for cube in cubes) / 1e6
+
+    if not SpatialDB.codec_parallel():
+        print("Codec calls can't run concurrently, so every thread count runs serially. Set BLOSC_NOLOCK=1 with a "
+              "python-blosc that supports set_releasegil to test the codec thread pool.")
+
+    print("{:>8} {:>16} {:>16}".format("threads", "compress MB/s", "decompress MB/s"))
+    for threads in args.threads:
+        db.close()
+        db.codec_threads = threads
+
+        compress_time = decompress_time = float("inf")
+        for _ in range(args.repeat):
+            start = time.time()
+            db._codec_map(lambda cube: cube.to_blosc_by_time_index(0), cubes)
+            compress_time = min(compress_time, time.time() - start)
+
+            out_cube = Cube.create_cube(resource, [x_cube_dim * args.cuboids, y_cube_dim, z_cube_dim])
+            start = time.time()
+            db._add_cuboids_to_cube(out_cube, cuboids, [0, 0, 0], cube_dim)
+            decompress_time = min(decompress_time, time.time() - start)
+
+        print("{:>8} {:>16.0f} {:>16.0f}".format(threads, total_mb / compress_time, total_mb / decompress_time))
+
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
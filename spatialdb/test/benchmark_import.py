@@ -0,0 +1,76 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark the time to import spdb modules in a fresh process, as reported by python -X importtime
+
+Usage:
+    python -m spdb.spatialdb.test.benchmark_import --modules spdb.spatialdb.object spdb.spatialdb.spatialdb
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+
+def import_time(module, repeat):
+    """Import a module in new processes and report the best timings
+
+    Args:
+        module (str): The module to import
+        repeat (int): Number of processes to run
+
+    Returns:
+        (float, float): Best seconds spent in spdb's own modules, and best total seconds to import the module
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(sys.path)
+
+    best_spdb = best_total = float("inf")
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import {}".format(module)], env=env,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+        spdb_time = 0
+        total_time = 0
+        for line in result.stderr.splitlines():
+            # Format is "import time: <self us> | <cumulative us> | <indented module name>"
+            if not line.startswith("import time:") or "[us]" in line:
+                continue
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            if name.strip().split(".")[0] == "spdb":
+                spdb_time += int(self_us) / 1e6
+            if name.strip() == module:
+                total_time = int(cumulative_us) / 1e6
+
+        best_spdb = min(best_spdb, spdb_time)
+        best_total = min(best_total, total_time)
+
+    return best_spdb, best_total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark spdb module import time")
+    parser.add_argument("--modules", nargs="+", default=["spdb.spatialdb", "spdb.spatialdb.object"],
+                        help="Modules to import")
+    parser.add_argument("--repeat", type=int, default=5, help="Imports per module, best is reported")
+    args = parser.parse_args()
+
+    print("{:<32} {:>10} {:>10}".format("module", "spdb ms", "total ms"))
+    for module in args.modules:
+        spdb_time, total_time = import_time(module, args.repeat)
+        print("{:<32} {:>10.1f} {:>10.1f}".format(module, spdb_time * 1e3, total_time * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -36,7 +36,7 @@ class IntegrationCacheStateDBTestMixin(object):
         csdb2 = CacheStateDB(self.config_data)
 
         # Create page in channel in the first instance
-        ch = csdb1.create_page_in_channel()
+        ch, listener = csdb1.create_page_in_channel()
         time.sleep(1.5)
 
         # Publish a message
@@ -44,7 +44,7 @@ class IntegrationCacheStateDBTestMixin(object):
 
         # Get message (ignore first message which is the subscribe)
         while True:
-            msg = csdb1.status_client_listener.get_message()
+            msg = listener.get_message()
             if not msg:
                 continue
             if msg['type'] == "message":
@@ -58,9 +58,9 @@ class IntegrationCacheStateDBTestMixin(object):
         start_time = datetime.now()
         with self.assertRaises(SpdbError):
             csdb = CacheStateDB(self.config_data)
-            ch = csdb.create_page_in_channel()
+            ch, listener = csdb.create_page_in_channel()
 
-            csdb.wait_for_page_in(["MY_TEST_KEY1", "MY_TEST_KEY2"], ch, 1)
+            csdb.wait_for_page_in(["MY_TEST_KEY1", "MY_TEST_KEY2"], ch, listener, 1)
 
         assert (datetime.now() - start_time).seconds < 3
 
@@ -71,14 +71,14 @@ class IntegrationCacheStateDBTestMixin(object):
         csdb2 = CacheStateDB(self.config_data)
 
         # Create page in channel in the first instance
-        ch = csdb1.create_page_in_channel()
+        ch, listener = csdb1.create_page_in_channel()
 
         # Publish a message
         csdb2.notify_page_in_complete(ch, "MY_TEST_KEY1")
         csdb2.notify_page_in_complete(ch, "MY_TEST_KEY2")
 
         # Wait for page in
-        csdb1.wait_for_page_in(["MY_TEST_KEY1", "MY_TEST_KEY2"], ch, 5)
+        csdb1.wait_for_page_in(["MY_TEST_KEY1", "MY_TEST_KEY2"], ch, listener, 5)
 
 
 class TestCacheStateDB(CacheStateDBTestMixin, IntegrationCacheStateDBTestMixin, unittest.TestCase):
@@ -0,0 +1,113 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from spdb.project import BossResourceBasic
+from spdb.spatialdb import Cube
+
+
+class LocalPageOutExecutor(object):
+    """
+    A stand-in for the page out (s3_flush) lambda that flushes write-cuboids in process, for testing.
+
+    Set as the object store's page_out_executor so page out messages are processed synchronously:
+
+        sp.objectio.page_out_executor = LocalPageOutExecutor(sp)
+
+    Each write-cuboid is merged into the existing cuboid (non-zero values overwrite), stored in the object store and
+    cache, and removed from the write buffer. Delayed writes for the cuboid are then flushed before it is removed from
+    page out.
+
+    Args:
+        spatial_db (spdb.spatialdb.SpatialDB): The SpatialDB instance whose cache and object store are flushed to
+
+    Attributes:
+        flushed_keys (list(str)): The write-cuboid keys flushed, in order
+    """
+    def __init__(self, spatial_db):
+        self.sp = spatial_db
+        self.flushed_keys = []
+
+    def __call__(self, msg_data):
+        """Process a page out message
+
+        Args:
+            msg_data (dict): The page out message, as built by AWSObjectStore.trigger_page_out_batch()
+
+        Returns:
+            None
+        """
+        resource = BossResourceBasic(msg_data["resource"])
+        if "write_cuboid_keys" in msg_data:
+            write_cuboid_keys = msg_data["write_cuboid_keys"]
+        else:
+            write_cuboid_keys = [msg_data["write_cuboid_key"]]
+
+        for write_cuboid_key in write_cuboid_keys:
+            self.flush(write_cuboid_key, resource)
+
+    def flush(self, write_cuboid_key, resource):
+        """Flush a write-cuboid and any delayed writes to the same cuboid
+
+        Args:
+            write_cuboid_key (str): The write-cuboid key to flush
+            resource (spdb.project.BossResource): resource for the write-cuboid key
+
+        Returns:
+            None
+        """
+        delayed_write_key = self.sp.cache_state.write_cuboid_key_to_delayed_write_key(write_cuboid_key)
+        while True:
+            self._flush_write_cuboid(write_cuboid_key, resource)
+
+            delayed_write = self.sp.cache_state.get_single_delayed_write(delayed_write_key)
+            if not delayed_write:
+                break
+            write_cuboid_key = delayed_write[0]
+
+        self.sp.cache_state.remove_from_page_out(write_cuboid_key)
+
+    def _flush_write_cuboid(self, write_cuboid_key, resource):
+        kvio = self.sp.kvio
+        objectio = self.sp.objectio
+
+        cache_key = kvio.write_cuboid_key_to_cache_key(write_cuboid_key)
+        object_key = objectio.write_cuboid_to_object_keys([write_cuboid_key])[0]
+
+        write_cube = Cube.create_cube(resource)
+        write_cube.from_blosc([kvio.get_cube_from_write_buffer(write_cuboid_key)])
+
+        # Merge with the existing cuboid, if any
+        existing_bytes = None
+        if kvio.cube_exists(cache_key):
+            existing_bytes = kvio.get_cubes([cache_key])[0][2]
+        else:
+            s3_key_idx, zero_key_idx = objectio.cuboids_exist([cache_key])
+            if 0 in s3_key_idx:
+                # Found in the S3 index
+                existing_bytes = objectio.get_single_object(object_key)
+
+        if existing_bytes:
+            cube = Cube.create_cube(resource)
+            cube.from_blosc([existing_bytes])
+            cube.overwrite(write_cube.data)
+        else:
+            cube = write_cube
+        cube_bytes = cube.to_blosc_by_time_index(0)
+
+        objectio.put_objects([object_key], [cube_bytes])
+        objectio.add_cuboid_to_index(object_key)
+        kvio.put_cubes([cache_key], [cube_bytes])
+        kvio.delete_cube(write_cuboid_key)
+
+        self.flushed_keys.append(write_cuboid_key)
@@ -12,11 +12,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import unittest
+from unittest.mock import patch
 
 from spdb.project import BossResourceBasic
 from spdb.spatialdb import AWSObjectStore
 from spdb.spatialdb import Region
+from spdb.spatialdb import SpdbError
 
 from bossutils import configuration
 
@@ -185,6 +188,50 @@ class AWSObjectStoreTestMixin(object):
         assert exist_keys == [1, 2]
         assert missing_keys == []
 
+    def test_cuboids_exist_multiple_batches(self):
+        """Test checking more keys than fit in a single BatchGetItem request"""
+        os = AWSObjectStore(self.object_store_config)
+
+        test_keys = ["CACHED-CUBOID&1&1&1&0&0&{}".format(x) for x in range(1000, 1250)]
+        expected_object_keys = os.cached_cuboid_to_object_keys(test_keys[::2])
+
+        # Populate table
+        for k in expected_object_keys:
+            os.add_cuboid_to_index(k)
+
+        # Check for keys
+        exist_keys, missing_keys = os.cuboids_exist(test_keys)
+
+        assert exist_keys == list(range(0, 250, 2))
+        assert missing_keys == list(range(1, 250, 2))
+
+    def test_batch_get_index_keys_unprocessed(self):
+        """Test unprocessed keys are retried"""
+        os = AWSObjectStore(self.object_store_config)
+        table = self.object_store_config['s3_index_table']
+
+        def make_key(key):
+            return {'object-key': {'S': key}, 'version-node': {'N': '0'}}
+
+        class FakeDynamoDB(object):
+            def __init__(self):
+                self.requests = []
+
+            def batch_get_item(self, RequestItems, ReturnConsumedCapacity):
+                self.requests.append(RequestItems)
+                if len(self.requests) == 1:
+                    return {'Responses': {table: [make_key('key1')]},
+                            'UnprocessedKeys': {table: {'Keys': [make_key('key2')]}}}
+                return {'Responses': {table: [make_key('key2')]}, 'UnprocessedKeys': {}}
+
+        fake_dynamodb = FakeDynamoDB()
+        with patch('spdb.spatialdb.object.time.sleep'):
+            found = os._batch_get_index_keys(fake_dynamodb, ['key1', 'key2', 'key3'], 0)
+
+        assert found == {'key1', 'key2'}
+        assert len(fake_dynamodb.requests) == 2
+        assert fake_dynamodb.requests[1] == {table: {'Keys': [make_key('key2')]}}
+
     def test_put_get_single_object(self):
         """Method to test putting and getting objects to and from S3"""
         os = AWSObjectStore(self.object_store_config)
@@ -214,6 +261,152 @@ class AWSObjectStoreTestMixin(object):
         for rdata, sdata in zip(returned_data, fake_data):
             assert rdata == sdata
 
+    def test_get_objects_order(self):
+        """Method to test concurrent gets return data in the order of the keys"""
+        os = AWSObjectStore(self.object_store_config)
+        object_keys = os.cached_cuboid_to_object_keys(["CACHED-CUBOID&1&1&1&0&0&{}".format(x) for x in range(50)])
+
+        with patch.object(os, '_get_object', side_effect=lambda key, version: key.encode()):
+            returned_data = os.get_objects(object_keys)
+
+        assert returned_data == [key.encode() for key in object_keys]
+
+    def test_get_objects_error_reports_keys(self):
+        """Method to test every key that fails is reported"""
+        os = AWSObjectStore(self.object_store_config)
+        object_keys = os.cached_cuboid_to_object_keys(["CACHED-CUBOID&1&1&1&0&0&{}".format(x) for x in range(10)])
+        bad_keys = [object_keys[3], object_keys[7]]
+
+        def fake_get(key, version):
+            if key in bad_keys:
+                raise Exception("NoSuchKey")
+            return key.encode()
+
+        with patch.object(os, '_get_object', side_effect=fake_get):
+            with self.assertRaises(SpdbError) as err:
+                os.get_objects(object_keys)
+
+        for key in bad_keys:
+            assert key in err.exception.message
+        assert object_keys[0] not in err.exception.message
+
+    def test_trigger_page_out_batch(self):
+        """Method to test page out messages are sent in SQS batches"""
+        config = dict(self.object_store_config)
+        config["page_out_keys_per_invoke"] = 10
+        os = AWSObjectStore(config)
+        write_cuboid_keys = ["WRITE-CUBOID&1&1&1&0&0&{}&abc".format(x) for x in range(21)]
+
+        with patch('boto3.client') as fake_client:
+            fake_client.return_value.send_message_batch.return_value = {'ResponseMetadata': {'HTTPStatusCode': 200}}
+            os.trigger_page_out_batch({"kv_config": {}}, write_cuboid_keys, self.resource)
+
+        batches = [c[1]["Entries"] for c in fake_client.return_value.send_message_batch.call_args_list]
+        assert [len(b) for b in batches] == [3]
+        messages = [json.loads(e["MessageBody"]) for b in batches for e in b]
+        assert [msg["write_cuboid_keys"] for msg in messages[:2]] == [write_cuboid_keys[:10],
+                                                                      write_cuboid_keys[10:20]]
+
+        # A single key message uses the original format
+        assert messages[2]["write_cuboid_key"] == write_cuboid_keys[20]
+        assert "write_cuboid_keys" not in messages[2]
+
+        # One lambda invocation per message
+        assert fake_client.return_value.invoke.call_count == 3
+
+    def test_trigger_page_out_batch_size_limit(self):
+        """Method to test SQS batches are split to stay under the request size limit"""
+        os = AWSObjectStore(self.object_store_config)
+        write_cuboid_keys = ["WRITE-CUBOID&1&1&1&0&0&{}&abc".format(x) for x in range(10)]
+        config = {"kv_config": {"padding": "x" * 60000}}
+
+        with patch('boto3.client') as fake_client:
+            fake_client.return_value.send_message_batch.return_value = {'ResponseMetadata': {'HTTPStatusCode': 200}}
+            os.trigger_page_out_batch(config, write_cuboid_keys, self.resource)
+
+        batches = [c[1]["Entries"] for c in fake_client.return_value.send_message_batch.call_args_list]
+        assert [len(b) for b in batches] == [4, 4, 2]
+        for batch in batches:
+            assert sum(len(e["MessageBody"].encode()) for e in batch) <= AWSObjectStore.SQS_BATCH_BYTES
+        assert [json.loads(e["MessageBody"])["write_cuboid_key"] for b in batches for e in b] == write_cuboid_keys
+
+    def test_trigger_page_out_batch_default(self):
+        """Method to test page out messages have one key in the original format by default"""
+        os = AWSObjectStore(self.object_store_config)
+        write_cuboid_keys = ["WRITE-CUBOID&1&1&1&0&0&{}&abc".format(x) for x in range(23)]
+
+        with patch('boto3.client') as fake_client:
+            fake_client.return_value.send_message_batch.return_value = {'ResponseMetadata': {'HTTPStatusCode': 200}}
+            os.trigger_page_out_batch({"kv_config": {}}, write_cuboid_keys, self.resource)
+
+        batches = [c[1]["Entries"] for c in fake_client.return_value.send_message_batch.call_args_list]
+        assert [len(b) for b in batches] == [10, 10, 3]
+        messages = [json.loads(e["MessageBody"]) for b in batches for e in b]
+        assert messages[0] == {"config": {"kv_config": {}},
+                               "write_cuboid_key": write_cuboid_keys[0],
+                               "lambda-name": "s3_flush",
+                               "resource": self.resource.to_dict()}
+        assert [msg["write_cuboid_key"] for msg in messages] == write_cuboid_keys
+        assert fake_client.return_value.invoke.call_count == 23
+
+    def test_trigger_page_out_batch_executor(self):
+        """Method to test page out messages are given to a configured executor instead of SQS and lambda"""
+        messages = []
+        config = dict(self.object_store_config)
+        config["page_out_executor"] = messages.append
+        config["page_out_keys_per_invoke"] = 10
+        os = AWSObjectStore(config)
+        write_cuboid_keys = ["WRITE-CUBOID&1&1&1&0&0&{}&abc".format(x) for x in range(12)]
+
+        with patch('boto3.client') as fake_client:
+            os.trigger_page_out_batch({"kv_config": {}}, write_cuboid_keys, self.resource)
+
+        assert fake_client.return_value.send_message_batch.call_count == 0
+        assert fake_client.return_value.invoke.call_count == 0
+        assert [msg["write_cuboid_keys"] for msg in messages] == [write_cuboid_keys[:10], write_cuboid_keys[10:]]
+        assert messages[0]["resource"] == self.resource.to_dict()
+
+    def test_trigger_page_out_batch_failed(self):
+        """Method to test failed SQS batch entries raise"""
+        os = AWSObjectStore(self.object_store_config)
+
+        with patch('boto3.client') as fake_client:
+            fake_client.return_value.send_message_batch.return_value = {'ResponseMetadata': {'HTTPStatusCode': 200},
+                                                                        'Failed': [{'Id': '0'}]}
+            with self.assertRaises(SpdbError):
+                os.trigger_page_out_batch({}, ["WRITE-CUBOID&1&1&1&0&0&0&abc"], self.resource)
+
+    def test_page_in_objects(self):
+        """Method to test object keys are paged in with one lambda invocation per batch"""
+        config = dict(self.object_store_config)
+        config["page_in_keys_per_invoke"] = 10
+        os = AWSObjectStore(config)
+        cached_cuboid_keys = ["CACHED-CUBOID&1&1&1&0&0&{}".format(x) for x in range(21)]
+
+        with patch('boto3.client') as fake_client:
+            object_keys = os.page_in_objects(cached_cuboid_keys, "PAGE-IN-CHANNEL&abc", {}, {})
+
+        assert object_keys == os.cached_cuboid_to_object_keys(cached_cuboid_keys)
+        payloads = [json.loads(c[1]["Payload"].decode()) for c in fake_client.return_value.invoke.call_args_list]
+        assert [p["object_keys"] for p in payloads[:2]] == [object_keys[:10], object_keys[10:20]]
+
+        # A single key batch uses the original format
+        assert payloads[2]["object_key"] == object_keys[20]
+        assert "object_keys" not in payloads[2]
+        assert all(p["page_in_channel"] == "PAGE-IN-CHANNEL&abc" for p in payloads)
+
+    def test_page_in_objects_default(self):
+        """Method to test page in lambdas get one key in the original payload format by default"""
+        os = AWSObjectStore(self.object_store_config)
+        cached_cuboid_keys = ["CACHED-CUBOID&1&1&1&0&0&{}".format(x) for x in range(3)]
+
+        with patch('boto3.client') as fake_client:
+            object_keys = os.page_in_objects(cached_cuboid_keys, "PAGE-IN-CHANNEL&abc", {}, {})
+
+        payloads = [json.loads(c[1]["Payload"].decode()) for c in fake_client.return_value.invoke.call_args_list]
+        assert [p["object_key"] for p in payloads] == object_keys
+        assert all("object_keys" not in p for p in payloads)
+
     def test_get_object_key_parts(self):
         """Test to get an object key parts"""
         os = AWSObjectStore(self.object_store_config)
@@ -371,6 +371,28 @@ class TestImageCube8(unittest.TestCase):
         assert c.is_time_series is True
         assert c2.is_time_series is True
 
+    def test_unpack_array_into(self):
+        """Test decompressing directly into a non-contiguous view of a larger array"""
+        c = ImageCube8([10, 20, 5], [0, 1])
+        c.random()
+        out = np.zeros([2, 10, 40, 30], dtype=np.uint8)
+
+        staging = Cube.unpack_array_into(c.to_blosc(), out[1:2, 5:10, 20:40, 10:20])
+        staging = Cube.unpack_array_into(c.to_blosc(), out[0:1, 0:5, 0:20, 0:10], staging)
+
+        np.testing.assert_array_equal(out[1:2, 5:10, 20:40, 10:20], c.data)
+        np.testing.assert_array_equal(out[0:1, 0:5, 0:20, 0:10], c.data)
+        assert np.count_nonzero(out) == np.count_nonzero(c.data) * 2
+
+    def test_unpack_array_into_size_mismatch(self):
+        """Test decompressing into an array of the wrong size fails"""
+        c = ImageCube8([10, 20, 5], [0, 1])
+        c.random()
+        out = np.zeros([1, 5, 20, 9], dtype=np.uint8)
+
+        with self.assertRaises(SpdbError):
+            Cube.unpack_array_into(c.to_blosc(), out)
+
     def test_factory_no_time(self):
         """Test the Cube factory in Cube"""
 
@@ -0,0 +1,81 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import numpy as np
+
+from spdb.spatialdb import CuboidCache
+
+
+class TestCuboidCache(unittest.TestCase):
+
+    def test_get_put(self):
+        """Test a cuboid is only returned at the version it was stored with"""
+        cache = CuboidCache(1000)
+        data = np.arange(10, dtype=np.uint8)
+
+        cache.put("key1", "v1", data)
+        np.testing.assert_array_equal(cache.get("key1", "v1"), data)
+        assert cache.get("key1", "v2") is None
+        assert cache.get("key1", None) is None
+        assert cache.get("key2", "v1") is None
+
+        assert cache.hits == 1
+        assert cache.misses == 3
+
+        # Shared arrays are read-only
+        assert not data.flags.writeable
+
+    def test_put_no_version(self):
+        """Test a cuboid without a version isn't cached"""
+        cache = CuboidCache(1000)
+        cache.put("key1", None, np.zeros(10, dtype=np.uint8))
+
+        assert len(cache) == 0
+        assert cache.size_bytes == 0
+
+    def test_eviction(self):
+        """Test the least recently used cuboids are evicted to stay within budget"""
+        cache = CuboidCache(250)
+        for idx in range(3):
+            cache.put("key{}".format(idx), "v", np.zeros(100, dtype=np.uint8))
+
+        # key0 is evicted, then key1 after key2 is used
+        assert cache.get("key0", "v") is None
+        assert cache.get("key2", "v") is not None
+        cache.put("key3", "v", np.zeros(100, dtype=np.uint8))
+
+        assert cache.get("key1", "v") is None
+        assert cache.get("key2", "v") is not None
+        assert cache.get("key3", "v") is not None
+        assert cache.size_bytes == 200
+
+        # Too big to ever fit
+        cache.put("key4", "v", np.zeros(300, dtype=np.uint8))
+        assert cache.get("key4", "v") is None
+
+        cache.resize(100)
+        assert len(cache) == 1
+        assert cache.size_bytes == 100
+
+    def test_replace(self):
+        """Test storing a new version replaces the old one"""
+        cache = CuboidCache(1000)
+        cache.put("key1", "v1", np.zeros(100, dtype=np.uint8))
+        cache.put("key1", "v2", np.ones(100, dtype=np.uint8))
+
+        assert len(cache) == 1
+        assert cache.size_bytes == 100
+        np.testing.assert_array_equal(cache.get("key1", "v2"), np.ones(100, dtype=np.uint8))
@@ -0,0 +1,71 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import subprocess
+import sys
+import unittest
+
+
+# Dependencies that must not be imported just to use the object store's key conversion (e.g. in the page in and page
+# out lambdas)
+HEAVY_MODULES = ["boto3", "botocore", "redis", "PIL", "blosc", "bossutils", "spdb.c_lib.ndlib"]
+
+def run_python(args):
+    """Run python in a new process, so nothing is already imported
+
+    Args:
+        args (list(str)): python command line arguments
+
+    Returns:
+        (subprocess.CompletedProcess)
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(sys.path)
+    return subprocess.run([sys.executable] + args, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, check=True)
+
+
+class TestImportTime(unittest.TestCase):
+
+    def test_object_store_import_is_slim(self):
+        """Test importing the object store doesn't import heavy dependencies"""
+        result = run_python(["-c", "import sys, spdb.spatialdb.object\n"
+                                   "print(' '.join(sys.modules))"])
+        loaded = result.stdout.split()
+
+        for name in HEAVY_MODULES:
+            self.assertEqual([m for m in loaded if m == name or m.startswith(name + ".")], [],
+                             "{} imported by spdb.spatialdb.object".format(name))
+
+    def test_package_import_is_slim(self):
+        """Test importing the package doesn't import heavy dependencies or the submodules that use them"""
+        result = run_python(["-c", "import sys, spdb.spatialdb\n"
+                                   "print(' '.join(sys.modules))"])
+        loaded = result.stdout.split()
+
+        for name in HEAVY_MODULES + ["spdb.spatialdb.spatialdb", "spdb.spatialdb.rediskvio", "spdb.spatialdb.state",
+                                     "spdb.spatialdb.object", "spdb.spatialdb.cube"]:
+            self.assertEqual([m for m in loaded if m == name or m.startswith(name + ".")], [],
+                             "{} imported by spdb.spatialdb".format(name))
+
+    def test_package_exports_are_lazy(self):
+        """Test package exports are importable, but a submodule is only imported when its names are used"""
+        result = run_python(["-c", "import sys, spdb.spatialdb\n"
+                                   "assert 'spdb.spatialdb.spatialdb' not in sys.modules\n"
+                                   "from spdb.spatialdb import SpdbError, ErrorCodes\n"
+                                   "assert 'spdb.spatialdb.spatialdb' not in sys.modules\n"
+                                   "import spdb.spatialdb as s\n"
+                                   "print(s.SpatialDB.__module__, set(s.__all__) <= set(dir(s)))"])
+        self.assertEqual(result.stdout.split(), ["spdb.spatialdb.spatialdb", "True"])
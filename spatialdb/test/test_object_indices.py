@@ -129,6 +129,8 @@ class ObjectIndicesTestMixin(object):
                 't_range': [0, 1]
             }
             self.assertEqual(expected, actual)
+            for rng in actual.values():
+                self.assertEqual([int], list(set(type(val) for val in rng)))
 
     def test_get_loose_bounding_box_not_found(self):
         """Make sure None returned if id is not in channel."""
@@ -254,6 +254,207 @@ class RedisKVIOTestMixin(object):
         result = rkv.is_dirty(keys)
         assert result[0]
 
+    def test_is_dirty_after_flush(self):
+        """Test a cube becomes clean once all its write-cuboid keys are deleted"""
+        rkv = RedisKVIO(self.config_data)
+
+        # Clean up data
+        self.cache_client.flushdb()
+
+        data_packed = blosc.pack_array(np.random.randint(50, size=[10, 15, 5]))
+
+        keys = rkv.generate_cached_cuboid_keys(self.resource, 2, [0], [112])
+        base_key, time_sample, morton = "WRITE-CUBOID&{}".format(keys[0].split('&', 1)[1]).rsplit('&', 2)
+        write_key1 = rkv.insert_cube_in_write_buffer(base_key, time_sample, morton, data_packed)
+        write_key2 = rkv.insert_cube_in_write_buffer(base_key, time_sample, morton, data_packed)
+
+        dirty_key = rkv.generate_dirty_cuboid_key(keys[0])
+        assert dirty_key == rkv.generate_dirty_cuboid_key(write_key1)
+        assert [x.decode() for x in self.cache_client.zrange(dirty_key, 0, -1)] == [write_key1, write_key2]
+
+        rkv.delete_cube(write_key1)
+        assert rkv.is_dirty(keys)[0]
+
+        rkv.delete_cube(write_key2)
+        assert not rkv.is_dirty(keys)[0]
+        assert not self.cache_client.exists(dirty_key)
+
+    def test_is_dirty_stale_index(self):
+        """Test a write-cuboid key removed outside of delete_cube() doesn't leave a cube dirty"""
+        rkv = RedisKVIO(self.config_data)
+
+        # Clean up data
+        self.cache_client.flushdb()
+
+        data_packed = blosc.pack_array(np.random.randint(50, size=[10, 15, 5]))
+
+        keys = rkv.generate_cached_cuboid_keys(self.resource, 2, [0], [112])
+        base_key, time_sample, morton = "WRITE-CUBOID&{}".format(keys[0].split('&', 1)[1]).rsplit('&', 2)
+        write_key = rkv.insert_cube_in_write_buffer(base_key, time_sample, morton, data_packed)
+
+        self.cache_client.delete(write_key)
+
+        assert not rkv.is_dirty(keys)[0]
+        assert not self.cache_client.exists(rkv.generate_dirty_cuboid_key(keys[0]))
+
+    def test_cube_versions(self):
+        """Test that a cuboid's version stamp changes whenever it is written or becomes dirty"""
+        rkv = RedisKVIO(self.config_data)
+
+        keys = rkv.generate_cached_cuboid_keys(self.resource, 2, [0], [123, 124])
+        assert rkv.get_cube_versions(keys) == [None, None]
+
+        rkv.put_cubes(keys, [b"1", b"2"])
+        versions1 = rkv.get_cube_versions(keys)
+        assert None not in versions1
+        assert versions1[0] != versions1[1]
+
+        # Versions come back with the existence check
+        missing, cached, all_keys, versions = rkv.get_missing_read_cache_keys(self.resource, 2, [0, 1], [123, 124],
+                                                                              versions=True)
+        assert all_keys[:2] == keys
+        assert versions[:2] == versions1
+
+        # Inserting into the write buffer changes the version
+        base_key = "WRITE-CUBOID&{}&{}".format(self.resource.get_lookup_key(), 2)
+        write_key = rkv.insert_cube_in_write_buffer(base_key, 0, 123, b"3")
+        versions2 = rkv.get_cube_versions(keys)
+        assert versions2[0] != versions1[0]
+        assert versions2[1] == versions1[1]
+
+        # Flushing the write buffer changes it again
+        rkv.delete_cube(write_key)
+        versions3 = rkv.get_cube_versions(keys)
+        assert versions3[0] not in (versions1[0], versions2[0])
+
+    def test_empty_cubes(self):
+        """Test marking cubes as not in the object store and invalidating the marker when written"""
+        rkv = RedisKVIO(dict(self.config_data, empty_timeout=300))
+
+        keys = rkv.generate_cached_cuboid_keys(self.resource, 2, [0], [123, 124, 125])
+        assert rkv.get_empty_cubes(keys) == [False, False, False]
+
+        rkv.set_empty_cubes(keys)
+        assert rkv.get_empty_cubes(keys) == [True, True, True]
+        assert self.cache_client.ttl(rkv.generate_empty_cuboid_key(keys[0])) > 0
+
+        # Put in the cache
+        rkv.put_cubes([keys[0]], [b"1"])
+        assert rkv.get_empty_cubes(keys) == [False, True, True]
+
+        # Written and flushed
+        base_key = "WRITE-CUBOID&{}&{}".format(self.resource.get_lookup_key(), 2)
+        write_key = rkv.insert_cube_in_write_buffer(base_key, 0, 124, b"2")
+        assert rkv.get_empty_cubes(keys) == [False, False, True]
+        rkv.set_empty_cubes([keys[1]])
+        rkv.delete_cube(write_key)
+        assert rkv.get_empty_cubes(keys) == [False, False, True]
+
+    def test_empty_cubes_disabled(self):
+        """Test empty cube markers are off unless empty_timeout is configured"""
+        rkv = RedisKVIO(self.config_data)
+
+        keys = rkv.generate_cached_cuboid_keys(self.resource, 2, [0], [123, 124])
+        rkv.set_empty_cubes(keys)
+        assert rkv.get_empty_cubes(keys) == [False, False]
+        assert self.cache_client.get(rkv.generate_empty_cuboid_key(keys[0])) is None
+
+    def test_empty_cubes_versions(self):
+        """Test markers are only set if the cubes weren't written since their versions were read"""
+        rkv = RedisKVIO(dict(self.config_data, empty_timeout=300))
+
+        keys = rkv.generate_cached_cuboid_keys(self.resource, 2, [0], [123, 124])
+        versions = rkv.get_cube_versions(keys)
+
+        rkv.set_empty_cubes(keys, versions)
+        assert rkv.get_empty_cubes(keys) == [True, True]
+
+        # Written and flushed after the versions were read
+        self.cache_client.delete(*[rkv.generate_empty_cuboid_key(key) for key in keys])
+        base_key = "WRITE-CUBOID&{}&{}".format(self.resource.get_lookup_key(), 2)
+        rkv.delete_cube(rkv.insert_cube_in_write_buffer(base_key, 0, 124, b"2"))
+        rkv.set_empty_cubes(keys, versions)
+        assert rkv.get_empty_cubes(keys) == [False, False]
+
+        rkv.set_empty_cubes(keys, rkv.get_cube_versions(keys))
+        assert rkv.get_empty_cubes(keys) == [True, True]
+
+    def test_get_clean_cubes(self):
+        """Test checking and reading cubes in one call"""
+        rkv = RedisKVIO(self.config_data)
+
+        keys = rkv.generate_cached_cuboid_keys(self.resource, 2, [0], [123, 124, 125, 126])
+        rkv.put_cubes(keys[:3], [b"1", b"2", b"3"])
+
+        # Dirty cube
+        base_key = "WRITE-CUBOID&{}&{}".format(self.resource.get_lookup_key(), 2)
+        rkv.insert_cube_in_write_buffer(base_key, 0, 124, b"4")
+
+        # Stale dirty index
+        write_key = rkv.insert_cube_in_write_buffer(base_key, 0, 125, b"5")
+        self.cache_client.delete(write_key)
+
+        status, data, versions = rkv.get_clean_cubes(keys, versions=True)
+        self.assertEqual(status, [rkv.CUBE_CLEAN, rkv.CUBE_DIRTY, rkv.CUBE_CLEAN, rkv.CUBE_MISSING])
+        self.assertEqual(data, [b"1", None, b"3", None])
+        self.assertEqual(versions, rkv.get_cube_versions(keys))
+
+        status, data, versions = rkv.get_clean_cubes(keys, data=False)
+        self.assertEqual(status, [rkv.CUBE_CLEAN, rkv.CUBE_DIRTY, rkv.CUBE_CLEAN, rkv.CUBE_MISSING])
+        self.assertEqual(data, [None, None, None, None])
+        self.assertEqual(versions, [None, None, None, None])
+
+    def test_insert_cubes_in_write_buffer(self):
+        """Test inserting multiple cubes into the write buffer at once"""
+        rkv = RedisKVIO(self.config_data)
+
+        base_key = "WRITE-CUBOID&{}&{}".format(self.resource.get_lookup_key(), 2)
+        keys = rkv.insert_cubes_in_write_buffer(base_key, [(0, 123, b"1"), (1, 123, b"2"), (0, 124, b"3")])
+
+        assert len(set(keys)) == 3
+        assert [rkv.get_cube_from_write_buffer(key) for key in keys] == [b"1", b"2", b"3"]
+
+        cache_keys = [rkv.write_cuboid_key_to_cache_key(key) for key in keys]
+        assert rkv.is_dirty(cache_keys) == [True, True, True]
+
+    def test_get_pending_writes(self):
+        """Test reading the writes pending for multiple cuboids with their cached data"""
+        rkv = RedisKVIO(self.config_data)
+
+        base_key = "WRITE-CUBOID&{}&{}".format(self.resource.get_lookup_key(), 2)
+        keys = rkv.insert_cubes_in_write_buffer(base_key, [(0, 123, b"1"), (0, 124, b"2")])
+        keys += rkv.insert_cubes_in_write_buffer(base_key, [(0, 123, b"3"), (0, 124, b"4")])
+        cache_keys = [rkv.write_cuboid_key_to_cache_key(key) for key in keys[:2]] + \
+                     ["CACHED-CUBOID&{}&{}&0&125".format(self.resource.get_lookup_key(), 2)]
+        rkv.put_cubes(cache_keys[0], [b"cached"])
+
+        # A write removed from the write buffer has been flushed, so is not returned
+        rkv.cache_client.delete(keys[1])
+
+        rows, writes = rkv.get_pending_writes(cache_keys)
+        assert rows == [b"cached", None, None]
+        assert writes == [[b"1", b"3"], [b"4"], []]
+
+    def test_get_pending_writes_ordered_by_server(self):
+        """Test pending writes are ordered by the Redis write sequence, not the clocks of the writing clients"""
+        rkv1 = RedisKVIO(self.config_data)
+        rkv2 = RedisKVIO(self.config_data)
+
+        base_key = "WRITE-CUBOID&{}&{}".format(self.resource.get_lookup_key(), 2)
+        with patch('time.time', return_value=2000.0):
+            write_key1 = rkv1.insert_cube_in_write_buffer(base_key, 0, 123, b"1")
+        # A client whose clock is behind writes last
+        with patch('time.time', return_value=1000.0):
+            write_key2 = rkv2.insert_cube_in_write_buffer(base_key, 0, 123, b"2")
+
+        dirty_key = rkv1.generate_dirty_cuboid_key(write_key1)
+        scores = self.cache_client.zrange(dirty_key, 0, -1, withscores=True)
+        assert [key.decode() for key, _ in scores] == [write_key1, write_key2]
+        assert scores[0][1] < scores[1][1]
+
+        rows, writes = rkv1.get_pending_writes([rkv1.write_cuboid_key_to_cache_key(write_key1)])
+        assert writes == [[b"1", b"2"]]
+
     def test_write_buffer_io(self):
         """Test methods specific to single cube write buffer io"""
         resolution = 1
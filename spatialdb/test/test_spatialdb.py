@@ -13,14 +13,18 @@
 # limitations under the License.
 
 import unittest
-from unittest.mock import patch
+from unittest.mock import patch, MagicMock
 import redis
 from mockredis import mock_strict_redis_client
 import collections
+import tempfile
+import time
 
 from spdb.project import BossResourceBasic
 from spdb.spatialdb import Cube, SpatialDB, SpdbError
+from spdb.spatialdb.test.pageout import LocalPageOutExecutor
 from spdb.c_lib.ndtype import CUBOIDSIZE
+from spdb.c_lib.ndlib import XYZMorton, MortonXYZ
 
 import numpy as np
 
@@ -87,6 +91,25 @@ class SpatialDBImageDataTestMixin(object):
         sp.cache_state.set_project_lock(self.resource.get_lookup_key(), False)
         assert not sp.resource_locked(self.resource.get_lookup_key())
 
+    def test_codec_map(self):
+        """Test the codec thread pool is only used if blosc calls can run concurrently"""
+        sp = SpatialDB(self.kvio_config, self.state_config, self.object_store_config)
+        assert sp.codec_threads == 1
+
+        sp.codec_threads = 4
+        with patch.dict('os.environ', clear=False) as env:
+            env.pop("BLOSC_NOLOCK", None)
+            assert sp._codec_map(lambda x: x * 2, [1, 2, 3]) == [2, 4, 6]
+            assert sp._codec_executor is None
+
+            env["BLOSC_NOLOCK"] = "1"
+            with patch('spdb.spatialdb.spatialdb.blosc') as mock_blosc:
+                assert sp._codec_map(lambda x: x * 2, [1, 2, 3]) == [2, 4, 6]
+                mock_blosc.set_releasegil.assert_called_once_with(True)
+            assert sp._codec_executor is not None
+
+        sp.close()
+
     def test_get_cubes_no_time_single(self):
         """Test the get_cubes method - no time - single"""
         # Generate random data
@@ -215,6 +238,538 @@ class SpatialDBImageDataTestMixin(object):
 
         np.testing.assert_array_equal(cube1.data, cube2.data)
 
+    def test_cutout_time_multiple_unaligned_hit(self):
+        """Test a cutout spanning multiple cuboids and time samples, not cuboid aligned"""
+        db = SpatialDB(self.kvio_config, self.state_config, self.object_store_config)
+
+        # Populate a 2x2x2 block of cuboids in the cache
+        expected = np.zeros([2, self.z_dim * 2, self.y_dim * 2, self.x_dim * 2], dtype=self.resource.get_numpy_data_type())
+        for x in range(2):
+            for y in range(2):
+                for z in range(2):
+                    cube = Cube.create_cube(self.resource, [self.x_dim, self.y_dim, self.z_dim], [0, 2])
+                    cube.random()
+                    cube.morton_id = XYZMorton([x, y, z])
+                    self.write_test_cube(db, self.resource, 0, cube, cache=True, s3=False)
+                    expected[:, z * self.z_dim:(z + 1) * self.z_dim, y * self.y_dim:(y + 1) * self.y_dim,
+                             x * self.x_dim:(x + 1) * self.x_dim] = cube.data
+
+        corner = (self.x_dim - 20, self.y_dim - 30, self.z_dim - 3)
+        extent = (50, 60, 6)
+        cube2 = db.cutout(self.resource, corner, extent, 0, [0, 2])
+
+        # Output is allocated at exactly the requested extent
+        assert cube2.data.shape == (2, extent[2], extent[1], extent[0])
+        assert cube2.data.flags['C_CONTIGUOUS']
+        np.testing.assert_array_equal(cube2.data,
+                                      expected[:, corner[2]:corner[2] + extent[2], corner[1]:corner[1] + extent[1],
+                                               corner[0]:corner[0] + extent[0]])
+
+    def test_cutout_out_buffer(self):
+        """Test cutting out into caller provided buffers"""
+        db = SpatialDB(self.kvio_config, self.state_config, self.object_store_config)
+
+        cube1 = Cube.create_cube(self.resource, [self.x_dim, self.y_dim, self.z_dim])
+        cube1.random()
+        cube1.morton_id = 0
+        self.write_test_cube(db, self.resource, 0, cube1, cache=True, s3=False)
+
+        corner = (10, 20, 3)
+        extent = (40, 30, 5)
+        expected = cube1.data[:, 3:8, 20:50, 10:50]
+        dtype = self.resource.get_numpy_data_type()
+
+        # ndarray, reused with stale data
+        out = np.ones((1, 5, 30, 40), dtype=dtype)
+        cube2 = db.cutout(self.resource, corner, extent, 0, out=out)
+        assert cube2.data is out
+        np.testing.assert_array_equal(out, expected)
+
+        # memmap
+        with tempfile.TemporaryFile() as fp:
+            out = np.memmap(fp, dtype=dtype, mode="w+", shape=(1, 5, 30, 40))
+            db.cutout(self.resource, corner, extent, 0, out=out)
+            np.testing.assert_array_equal(out, expected)
+
+        # Shared memory style object exposing a buffer
+        shared = collections.namedtuple("SharedMemory", ["buf"])(bytearray(expected.nbytes + 100))
+        db.cutout(self.resource, corner, extent, 0, out=shared)
+        np.testing.assert_array_equal(np.frombuffer(shared.buf, dtype=dtype, count=expected.size).reshape(expected.shape),
+                                      expected)
+
+    def test_cutout_out_buffer_mismatch(self):
+        """Test a caller provided buffer must match the cutout"""
+        db = SpatialDB(self.kvio_config, self.state_config, self.object_store_config)
+        dtype = self.resource.get_numpy_data_type()
+
+        read_only = np.zeros((1, 5, 30, 40), dtype=dtype)
+        read_only.flags.writeable = False
+
+        for out in [np.zeros((1, 5, 30, 41), dtype=dtype),
+                    np.zeros((1, 5, 30, 40), dtype=np.float32),
+                    read_only,
+                    bytearray(10)]:
+            with self.assertRaises(SpdbError):
+                db.cutout(self.resource, (0, 0, 0), (40, 30, 5), 0, out=out)
+
+        # Strided views are fine
+        out = np.zeros((1, 10, 30, 40), dtype=dtype)[:, ::2]
+        db.cutout(self.resource, (0, 0, 0), (40, 30, 5), 0, out=out)
+
+    def test_cutout_many(self):
+        """Test cutting out overlapping regions at once matches individual cutouts and reads each cuboid once"""
+        db = SpatialDB(self.kvio_config, self.state_config, self.object_store_config)
+
+        for x in range(2):
+            cube = Cube.create_cube(self.resource, [self.x_dim, self.y_dim, self.z_dim])
+            cube.random()
+            cube.morton_id = XYZMorton([x, 0, 0])
+            self.write_test_cube(db, self.resource, 0, cube, cache=True, s3=False)
+
+        regions = [((self.x_dim - 10, 5, 2), (20, 10, 4)),
+                   ((self.x_dim - 30, 0, 0), (40, 3, 2)),
+                   ((5, 5, 5), (10, 10, 10)),
+                   ((5, 5, self.z_dim), (10, 10, 3))]
+        expected = [db.cutout(self.resource, corner, extent, 0) for corner, extent in regions]
+
+        with patch.object(db.kvio, 'get_clean_cubes', wraps=db.kvio.get_clean_cubes) as mock_get_clean_cubes:
+            cubes = db.cutout_many(self.resource, regions, 0)
+
+        assert mock_get_clean_cubes.call_count == 1
+        self.assertEqual(len(mock_get_clean_cubes.call_args[0][0]), 3)
+        for cube, expected_cube in zip(cubes, expected):
+            np.testing.assert_array_equal(cube.data, expected_cube.data)
+
+    def test_cutout_read_your_writes(self):
+        """Test a cutout can merge in pending writes instead of waiting for them to be flushed"""
+        db = SpatialDB(self.kvio_config, self.state_config, self.object_store_config)
+        db.dirty_poll_interval = 0.001
+        db.dirty_read_timeout = 0.05
+
+        cube = Cube.create_cube(self.resource, [self.x_dim, self.y_dim, self.z_dim])
+        cube.random()
+        cube.morton_id = 0
+        self.write_test_cube(db, self.resource, 0, cube, cache=True, s3=False)
+
+        # Two pending writes over the cached cuboid and a cuboid that only exists in the write buffer
+        data = np.zeros([4, 10, self.x_dim + 10], dtype=self.resource.get_numpy_data_type())
+        data[:, :, :5] = 3
+        data2 = np.zeros(data.shape, dtype=data.dtype)
+        data2[:, :, 3:] = 4
+        with patch.object(db.objectio, 'trigger_page_out_batch'):
+            db.write_cuboid(self.resource, (0, 0, 0), 0, data)
+            db.write_cuboid(self.resource, (0, 0, 0), 0, data2)
+
+        expected = np.zeros([1, 4, 10, self.x_dim + 10], dtype=data.dtype)
+        expected[0, :, :, :self.x_dim] = cube.data[0, :4, :10, :]
+        expected[0, :, :, :5] = 3
+        expected[0, :, :, 3:] = 4
+
+        with self.assertRaises(SpdbError):
+            db.cutout(self.resource, (0, 0, 0), (self.x_dim + 10, 10, 4), 0)
+
+        with patch.object(db.objectio, 'cuboids_exist', side_effect=lambda keys, idx: ([], list(idx))):
+            out_cube = db.cutout(self.resource, (0, 0, 0), (self.x_dim + 10, 10, 4), 0, read_your_writes=True)
+            np.testing.assert_array_equal(out_cube.data, expected)
+
+            # Bypassing the cache, the cached cuboid isn't in S3 so only the writes are read
+            out_cube = db.cutout(self.resource, (0, 0, 0), (self.x_dim + 10, 10, 4), 0, no_cache=True,
+                                 read_your_writes=True)
+            expected[0, :, :, :self.x_dim] = 0
+            expected[0, :, :, :5] = 3
+            expected[0, :, :, 3:] = 4
+            np.testing.assert_array_equal(out_cube.data, expected)
+
+    def test_cutout_stream(self):
+        """Test a streaming cutout matches the full cutout"""
+        db = SpatialDB(self.kvio_config, self.state_config, self.object_store_config)
+
+        for z in range(2):
+            cube = Cube.create_cube(self.resource, [self.x_dim, self.y_dim, self.z_dim])
+            cube.random()
+            cube.morton_id = XYZMorton([0, 0, z])
+            self.write_test_cube(db, self.resource, 0, cube, cache=True, s3=False)
+
+        corner = (10, 20, self.z_dim - 5)
+        extent = (40, 30, 12)
+        expected = db.cutout(self.resource, corner, extent, 0)
+
+        for prefetch in (0, 1, 2):
+            slabs = list(db.cutout_stream(self.resource, corner, extent, 0, slab_depth=4, prefetch=prefetch))
+
+            # Slabs are aligned to multiples of slab_depth
+            self.assertEqual([c[2] for c, _ in slabs], [self.z_dim - 5, self.z_dim - 4, self.z_dim, self.z_dim + 4])
+            np.testing.assert_array_equal(np.concatenate([slab.data for _, slab in slabs], axis=1), expected.data)
+
+    def test_cutout_stream_close(self):
+        """Test stopping a streaming cutout early"""
+        db = SpatialDB(self.kvio_config, self.state_config, self.object_store_config)
+
+        stream = db.cutout_stream(self.resource, (0, 0, 0), (self.x_dim, self.y_dim, self.z_dim * 4), 0, prefetch=2)
+        corner, slab = next(stream)
+        stream.close()
+
+        self.assertEqual(corner, (0, 0, 0))
+        self.assertEqual(slab.data.shape, (1, self.z_dim, self.y_dim, self.x_dim))
+
+    def test_cutout_empty_cuboid_cache(self):
+        """Test cuboids found to not exist in the object store aren't checked again"""
+        db = SpatialDB(dict(self.kvio_config, empty_timeout=300), self.state_config, self.object_store_config)
+
+        with patch.object(db.objectio, 'cuboids_exist', wraps=db.objectio.cuboids_exist) as mock_exist:
+            for _ in range(2):
+                cube = db.cutout(self.resource, (0, 0, 0), (self.x_dim, self.y_dim, self.z_dim), 0)
+                np.testing.assert_array_equal(np.sum(cube.data), 0)
+
+        assert mock_exist.call_count == 1
+
+        # Once the cuboid is written it is looked up again
+        key = db.kvio.generate_cached_cuboid_keys(self.resource, 0, [0], [0])[0]
+        assert db.kvio.get_empty_cubes([key]) == [True]
+        db.kvio.delete_cube(db.kvio.insert_cube_in_write_buffer(
+            "WRITE-CUBOID&{}&0".format(self.resource.get_lookup_key()), 0, 0, b""))
+        assert db.kvio.get_empty_cubes([key]) == [False]
+
+    def test_cutout_empty_cuboid_cache_page_out_during_lookup(self):
+        """Test a cuboid paged out while the object store is checked isn't marked empty"""
+        db = SpatialDB(dict(self.kvio_config, empty_timeout=300), self.state_config, self.object_store_config)
+        key = db.kvio.generate_cached_cuboid_keys(self.resource, 0, [0], [0])[0]
+
+        def page_out_during_lookup(keys, idx):
+            # The write buffer is flushed after the index was checked
+            db.kvio.delete_cube(db.kvio.insert_cube_in_write_buffer(
+                "WRITE-CUBOID&{}&0".format(self.resource.get_lookup_key()), 0, 0, b""))
+            return [], list(idx)
+
+        with patch.object(db.objectio, 'cuboids_exist', side_effect=page_out_during_lookup):
+            db.cutout(self.resource, (0, 0, 0), (self.x_dim, self.y_dim, self.z_dim), 0)
+
+        assert db.kvio.get_empty_cubes([key]) == [False]
+
+    def test_cutout_cuboid_cache(self):
+        """Test repeat reads are served from the cuboid cache until the cuboid changes"""
+        kvio_config = dict(self.kvio_config, cuboid_cache_bytes=10 * 1024 * 1024)
+        db = SpatialDB(kvio_config, self.state_config, self.object_store_config)
+        db.cuboid_cache.clear()
+
+        cube1 = Cube.create_cube(self.resource, [self.x_dim, self.y_dim, self.z_dim])
+        cube1.random()
+        cube1.morton_id = 0
+        self.write_test_cube(db, self.resource, 0, cube1, cache=True, s3=False)
+
+        for _ in range(2):
+            cube2 = db.cutout(self.resource, (0, 0, 0), (self.x_dim, self.y_dim, self.z_dim), 0)
+            np.testing.assert_array_equal(cube1.data, cube2.data)
+        assert db.cuboid_cache.misses == 1
+        assert db.cuboid_cache.hits == 1
+
+        # Output doesn't share memory with the cache
+        cube2.data[:] = 0
+        cube3 = db.get_cubes(self.resource, db.kvio.generate_cached_cuboid_keys(self.resource, 0, [0], [0]))[0]
+        np.testing.assert_array_equal(cube1.data, cube3.data)
+        assert db.cuboid_cache.hits == 2
+
+        # Overwriting the cuboid invalidates it
+        cube1.random()
+        self.write_test_cube(db, self.resource, 0, cube1, cache=True, s3=False)
+        cube2 = db.cutout(self.resource, (0, 0, 0), (self.x_dim, self.y_dim, self.z_dim), 0)
+        np.testing.assert_array_equal(cube1.data, cube2.data)
+        assert db.cuboid_cache.misses == 2
+
+    def test_wait_for_clean_cubes(self):
+        """Test waiting on dirty cubes, falling back to polling since events are not available in the mock"""
+        db = SpatialDB(self.kvio_config, self.state_config, self.object_store_config)
+        db.dirty_poll_interval = 0.001
+
+        keys = ["CACHED-CUBOID&1&1&1&0&0&0", "CACHED-CUBOID&1&1&1&0&0&1"]
+        with patch.object(db.kvio, 'is_dirty', side_effect=[[True, False], [True], [False]]):
+            result = list(db.wait_for_clean_cubes(keys))
+
+        self.assertEqual(result, [[keys[1]], [keys[0]]])
+
+    def test_wait_for_clean_cubes_timeout(self):
+        """Test waiting on dirty cubes that never get flushed"""
+        db = SpatialDB(self.kvio_config, self.state_config, self.object_store_config)
+        db.dirty_poll_interval = 0.001
+        db.dirty_read_timeout = 0.05
+
+        with patch.object(db.kvio, 'is_dirty', return_value=[True]):
+            with self.assertRaises(SpdbError):
+                list(db.wait_for_clean_cubes(["CACHED-CUBOID&1&1&1&0&0&0"]))
+
+    def test_write_cuboid_batch(self):
+        """Test writing a region triggers page out once per cuboid, delaying cuboids already in page out"""
+        db = SpatialDB(self.kvio_config, self.state_config, self.object_store_config)
+
+        data = np.random.randint(1, 200, size=[2, 10, 20, self.x_dim + 10], dtype=self.resource.get_numpy_data_type())
+        with patch.object(db.objectio, 'trigger_page_out_batch') as fake_trigger:
+            db.write_cuboid(self.resource, (0, 0, 0), 0, data, time_sample_start=0)
+            db.write_cuboid(self.resource, (0, 0, 0), 0, data[:, :, :, :self.x_dim], time_sample_start=0)
+
+        # 2 cuboids x 2 time samples, then the second write's 2 are all already in page out
+        write_cuboid_keys = fake_trigger.call_args_list[0][0][1]
+        assert len(write_cuboid_keys) == 4
+        assert fake_trigger.call_args_list[1][0][1] == []
+        assert len(db.cache_state.get_all_delayed_write_keys()) == 2
+
+        # Flushed cuboids can be read back
+        for write_cuboid_key in write_cuboid_keys:
+            db.cache_state.remove_from_page_out(write_cuboid_key)
+            db.kvio.put_cubes(db.kvio.write_cuboid_key_to_cache_key(write_cuboid_key),
+                              [db.kvio.get_cube_from_write_buffer(write_cuboid_key)])
+            db.kvio.delete_cube(write_cuboid_key)
+        for delayed_write_key in db.cache_state.get_all_delayed_write_keys():
+            for write_cuboid_key in db.cache_state.get_delayed_writes(delayed_write_key):
+                db.kvio.delete_cube(write_cuboid_key)
+
+        cube = db.cutout(self.resource, (0, 0, 0), (self.x_dim + 10, 20, 10), 0, [0, 2])
+        np.testing.assert_array_equal(cube.data, data)
+
+    def test_write_cuboid_split(self):
+        """Test an unaligned write is split into cuboids zero padded only outside the written region"""
+        db = SpatialDB(self.kvio_config, self.state_config, self.object_store_config)
+
+        # Spans a full interior cuboid and partial edge cuboids
+        data = np.random.randint(1, 200, size=[2, self.z_dim + 1, self.y_dim, self.x_dim + 1],
+                                 dtype=self.resource.get_numpy_data_type())
+        corner = (self.x_dim - 1, 0, self.z_dim - 1)
+        with patch.object(db.objectio, 'trigger_page_out_batch') as fake_trigger:
+            db.write_cuboid(self.resource, corner, 0, data, time_sample_start=3)
+
+        expected = np.zeros([2, 2 * self.z_dim, self.y_dim, 2 * self.x_dim], dtype=data.dtype)
+        expected[:, corner[2]:, :, corner[0]:] = data
+
+        write_cuboid_keys = fake_trigger.call_args_list[0][0][1]
+        assert len(write_cuboid_keys) == 8
+        for write_cuboid_key in write_cuboid_keys:
+            t, morton = [int(v) for v in write_cuboid_key.split("&")[-3:-1]]
+            x, y, z = MortonXYZ(morton)
+            cube = Cube.create_cube(self.resource, [self.x_dim, self.y_dim, self.z_dim])
+            cube.from_blosc([db.kvio.get_cube_from_write_buffer(write_cuboid_key)])
+            np.testing.assert_array_equal(cube.data[0],
+                                          expected[t - 3,
+                                                   z * self.z_dim:(z + 1) * self.z_dim,
+                                                   y * self.y_dim:(y + 1) * self.y_dim,
+                                                   x * self.x_dim:(x + 1) * self.x_dim])
+
+    def test_write_cuboid_skip_zeros(self):
+        """Test cuboids where the data written is all zeros are skipped"""
+        db = SpatialDB(self.kvio_config, self.state_config, self.object_store_config)
+
+        data = np.zeros([2, 10, 20, self.x_dim + 10], dtype=self.resource.get_numpy_data_type())
+        data[1, :, :, self.x_dim:] = 5
+        with patch.object(db.objectio, 'trigger_page_out_batch') as fake_trigger:
+            skipped = db.write_cuboid(self.resource, (0, 0, 0), 0, data, time_sample_start=0)
+            assert db.write_cuboid(self.resource, (0, 0, 0), 0, np.zeros(data.shape[1:], dtype=data.dtype)) == 2
+
+        # Only the second cuboid at time sample 1 is written
+        assert skipped == 3
+        write_cuboid_keys = fake_trigger.call_args_list[0][0][1]
+        assert len(write_cuboid_keys) == 1
+        assert write_cuboid_keys[0].split("&")[-3:-1] == ["1", str(XYZMorton([1, 0, 0]))]
+        assert fake_trigger.call_args_list[1][0][1] == []
+        assert db.kvio.cache_client.keys("WRITE-CUBOID&*") == [write_cuboid_keys[0].encode()]
+
+    def test_write_cuboid_local_page_out(self):
+        """Test writing with the local page out executor flushes write-cuboids in process and merges them"""
+        db = SpatialDB(self.kvio_config, self.state_config, self.object_store_config)
+        executor = LocalPageOutExecutor(db)
+        db.objectio.page_out_executor = executor
+
+        data = np.random.randint(1, 200, size=[10, 20, self.x_dim + 10], dtype=self.resource.get_numpy_data_type())
+        data2 = np.zeros(data.shape, dtype=data.dtype)
+        data2[:, :, self.x_dim:] = 7
+        with patch.object(db.objectio, 'put_objects') as fake_put, \
+                patch.object(db.objectio, 'add_cuboid_to_index'), \
+                patch.object(db.objectio, 'cuboids_exist', return_value=([], [0])):
+            db.write_cuboid(self.resource, (0, 0, 0), 0, data, time_sample_start=2)
+            db.write_cuboid(self.resource, (0, 0, 0), 0, data2, time_sample_start=2)
+
+        # 2 cuboids in the first write, 1 in the second since it is all zeros in the other, all flushed
+        assert len(executor.flushed_keys) == 3
+        assert fake_put.call_count == 3
+        assert db.cache_state.get_all_delayed_write_keys() == []
+        assert db.kvio.is_dirty([db.kvio.write_cuboid_key_to_cache_key(key) for key in executor.flushed_keys]) == [False] * 3
+
+        # Zeros in the second write do not overwrite
+        expected = data.copy()
+        expected[:, :, self.x_dim:] = 7
+        cube = db.cutout(self.resource, (0, 0, 0), (self.x_dim + 10, 20, 10), 0, [2, 3])
+        np.testing.assert_array_equal(cube.data[0], expected)
+
+    def test_page_objects_into_cache(self):
+        """Test a batch of objects is written to the cache with a single completion message"""
+        cubes = []
+        for morton in range(3):
+            cube = Cube.create_cube(self.resource, [self.x_dim, self.y_dim, self.z_dim])
+            cube.random()
+            cube.morton_id = morton
+            cubes.append(cube)
+
+        db = SpatialDB(self.kvio_config, self.state_config, self.object_store_config)
+        cache_keys = db.kvio.generate_cached_cuboid_keys(self.resource, 0, [0], [c.morton_id for c in cubes])
+        object_keys = db.objectio.cached_cuboid_to_object_keys(cache_keys)
+
+        with patch.object(db.objectio, 'get_objects',
+                          return_value=[c.to_blosc_by_time_index(0) for c in cubes]) as fake_get, \
+                patch.object(db.cache_state, 'notify_page_in_batch_complete') as fake_notify:
+            db.page_objects_into_cache(object_keys, "PAGE-IN-CHANNEL&abc")
+
+        fake_get.assert_called_once_with(object_keys)
+        fake_notify.assert_called_once_with("PAGE-IN-CHANNEL&abc", cache_keys)
+
+        for cube, (_, _, cube_bytes) in zip(cubes, db.kvio.get_cubes(cache_keys)):
+            cached = Cube.create_cube(self.resource, [self.x_dim, self.y_dim, self.z_dim])
+            cached.from_blosc([cube_bytes])
+            np.testing.assert_array_equal(cached.data, cube.data)
+
+    def test_cutout_page_in_progressive(self):
+        """Test cuboids paged in by lambda are read and decompressed as each page in completes"""
+        cubes = []
+        for morton in range(4):
+            cube = Cube.create_cube(self.resource, [self.x_dim, self.y_dim, self.z_dim])
+            cube.random()
+            cube.morton_id = morton
+            cubes.append(cube)
+
+        db = SpatialDB(self.kvio_config, self.state_config, self.object_store_config)
+        db.read_lambda_threshold = 0
+        cache_keys = db.kvio.generate_cached_cuboid_keys(self.resource, 0, [0], [c.morton_id for c in cubes])
+
+        def fake_page_in(key_list):
+            assert key_list == cache_keys
+            for batch in ([0, 3], [1, 2]):
+                db.kvio.put_cubes([cache_keys[idx] for idx in batch],
+                                  [cubes[idx].to_blosc_by_time_index(0) for idx in batch])
+                yield [cache_keys[idx] for idx in batch]
+
+        with patch.object(db.objectio, 'cuboids_exist', return_value=([0, 1, 2, 3], [])), \
+                patch.object(db, 'page_in_cubes_iter', side_effect=fake_page_in), \
+                patch.object(db.kvio, 'get_cubes', wraps=db.kvio.get_cubes) as fake_get_cubes:
+            cube = db.cutout(self.resource, (0, 0, 0), (self.x_dim * 2, self.y_dim * 2, self.z_dim), 0)
+
+        # One read per page in completion
+        assert fake_get_cubes.call_count == 2
+
+        expected = np.zeros((self.z_dim, self.y_dim * 2, self.x_dim * 2), dtype=cube.data.dtype)
+        for c in cubes:
+            x, y, _ = MortonXYZ(c.morton_id)
+            expected[:, y * self.y_dim:(y + 1) * self.y_dim, x * self.x_dim:(x + 1) * self.x_dim] = c.data[0]
+        np.testing.assert_array_equal(cube.data[0], expected)
+
+    def test_page_in_cubes_overlapping(self):
+        """Test overlapping page-ins on the same instance each only read their own completion messages"""
+        db = SpatialDB(self.kvio_config, self.state_config, self.object_store_config)
+        db.page_in_hedge_percentile = None
+        cache_keys = db.kvio.generate_cached_cuboid_keys(self.resource, 0, [0], [0, 1, 2, 3])
+
+        # Each listener only receives messages published to its own channel
+        published = collections.defaultdict(list)
+
+        def fake_pubsub():
+            listener = MagicMock()
+
+            def get_message(timeout=0.0):
+                channel = listener.subscribe.call_args[0][0]
+                if published[channel]:
+                    return {"channel": channel.encode(), "type": "message",
+                            "data": published[channel].pop(0).encode()}
+                return None
+
+            listener.get_message.side_effect = get_message
+            return listener
+
+        def fake_page_in_objects(key_list, page_in_channel, kv_config, state_config):
+            published[page_in_channel].extend(key_list)
+
+        with patch.object(db.cache_state.status_client, 'pubsub', side_effect=fake_pubsub, create=True), \
+                patch.object(db.objectio, 'page_in_objects', side_effect=fake_page_in_objects):
+            # Start both page-ins before either finishes
+            pages1 = db.page_in_cubes_iter(cache_keys[:2], timeout=1)
+            pages2 = db.page_in_cubes_iter(cache_keys[2:], timeout=1)
+            first1 = next(pages1)
+            first2 = next(pages2)
+
+            assert [first1] + list(pages1) == [[cache_keys[0]], [cache_keys[1]]]
+            assert [first2] + list(pages2) == [[cache_keys[2]], [cache_keys[3]]]
+
+    def test_page_in_cubes_hedged(self):
+        """Test keys still missing after the hedge delay are read directly from the object store"""
+        cubes = []
+        for morton in range(3):
+            cube = Cube.create_cube(self.resource, [self.x_dim, self.y_dim, self.z_dim])
+            cube.random()
+            cube.morton_id = morton
+            cubes.append(cube)
+
+        db = SpatialDB(self.kvio_config, self.state_config, self.object_store_config)
+        db._page_in_latencies = collections.deque()
+        db.page_in_hedge_percentile = 95
+        db.page_in_hedge_delay = 0.1
+        cache_keys = db.kvio.generate_cached_cuboid_keys(self.resource, 0, [0], [c.morton_id for c in cubes])
+        object_keys = db.objectio.cached_cuboid_to_object_keys(cache_keys)
+
+        # Only the first key is paged in by lambda
+        channel = "PAGE-IN-CHANNEL&abc"
+        db.kvio.put_cubes(cache_keys[:1], [cubes[0].to_blosc_by_time_index(0)])
+        messages = [{"channel": channel.encode(), "type": "message", "data": cache_keys[0].encode()}]
+
+        def get_message(timeout=0.0):
+            if messages:
+                return messages.pop(0)
+            time.sleep(timeout)
+            return None
+
+        listener = MagicMock()
+        listener.get_message.side_effect = get_message
+
+        with patch.object(db.cache_state, 'create_page_in_channel', return_value=(channel, listener)), \
+                patch.object(db.cache_state, 'delete_page_in_channel') as fake_delete, \
+                patch.object(db.objectio, 'page_in_objects') as fake_page_in, \
+                patch.object(db.objectio, 'get_objects',
+                             return_value=[c.to_blosc_by_time_index(0) for c in cubes[1:]]) as fake_get:
+            pages = list(db.page_in_cubes_iter(cache_keys))
+
+        assert pages == [cache_keys[:1], cache_keys[1:]]
+        fake_page_in.assert_called_once_with(cache_keys, channel, self.kvio_config, self.state_config)
+        fake_get.assert_called_once_with(object_keys[1:])
+        fake_delete.assert_called_once_with(channel, listener)
+        assert len(db._page_in_latencies) == 1
+
+        for cube, (_, _, cube_bytes) in zip(cubes, db.kvio.get_cubes(cache_keys)):
+            assert cube_bytes == cube.to_blosc_by_time_index(0)
+
+    def test_get_page_in_hedge_delay(self):
+        """Test the hedge delay is the configured delay until there are enough page in latencies"""
+        db = SpatialDB(self.kvio_config, self.state_config, self.object_store_config)
+
+        # Hedging is off by default
+        assert db.get_page_in_hedge_delay() is None
+
+        db.page_in_hedge_percentile = 95
+        db._page_in_latencies = collections.deque(x / 10 for x in range(1, 11))
+        db.page_in_hedge_min_samples = 20
+
+        assert db.get_page_in_hedge_delay() == db.page_in_hedge_delay
+
+        db._page_in_latencies.extend(x / 10 for x in range(11, 101))
+        assert abs(db.get_page_in_hedge_delay() - 9.505) < 1e-6
+
+        db.page_in_hedge_percentile = None
+        assert db.get_page_in_hedge_delay() is None
+
+    def test_local_page_out_executor_message_formats(self):
+        """Test the local page out executor accepts single key and batch page out messages"""
+        db = SpatialDB(self.kvio_config, self.state_config, self.object_store_config)
+        executor = LocalPageOutExecutor(db)
+        keys = ["WRITE-CUBOID&1&1&1&0&0&{}&abc".format(x) for x in range(3)]
+
+        with patch.object(executor, 'flush') as fake_flush:
+            executor({"write_cuboid_key": keys[0], "resource": self.resource.to_dict()})
+            executor({"write_cuboid_keys": keys[1:], "resource": self.resource.to_dict()})
+
+        assert [c[0][0] for c in fake_flush.call_args_list] == keys
+
     def test_write_cuboid_off_base_res(self):
         """Test writing a cuboid to not the base resolution"""
         # Generate random data
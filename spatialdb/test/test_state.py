@@ -12,12 +12,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
+import time
 import unittest
-from unittest.mock import patch
+from unittest.mock import patch, MagicMock
 from mockredis import mock_strict_redis_client
 
 from spdb.project import BossResourceBasic
-from spdb.spatialdb import CacheStateDB
+from spdb.spatialdb import CacheStateDB, SpdbError
 
 import redis
 
@@ -53,6 +55,51 @@ class CacheStateDBTestMixin(object):
 
         assert csdb.project_locked("1&1&1") == False
 
+    def test_project_locked_cached(self):
+        """Test a channel's lock state is cached for lock_cache_timeout seconds and shared by all instances"""
+        csdb = CacheStateDB(self.config_data)
+        csdb2 = CacheStateDB(self.config_data)
+
+        with patch.object(self.state_client, 'exists', wraps=self.state_client.exists) as fake_exists:
+            assert csdb.project_locked("1&1&1") == False
+            assert csdb2.project_locked("1&1&1") == False
+        assert fake_exists.call_count == 1
+
+        # A lock set by another process isn't seen until the cached state expires
+        self.state_client.set("WRITE-LOCK&1&1&1", True)
+        assert csdb2.project_locked("1&1&1") == False
+        CacheStateDB._lock_cache["1&1&1"] = (0, False)
+        assert csdb2.project_locked("1&1&1") == True
+
+        # A lock changed in this process is seen by all instances immediately
+        assert csdb.project_locked("1&1&1") == True
+        csdb2.set_project_lock("1&1&1", False)
+        assert csdb.project_locked("1&1&1") == False
+        csdb.set_project_lock("1&1&1", True)
+        assert csdb2.project_locked("1&1&1") == True
+
+        config = dict(self.config_data)
+        config["lock_cache_timeout"] = 0
+        csdb3 = CacheStateDB(config)
+        self.state_client.delete("WRITE-LOCK&1&1&1")
+        assert csdb3.project_locked("1&1&1") == False
+        assert csdb2.project_locked("1&1&1") == True
+
+    def test_project_locked_set_during_check(self):
+        """Test a lock state read before set_project_lock() isn't cached after it"""
+        csdb = CacheStateDB(self.config_data)
+        csdb2 = CacheStateDB(self.config_data)
+
+        def exists_then_lock(key):
+            result = self.state_client.get(key) is not None
+            csdb2.set_project_lock("1&1&1", True)
+            return result
+
+        with patch.object(self.state_client, 'exists', side_effect=exists_then_lock):
+            assert csdb.project_locked("1&1&1") == False
+
+        assert csdb.project_locked("1&1&1") == True
+
     def test_add_to_page_out(self):
         """Test if a cube is in page out"""
         csdb = CacheStateDB(self.config_data)
@@ -73,6 +120,9 @@ class CacheStateDBTestMixin(object):
 
         assert csdb.in_page_out(temp_page_out_key, lookup_key, resolution, morton, time_sample)
 
+        in_page_out = csdb.add_to_page_out(temp_page_out_key, lookup_key, resolution, morton, time_sample)
+        assert in_page_out
+
     def test_remove_from_page_out(self):
         """Test removing a cube from the page out list"""
         csdb = CacheStateDB(self.config_data)
@@ -97,6 +147,153 @@ class CacheStateDBTestMixin(object):
         csdb.remove_from_page_out("WRITE-CUBOID&{}&{}&{}&{}&adsf34adsf49sdfj".format(lookup_key, resolution, time_sample, morton))
         assert not csdb.in_page_out(temp_page_out_key, lookup_key, resolution, morton, time_sample)
 
+        in_page_out = csdb.add_to_page_out(temp_page_out_key, lookup_key, resolution, morton, time_sample)
+        assert not in_page_out
+
+    def test_cuboid_clean_channel(self):
+        """Test cached-cuboid and write-cuboid keys for the same cuboid map to the same channel"""
+        csdb = CacheStateDB(self.config_data)
+
+        assert csdb.cuboid_clean_channel("CACHED-CUBOID&1&2&3&4&5&66") == "CUBOID-CLEAN&1&2&3&4"
+        assert csdb.cuboid_clean_channel("WRITE-CUBOID&1&2&3&4&5&66&daadsfjk") == "CUBOID-CLEAN&1&2&3&4"
+        assert csdb.cuboid_clean_channel("CACHED-CUBOID&ISO&1&2&3&4&5&66") == "CUBOID-CLEAN&ISO&1&2&3&4"
+        assert csdb.cuboid_clean_channel("WRITE-CUBOID&ISO&1&2&3&4&5&66&daadsfjk") == "CUBOID-CLEAN&ISO&1&2&3&4"
+
+    def test_notify_cuboid_clean(self):
+        """Test a cuboid clean event is published when a cube is removed from page out"""
+        csdb = CacheStateDB(self.config_data)
+
+        with patch.object(self.state_client, 'publish') as fake_publish:
+            csdb.remove_from_page_out("WRITE-CUBOID&1&2&3&4&5&66&daadsfjk")
+
+        fake_publish.assert_called_once_with("CUBOID-CLEAN&1&2&3&4", "5&66")
+
+    def test_wait_for_page_in(self):
+        """Test waiting for page in accepts both single key and batch completion messages"""
+        csdb = CacheStateDB(self.config_data)
+        channel = "PAGE-IN-CHANNEL&abc"
+        keys = ["CACHED-CUBOID&1&1&1&0&0&{}".format(x) for x in range(4)]
+
+        listener = MagicMock()
+        listener.get_message.side_effect = [
+            None,
+            {"channel": channel.encode(), "type": "subscribe", "data": 1},
+            {"channel": channel.encode(), "type": "message", "data": keys[0].encode()},
+            {"channel": channel.encode(), "type": "message", "data": json.dumps(keys[1:]).encode()},
+        ]
+
+        with patch.object(csdb, 'delete_page_in_channel') as fake_delete:
+            csdb.wait_for_page_in(keys, channel, listener, 5)
+
+        assert listener.get_message.call_count == 4
+        fake_delete.assert_called_once_with(channel, listener)
+
+    def test_iter_page_in(self):
+        """Test keys are yielded as each page in completion message arrives, blocking between messages"""
+        csdb = CacheStateDB(self.config_data)
+        channel = "PAGE-IN-CHANNEL&abc"
+        keys = ["CACHED-CUBOID&1&1&1&0&0&{}".format(x) for x in range(4)]
+
+        listener = MagicMock()
+        listener.get_message.side_effect = [
+            {"channel": channel.encode(), "type": "message", "data": json.dumps(keys[:2]).encode()},
+            None,
+            {"channel": channel.encode(), "type": "message", "data": keys[2].encode()},
+            {"channel": channel.encode(), "type": "message", "data": json.dumps(keys[1:]).encode()},
+        ]
+
+        assert list(csdb.iter_page_in(keys, channel, listener, 5)) == [keys[:2], [keys[2]], [keys[3]]]
+        for c in listener.get_message.call_args_list:
+            assert 0 < c[1]["timeout"] <= 5
+
+    def test_iter_page_in_timeout(self):
+        """Test an error is raised if keys are not paged in before the timeout"""
+        csdb = CacheStateDB(self.config_data)
+        listener = MagicMock()
+        listener.get_message.return_value = None
+
+        with self.assertRaises(SpdbError):
+            list(csdb.iter_page_in(["CACHED-CUBOID&1&1&1&0&0&0"], "PAGE-IN-CHANNEL&abc", listener, 0.1))
+
+    def test_iter_page_in_deadline(self):
+        """Test an empty list is yielded once the deadline passes with keys still missing"""
+        csdb = CacheStateDB(self.config_data)
+        channel = "PAGE-IN-CHANNEL&abc"
+        keys = ["CACHED-CUBOID&1&1&1&0&0&0", "CACHED-CUBOID&1&1&1&0&0&1"]
+
+        messages = [{"channel": channel.encode(), "type": "message", "data": keys[0].encode()}]
+
+        def get_message(timeout=0.0):
+            if messages:
+                return messages.pop(0)
+            time.sleep(timeout)
+            return None
+
+        listener = MagicMock()
+        listener.get_message.side_effect = get_message
+
+        pages = csdb.iter_page_in(keys, channel, listener, 5, time.time() + 0.1)
+        assert next(pages) == [keys[0]]
+        assert next(pages) == []
+        for c in listener.get_message.call_args_list:
+            assert c[1]["timeout"] <= 0.1
+
+    def test_create_page_in_channel(self):
+        """Test each page in channel gets its own listener"""
+        csdb = CacheStateDB(self.config_data)
+
+        with patch.object(self.state_client, 'pubsub', side_effect=[MagicMock(), MagicMock()], create=True):
+            channel1, listener1 = csdb.create_page_in_channel()
+            channel2, listener2 = csdb.create_page_in_channel()
+
+        assert channel1 != channel2
+        assert listener1 is not listener2
+        listener1.subscribe.assert_called_once_with(channel1)
+        listener2.subscribe.assert_called_once_with(channel2)
+
+        csdb.delete_page_in_channel(channel1, listener1)
+        listener1.unsubscribe.assert_called_once_with(channel1)
+        listener1.close.assert_called_once_with()
+        assert not listener2.close.called
+
+    def test_notify_page_in_batch_complete(self):
+        """Test a single message is published for a batch of paged in keys"""
+        csdb = CacheStateDB(self.config_data)
+        keys = ["CACHED-CUBOID&1&1&1&0&0&0", "CACHED-CUBOID&1&1&1&0&0&1"]
+
+        with patch.object(self.state_client, 'publish') as fake_publish:
+            csdb.notify_page_in_batch_complete("PAGE-IN-CHANNEL&abc", keys)
+
+        fake_publish.assert_called_once_with("PAGE-IN-CHANNEL&abc", json.dumps(keys))
+
+    def test_add_to_page_out_batch(self):
+        """Test adding multiple cubes to page out at once"""
+        csdb = CacheStateDB(self.config_data)
+
+        lookup_key = "1&2&3"
+        resolution = 4
+        assert csdb.add_to_page_out_batch(lookup_key, resolution, [(0, 10), (1, 10)]) == [False, False]
+        assert csdb.add_to_page_out_batch(lookup_key, resolution, [(0, 11), (1, 10), (0, 10)]) == [False, True, True]
+
+        csdb.remove_from_page_out("WRITE-CUBOID&{}&{}&{}&{}&abc".format(lookup_key, resolution, 1, 10))
+        assert csdb.add_to_page_out_batch(lookup_key, resolution, [(1, 10)]) == [False]
+
+    def test_add_to_delayed_write_batch(self):
+        """Test adding multiple cubes to delayed write at once"""
+        csdb = CacheStateDB(self.config_data)
+
+        lookup_key = "1&2&3"
+        resolution = 4
+        write_cuboid_keys = ["WRITE-CUBOID&{}&{}&5&66&abc".format(lookup_key, resolution),
+                             "WRITE-CUBOID&{}&{}&5&67&def".format(lookup_key, resolution)]
+
+        csdb.add_to_delayed_write_batch(write_cuboid_keys, lookup_key, resolution, [(5, 66), (5, 67)], "{resource}")
+
+        keys = sorted(csdb.get_all_delayed_write_keys())
+        assert keys == ["DELAYED-WRITE&{}&{}&5&66".format(lookup_key, resolution),
+                        "DELAYED-WRITE&{}&{}&5&67".format(lookup_key, resolution)]
+        assert csdb.get_single_delayed_write(keys[1]) == (write_cuboid_keys[1], "{resource}")
+
     def test_add_to_delayed_write(self):
         """Test if a cube is in delayed write"""
         csdb = CacheStateDB(self.config_data)
@@ -250,6 +447,7 @@ class TestCacheStateDB(CacheStateDBTestMixin, unittest.TestCase):
         self.mock_tests = self.patcher.start()
 
         self.state_client.flushdb()
+        CacheStateDB.clear_lock_cache()
 
     def tearDown(self):
         self.mock_tests = self.patcher.stop()